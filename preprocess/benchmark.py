@@ -0,0 +1,646 @@
+"""
+Benchmarks for the preprocessing code in gpx2czml.py.
+
+    python3 preprocess/benchmark.py reader [--points N]
+    python3 preprocess/benchmark.py tcx [--points N]
+    python3 preprocess/benchmark.py smooth [--points N]
+    python3 preprocess/benchmark.py stats [--points N]
+    python3 preprocess/benchmark.py coordinates [--points N]
+    python3 preprocess/benchmark.py camera [--points N] [--tracks N]
+    python3 preprocess/benchmark.py store [--points N] [--tracks N] [--overlap]
+    python3 preprocess/benchmark.py pipeline [--tracks N] [--points N] [--tcx N] [--photo-dirs N] [--photos N]
+    python3 preprocess/benchmark.py history
+
+The pipeline benchmark appends its results to a history file, together with the git commit, and compares
+them with the previous run with the same dataset size, so regressions between commits are visible.
+"""
+import argparse
+import configparser
+import contextlib
+import csv
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import gpxpy
+import gpxpy.gpx
+import numpy as np
+import pandas as pd
+
+import gpx2czml
+from gpx2czml import create_coordinate_list, create_photo_markers, create_tracking_entity, create_tracking_path, \
+    interpolate_photo_coordinates, interpolate_track, load_tracks, process_photos, process_track
+from czmlwriter import CzmlWriter
+from gpxreader import read_gpx, read_gpx_arrays, track_dataframe
+from intervals import IgnoreIntervals
+from profiler import peak_rss
+from tcx2gpx import read_tcx_arrays
+from tcxparser import TCXParser
+from tracksmooth import smooth_track
+from trackstats import track_statistics
+from trackstore import combine_tracks, write_track_store
+
+SYNTHETIC_START = datetime(2019, 10, 15, 7, 0, tzinfo=timezone.utc)
+POINT_INTERVAL = 5 # seconds between synthetic track points
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.benchmark_history.jsonl')
+
+# Position (latitude, longitude, elevation) of point i of synthetic track seed, without noise
+def synthetic_position(i, seed=0):
+    phase = (i + seed) / 500
+    return (44.0 + i * 0.00005 + 0.001 * math.sin(phase),
+            7.6 + i * 0.00003 + 0.001 * math.cos(phase),
+            700 + 100 * math.sin(phase / 3))
+
+# Yields (latitude, longitude, elevation, time) of the points of a synthetic track, one point every 5 seconds.
+# With noise, GPS jitter and occasional outliers are added, as found in real tracks.
+def synthetic_points(point_count, seed=0, noise=False, start=SYNTHETIC_START):
+    rng = random.Random(seed)
+    for i in range(point_count):
+        lat, lon, ele = synthetic_position(i, seed)
+        if noise:
+            lat += rng.gauss(0, 0.00002) + (0.002 if rng.random() < 0.005 else 0)
+            lon += rng.gauss(0, 0.00002)
+            ele += rng.gauss(0, 2) + (50 if rng.random() < 0.005 else 0)
+        yield lat, lon, ele, start + timedelta(seconds=POINT_INTERVAL * i)
+
+# Writes a gpx file with a single synthetic track of point_count points (see synthetic_points)
+def write_synthetic_gpx(path, point_count, seed=0, noise=False, start=SYNTHETIC_START):
+    with open(path, 'w') as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        outfile.write('<gpx version="1.1" creator="benchmark" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        outfile.write('<trk><name>synthetic</name><trkseg>\n')
+        for lat, lon, ele, t in synthetic_points(point_count, seed, noise, start):
+            t = t.strftime('%Y-%m-%dT%H:%M:%SZ')
+            outfile.write(f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><ele>{ele:.1f}</ele><time>{t}</time></trkpt>\n')
+        outfile.write('</trkseg></trk></gpx>\n')
+
+# Writes a tcx file (as exported by Garmin devices) with a single synthetic track of point_count points
+def write_synthetic_tcx(path, point_count, seed=0, noise=False, start=SYNTHETIC_START):
+    start_time = start.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    with open(path, 'w') as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        outfile.write('<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">\n')
+        outfile.write(f'<Activities><Activity Sport="Biking"><Id>{start_time}</Id><Lap StartTime="{start_time}">\n')
+        outfile.write(f'<TotalTimeSeconds>{POINT_INTERVAL * point_count}</TotalTimeSeconds><Track>\n')
+        for lat, lon, ele, t in synthetic_points(point_count, seed, noise, start):
+            t = t.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            outfile.write(f'<Trackpoint><Time>{t}</Time><Position><LatitudeDegrees>{lat:.7f}</LatitudeDegrees>'
+                          f'<LongitudeDegrees>{lon:.7f}</LongitudeDegrees></Position>'
+                          f'<AltitudeMeters>{ele:.1f}</AltitudeMeters></Trackpoint>\n')
+        outfile.write('</Track></Lap></Activity></Activities></TrainingCenterDatabase>\n')
+
+# Writes a synthetic dataset to data_dir/key, like a real one but with photos.csv files instead of photos
+# (the photo files are empty, their EXIF data is imported from photos.csv instead of running exiftool):
+# - track_count tracks of point_count points, one per day, of which the first tcx_count are tcx files
+# - photo_dir_count photo directories of photo_count photos, taken along the tracks or in the gaps between them,
+#   with EXIF coordinates for some of them (including duplicates), and some without date/time
+# - manual coordinates and ignored EXIF coordinates in the photo directory configs, and ignore_gpx_intervals
+# Returns the photo directory names.
+def write_synthetic_dataset(data_dir, key, track_count, point_count, tcx_count=0, photo_dir_count=1, photo_count=1000, seed=0):
+    dataset_dir = os.path.join(data_dir, key)
+    tracks_dir = os.path.join(dataset_dir, 'tracks')
+    os.makedirs(tracks_dir)
+    with open(os.path.join(tracks_dir, 'config.cfg'), 'w') as outfile:
+        outfile.write('[global]\nattribution=Benchmark\n')
+    track_starts = [SYNTHETIC_START + timedelta(days=index) for index in range(track_count)]
+    for index, start in enumerate(track_starts):
+        if index < tcx_count:
+            write_synthetic_tcx(os.path.join(tracks_dir, f'track{index:04d}.tcx'), point_count, index, True, start)
+        else:
+            write_synthetic_gpx(os.path.join(tracks_dir, f'track{index:04d}.gpx'), point_count, index, True, start)
+
+    dir_names = [f'dir{index}' for index in range(photo_dir_count)]
+    track_duration = POINT_INTERVAL * point_count
+    intervals = []
+    for dir_index, dir_name in enumerate(dir_names):
+        rng = random.Random(seed * 1000 + dir_index)
+        photo_dir = os.path.join(dataset_dir, 'photos', dir_name)
+        os.makedirs(photo_dir)
+        rows = []
+        gps = None
+        for index in range(photo_count):
+            filename = f'IMG_{index:05d}.jpg'
+            open(os.path.join(photo_dir, filename), 'w').close()
+            track = rng.randrange(track_count)
+            point = rng.randrange(point_count)
+            time = track_starts[track] + timedelta(seconds=POINT_INTERVAL * point)
+            if rng.random() < 0.05:
+                # In the gap after a track, to be interpolated between photos
+                time = track_starts[track] + timedelta(seconds=track_duration + rng.randrange(3600))
+            if rng.random() < 0.4:
+                # Repeat the previous coordinates now and then, as some cameras do without a GPS fix
+                if gps is None or rng.random() > 0.05:
+                    lat, lon, ele = synthetic_position(point, track)
+                    gps = (f'{lat + rng.gauss(0, 0.0001):.6f}', f'{lon + rng.gauss(0, 0.0001):.6f}', f'{ele:.1f}')
+                lat, lon, ele = gps
+            else:
+                lat, lon, ele = '-', '-', '-'
+            # Local time, two hours ahead of UTC
+            date_time = '-' if rng.random() < 0.01 else (time + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S') + '+0200'
+            rows.append([f'data/{key}/photos/{dir_name}/{filename}', filename, lat, lon, ele, '-', '-', date_time, date_time])
+        with open(os.path.join(photo_dir, 'photos.csv'), 'w', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(['SourceFile', 'FileName', 'GPSLatitude#', 'GPSLongitude#', 'GPSAltitude#',
+                             'GPSDateStamp', 'GPSTimeStamp', 'DateTimeOriginal', 'CreateDate'])
+            writer.writerows(rows)
+
+        with open(os.path.join(photo_dir, 'config.cfg'), 'w') as outfile:
+            with_gps = [row[1] for row in rows if row[2] != '-']
+            outfile.write(f'[global]\nattribution={dir_name}\nignore_duplicate_exif_coords=True\n')
+            outfile.write(f'ignore_exif={",".join(with_gps[:5])}\n')
+            outfile.write('[manual_coords]\n')
+            for row in rows[::100]:
+                lat, lon, ele = synthetic_position(rng.randrange(point_count))
+                outfile.write(f'{row[1]}={lon:.6f},{lat:.6f},{ele:.0f}\n')
+
+        # Ignore the tracks for an hour of the first track
+        interval_start = track_starts[0] + timedelta(seconds=track_duration / 2)
+        intervals.append(f'{dir_name}_interval={interval_start.isoformat()},'
+                         f'{(interval_start + timedelta(hours=1)).isoformat()},{dir_name}')
+
+    with open(os.path.join(dataset_dir, 'config.cfg'), 'w') as outfile:
+        outfile.write('[resize]\nenabled=False\n')
+        outfile.write('[ignore_gpx_intervals]\n' + ''.join(interval + '\n' for interval in intervals))
+    return dir_names
+
+# Returns the best wall-clock time in seconds of `repeat` calls and the result of the last call
+def timeit(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+# Calls func with its output (progress messages) suppressed
+def quiet(func):
+    def quiet_func():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+    return quiet_func
+
+def report(name, seconds, baseline=None):
+    speedup = f' ({baseline / seconds:.1f}x)' if baseline else ''
+    print(f'  {name:<30} {seconds * 1000:10.1f} ms{speedup}')
+
+# Returns the short hash of the current git commit (None outside a git repository), and whether there are uncommitted changes
+def git_commit():
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=code_dir,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode('utf-8').strip()
+    dirty = subprocess.call(['git', 'diff-index', '--quiet', 'HEAD'], cwd=code_dir, stderr=subprocess.DEVNULL) != 0
+    return sha or None, dirty
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as infile:
+        return [json.loads(line) for line in infile if line.strip() != '']
+
+# Appends the results of a benchmark run to the history file.
+# Returns the previous entry of the same benchmark with the same parameters, None if there is none.
+def record_history(path, benchmark, params, results):
+    previous = [entry for entry in read_history(path) if entry['benchmark'] == benchmark and entry['params'] == params]
+    sha, dirty = git_commit()
+    entry = {
+        'benchmark': benchmark,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': sha,
+        'dirty': dirty,
+        'params': params,
+        'versions': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__},
+        'results': {name: round(seconds, 6) for name, seconds in results.items()}
+    }
+    with open(path, 'a') as outfile:
+        outfile.write(json.dumps(entry) + '\n')
+    return previous[-1] if len(previous) > 0 else None
+
+def commit_label(entry):
+    return (entry['commit'] or 'unknown') + ('+' if entry['dirty'] else '')
+
+# The original reader, as the reference: the points of a gpxpy tree in python lists
+def gpx_to_dataframe(gpx):
+    lats = []
+    lons = []
+    elevations = []
+    times = []
+    timestamps = []
+
+    for track in gpx.tracks:
+        for segment in track.segments:
+            for point in segment.points:
+                lats.append(point.latitude)
+                lons.append(point.longitude)
+                elevations.append(point.elevation)
+                times.append(point.time)
+                timestamps.append(point.time.timestamp() if not point.time is None else None)
+
+    output = pd.DataFrame()
+    output['latitude'] = lats
+    output['longitude'] = lons
+    output['elevation'] = elevations
+    output['time'] = times
+    output['timestamp'] = timestamps
+    
+    # Mark first and last rows as boundaries
+    output['boundary'] = [0] * len(lats)
+    output.loc[0, 'boundary'] = 1
+    output.loc[output.index[-1], 'boundary'] = 1
+
+    output.sort_values('time', inplace=True)
+    output.reset_index(drop=True, inplace=True)
+    return output
+
+# Converts a dataframe of gpx_to_dataframe to the column types of gpxreader.track_dataframe, to compare them:
+# UTC times with nanoseconds, floats with NaN for missing values
+def normalize_track_dataframe(df):
+    output = df.copy()
+    output['elevation'] = output['elevation'].astype(np.float64)
+    output['time'] = pd.to_datetime(output['time'], utc=True).astype('datetime64[ns, UTC]')
+    output['timestamp'] = output['timestamp'].astype(np.float64)
+    output['boundary'] = output['boundary'].astype(np.int64)
+    return output
+
+def bench_reader(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'track.gpx')
+        write_synthetic_gpx(path, args.points)
+        print(f'Reading a gpx track of {args.points} points')
+
+        def gpxpy_path():
+            with open(path, 'r') as gpx_file:
+                return gpx_to_dataframe(gpxpy.parse(gpx_file))
+
+        gpxpy_time, _ = timeit(gpxpy_path, args.repeat)
+        reader_time, _ = timeit(lambda: read_gpx(path), args.repeat)
+        report('gpxpy.parse + gpx_to_dataframe', gpxpy_time)
+        report('read_gpx', reader_time, gpxpy_time)
+
+# The previous tcx path, as a baseline: parse with tcxparser, build a gpxpy tree, write it as gpx and read that
+def read_tcx_via_gpx(tcx_path):
+    tcx = TCXParser(tcx_path)
+    gpx = gpxpy.gpx.GPX()
+    track = gpxpy.gpx.GPXTrack()
+    gpx.tracks.append(track)
+    segment = gpxpy.gpx.GPXTrackSegment()
+    track.segments.append(segment)
+    for (lat, lon), elevation, time_value in zip(tcx.position_values(), tcx.altitude_points(), tcx.time_values()):
+        segment.points.append(gpxpy.gpx.GPXTrackPoint(latitude=lat, longitude=lon, elevation=elevation,
+                                                      time=datetime.strptime(time_value, '%Y-%m-%dT%H:%M:%S.%f%z')))
+    gpx_path = tcx_path[:-4] + '.gpx'
+    with open(gpx_path, 'w', encoding='utf8') as outfile:
+        outfile.write(gpx.to_xml())
+    return read_gpx(gpx_path)
+
+def read_tcx(tcx_path):
+    lats, lons, elevations, epochs, _ = read_tcx_arrays(tcx_path)
+    return track_dataframe(lats, lons, elevations, epochs)
+
+def measure_peak_memory(func, *args):
+    before = peak_rss()
+    func(*args)
+    return peak_rss() - before
+
+# Returns how much func(*args) increases the peak memory use (MB), measured in a fresh process.
+# On Linux the peak is inherited from the parent process, so measure before the parent itself uses a lot of memory.
+def peak_memory(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(measure_peak_memory, func, *args).result()
+
+def bench_tcx(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'track.tcx')
+        write_synthetic_tcx(path, args.points, noise=True)
+        print(f'Reading a tcx track of {args.points} points')
+
+        baseline_memory = peak_memory(read_tcx_via_gpx, path)
+        reader_memory = peak_memory(read_tcx, path)
+        baseline_time, _ = timeit(lambda: read_tcx_via_gpx(path), args.repeat)
+        reader_time, _ = timeit(lambda: read_tcx(path), args.repeat)
+        report('tcxparser + gpxpy + read_gpx', baseline_time)
+        report('read_tcx_arrays', reader_time, baseline_time)
+        if not baseline_memory is None:
+            print(f'  Peak memory increase: {baseline_memory:.1f} MB, read_tcx_arrays {reader_memory:.1f} MB '
+                  f'({baseline_memory / max(reader_memory, 0.1):.1f}x less)')
+
+def bench_smooth(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'track.gpx')
+        write_synthetic_gpx(path, args.points, noise=True)
+        print(f'Smoothing and simplifying a gpx track of {args.points} points ({args.iterations} iterations)')
+
+        def gpxpy_path():
+            with open(path, 'r') as gpx_file:
+                gpx = gpxpy.parse(gpx_file)
+            start = time.perf_counter()
+            for i in range(args.iterations):
+                gpx.smooth(vertical=True, horizontal=True, remove_extremes=True)
+            gpx.simplify(max_distance=args.tolerance)
+            return time.perf_counter() - start, normalize_track_dataframe(gpx_to_dataframe(gpx))
+
+        lats, lons, elevations, _, segments = read_gpx_arrays(path)
+        def numpy_path(algorithm):
+            return smooth_track(lats, lons, elevations, segments, args.iterations, args.tolerance, algorithm)
+
+        # Only time the smoothing itself, not the parsing
+        gpxpy_time = None
+        for _ in range(args.repeat):
+            elapsed, expected = gpxpy_path()
+            gpxpy_time = elapsed if gpxpy_time is None else min(gpxpy_time, elapsed)
+        rdp_time, keep = timeit(lambda: numpy_path('rdp'), args.repeat)
+        visvalingam_time, keep_visvalingam = timeit(lambda: numpy_path('visvalingam'), args.repeat)
+        report('gpxpy smooth + simplify', gpxpy_time)
+        report('smooth_track (rdp)', rdp_time, gpxpy_time)
+        report('smooth_track (visvalingam)', visvalingam_time, gpxpy_time)
+        print(f'  Points kept: gpxpy {expected.shape[0]}, rdp {np.count_nonzero(keep)}, visvalingam {np.count_nonzero(keep_visvalingam)}')
+
+# The previous metadata of load_track, as a baseline: build a gpxpy tree from the point arrays and use its statistics.
+# Missing elevations and times are None, as in a parsed gpx file.
+def gpxpy_statistics(lats, lons, elevations, epochs, segments):
+    gpx = gpxpy.gpx.GPX()
+    gpx_track = gpxpy.gpx.GPXTrack()
+    gpx.tracks.append(gpx_track)
+    elevations = [None if np.isnan(elevation) else elevation for elevation in elevations]
+    times = [None if pd.isna(t) else t for t in pd.to_datetime(epochs, utc=True).to_pydatetime()]
+    bounds = list(segments) + [len(lats)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        gpx_segment = gpxpy.gpx.GPXTrackSegment()
+        gpx_track.segments.append(gpx_segment)
+        for i in range(start, stop):
+            gpx_segment.points.append(gpxpy.gpx.GPXTrackPoint(latitude=lats[i], longitude=lons[i],
+                                                              elevation=elevations[i], time=times[i]))
+    minmax = gpx.get_elevation_extremes()
+    time_bounds = gpx.get_time_bounds()
+    updown_elevation = gpx.get_uphill_downhill()
+    return {
+        "start_time": time_bounds.start_time.isoformat(),
+        "end_time": time_bounds.end_time.isoformat(),
+        "duration": gpx.get_duration(),
+        "length_2d": gpx.length_2d(),
+        "ascent": updown_elevation.uphill,
+        "descent": updown_elevation.downhill,
+        "min_elevation": minmax.minimum,
+        "max_elevation": minmax.maximum
+    }
+
+def bench_stats(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'track.gpx')
+        write_synthetic_gpx(path, args.points, noise=True)
+        print(f'Track statistics of a gpx track of {args.points} points')
+        lats, lons, elevations, epochs, segments = read_gpx_arrays(path)
+
+        gpxpy_time, _ = timeit(lambda: gpxpy_statistics(lats, lons, elevations, epochs, segments), args.repeat)
+        stats_time, _ = timeit(lambda: track_statistics(lats, lons, elevations, epochs, segments), args.repeat)
+        report('gpxpy', gpxpy_time)
+        report('track_statistics', stats_time, gpxpy_time)
+
+# The original row by row implementation of create_coordinate_list, as a baseline
+def create_coordinate_list_iloc(df_input, includeTimestep=True):
+    results = []
+    start_timestamp = min(df_input['timestamp']) if includeTimestep else None
+    for i in df_input.index:
+        if includeTimestep:
+            timestamp = df_input.timestamp.iloc[i]
+            results.append(timestamp - start_timestamp)
+        results.append(df_input.longitude.iloc[i])
+        results.append(df_input.latitude.iloc[i])
+        results.append(df_input.elevation.iloc[i])
+    return results
+
+def bench_coordinates(args):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'latitude': 44.0 + np.cumsum(rng.normal(0, 0.00005, args.points)),
+        'longitude': 7.6 + np.cumsum(rng.normal(0, 0.00005, args.points)),
+        'elevation': 700 + np.cumsum(rng.normal(0, 0.5, args.points)),
+        'timestamp': 1571122800.0 + 5 * np.arange(args.points),
+    })
+    print(f'Serializing the coordinates of a track of {args.points} points (with time offsets)')
+
+    # The row by row baseline is too slow for large tracks, time it on a prefix and extrapolate
+    baseline_points = min(args.points, args.baseline_points)
+    baseline_df = df.iloc[:baseline_points]
+    baseline_time, _ = timeit(lambda: create_coordinate_list_iloc(baseline_df), 1)
+    baseline_time *= args.points / baseline_points
+    array_time, _ = timeit(lambda: create_coordinate_list(df), args.repeat)
+    rounded_time, _ = timeit(lambda: create_coordinate_list(df, precision={'coordinates': 6, 'elevation': 1, 'time': 0}), args.repeat)
+    extrapolated = ' (extrapolated)' if baseline_points < args.points else ''
+    report('iloc loop' + extrapolated, baseline_time)
+    report('create_coordinate_list', array_time, baseline_time)
+    report('create_coordinate_list rounded', rounded_time, baseline_time)
+
+# The previous combined tracks: a dataframe of all track points, sorted by time
+def get_combined_tracks(tracks):
+    combined_tracks = pd.concat(tracks)
+    combined_tracks.sort_values('time', inplace=True)
+    combined_tracks.reset_index(drop=True, inplace=True)
+    return combined_tracks
+
+# The previous pandas implementation of the camera path smoothing (with UTC times), as a baseline
+def create_tracking_path_pandas(track_dfs):
+    SMOOTHING_WINDOW_SIZE = 100
+    smoothed_tracks = []
+    for track in track_dfs:
+        padding_before = pd.DataFrame([track.iloc[0].copy()] * (int(SMOOTHING_WINDOW_SIZE / 2) + 1))
+        padding_after = pd.DataFrame([track.iloc[-1].copy()] * (int(SMOOTHING_WINDOW_SIZE / 2) + 1))
+        padded_track = get_combined_tracks([padding_before, track, padding_after])
+        for column in ['longitude', 'latitude', 'elevation', 'timestamp']:
+            padded_track[column] = padded_track[column].rolling(SMOOTHING_WINDOW_SIZE, 1, True).mean()
+        padded_track['time'] = padded_track['timestamp'].apply(lambda timestamp: datetime.fromtimestamp(timestamp, timezone.utc))
+        smoothed_tracks.append(padded_track)
+    return get_combined_tracks(smoothed_tracks)
+
+# Returns track_count track dataframes with point_count points in total. Consecutive tracks are an hour apart,
+# or overlap by half their duration.
+def synthetic_tracks(track_count, point_count, overlap=False):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tracks = []
+        point_count = point_count // track_count
+        for seed in range(track_count):
+            path = os.path.join(tmp_dir, f'track{seed}.gpx')
+            write_synthetic_gpx(path, point_count, seed=seed, noise=True)
+            track = read_gpx(path)
+            offset = seed * (point_count * POINT_INTERVAL // 2 if overlap else point_count * POINT_INTERVAL + 3600)
+            track['timestamp'] += offset
+            track['time'] += pd.Timedelta(seconds=offset)
+            tracks.append(track)
+    return tracks
+
+def bench_camera(args):
+    tracks = synthetic_tracks(args.tracks, args.points)
+    print(f'Smoothing the camera path of {args.tracks} tracks, {args.points} points in total')
+
+    combined_tracks = combine_tracks(tracks)
+    pandas_time, expected = timeit(lambda: create_tracking_path_pandas(tracks), args.repeat)
+    array_time, actual = timeit(lambda: create_tracking_path(combined_tracks), args.repeat)
+    gaussian_time, _ = timeit(lambda: create_tracking_path(combined_tracks, smoothing_filter='gaussian'), args.repeat)
+    resampled_time, resampled = timeit(lambda: create_tracking_path(combined_tracks, resample=30), args.repeat)
+    report('pandas rolling', pandas_time)
+    report('create_tracking_path', array_time, pandas_time)
+    report('create_tracking_path gaussian', gaussian_time, pandas_time)
+    report('create_tracking_path resampled', resampled_time, pandas_time)
+    print(f'  Samples: {actual.shape[0]}, resampled every 30 s: {resampled.shape[0]}')
+    columns = ['longitude', 'latitude', 'elevation', 'timestamp']
+    max_difference = np.abs(expected[columns].to_numpy() - actual[columns].to_numpy()).max()
+    print(f'  Maximum difference with pandas rolling: {max_difference:.2g}')
+
+def bench_store(args):
+    tracks = synthetic_tracks(args.tracks, args.points, args.overlap)
+    print(f'Combining {args.tracks} {"overlapping " if args.overlap else ""}tracks, {args.points} points in total')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'combined_tracks.bin')
+        pandas_time, _ = timeit(lambda: get_combined_tracks(tracks), args.repeat)
+        store_time, store = timeit(lambda: write_track_store(path, tracks), args.repeat)
+        report('pandas concat + sort', pandas_time)
+        report('write_track_store', store_time, pandas_time)
+
+        # Points with the same time are in track order in the store, the previous sort didn't keep their order
+        expected = pd.concat(tracks).sort_values('time', kind='stable').reset_index(drop=True)
+        # Photo positions along the tracks
+        timestamps = np.random.default_rng(0).uniform(expected['timestamp'].min(), expected['timestamp'].max(), 10000)
+        expected_positions = interpolate_track(
+            {column: expected[column].to_numpy() for column in ['timestamp', 'boundary', 'longitude', 'latitude', 'elevation']},
+            timestamps)
+        positions = interpolate_track(store, timestamps)
+        frame_size = expected.memory_usage(deep=True).sum()
+        print(f'  Size: dataframe {frame_size / 1e6:.1f} MB, store file {os.path.getsize(path) / 1e6:.1f} MB')
+        for column in ['latitude', 'longitude', 'elevation', 'timestamp', 'boundary']:
+            assert np.array_equal(expected[column].to_numpy(), store[column], equal_nan=True)
+        assert np.array_equal(expected['time'].values.view(np.int64), store['epoch'])
+        for expected_values, values in zip(expected_positions, positions):
+            assert np.array_equal(expected_values, values, equal_nan=True)
+        print('  Output is identical')
+
+def bench_pipeline(args):
+    params = {'tracks': args.tracks, 'points': args.points, 'tcx': args.tcx, 'photo_dirs': args.photo_dirs,
+              'photos': args.photos, 'jobs': args.jobs, 'seed': args.seed}
+    with tempfile.TemporaryDirectory() as data_dir:
+        key = 'benchmark'
+        dir_names = write_synthetic_dataset(data_dir, key, args.tracks, args.points, args.tcx, args.photo_dirs, args.photos, args.seed)
+        print(f'Preprocessing {args.tracks} tracks ({args.tcx} tcx) of {args.points} points, '
+              f'{args.photo_dirs} photo directories of {args.photos} photos')
+        # get_datadir() reads the dataset location from the environment and the parsed arguments
+        os.environ['DATA_DIR'] = data_dir
+        gpx2czml.args = argparse.Namespace(key=key)
+        dataset_dir = os.path.join(data_dir, key)
+        tracks_dir = os.path.join(dataset_dir, 'tracks')
+        global_config = configparser.RawConfigParser()
+        global_config.read(os.path.join(dataset_dir, 'config.cfg'))
+
+        def run_load_tracks():
+            # Remove any gpx files exported from tcx in a previous run, so the tcx files are read every run
+            for index in range(args.tcx):
+                converted_path = os.path.join(tracks_dir, f'track{index:04d}.gpx')
+                if os.path.exists(converted_path):
+                    os.remove(converted_path)
+            return load_tracks(tracks_dir, args.jobs)
+
+        results = {}
+        results['load_tracks'], track_tuples = timeit(quiet(run_load_tracks), args.repeat)
+        tracks = [track_tuple[0] for track_tuple in track_tuples]
+        combined_tracks = write_track_store(os.path.join(dataset_dir, gpx2czml.TRACK_STORE), tracks)
+        ignore_intervals = IgnoreIntervals(global_config)
+
+        results['process_photos'], photo_dfs = timeit(quiet(
+            lambda: [process_photos(dir_name, combined_tracks, ignore_intervals) for dir_name in dir_names]), args.repeat)
+        all_photos = pd.concat(photo_dfs)
+        results['interpolate_photo_coordinates'], _ = timeit(quiet(
+            lambda: interpolate_photo_coordinates(all_photos.copy(), ignore_intervals, combined_tracks)), args.repeat)
+        quiet(lambda: interpolate_photo_coordinates(all_photos, ignore_intervals, combined_tracks))()
+        results['create_tracking_entity'], tracking_entity = timeit(
+            lambda: create_tracking_entity('track_entity', create_tracking_path(combined_tracks)), args.repeat)
+
+        def write_czml():
+            with CzmlWriter(os.path.join(dataset_dir, 'combined.czml')) as czml:
+                for index, track_tuple in enumerate(track_tuples):
+                    process_track(track_tuple, czml, index)
+                create_photo_markers(all_photos, czml)
+                czml.append(tracking_entity)
+        results['write_czml'], _ = timeit(quiet(write_czml), args.repeat)
+
+    previous = record_history(args.history, 'pipeline', params, results) if args.history != '' else None
+    for name, seconds in results.items():
+        change = ''
+        if not previous is None and name in previous['results']:
+            percentage = (seconds / previous['results'][name] - 1) * 100
+            flag = '  <- slower' if percentage > args.threshold else ''
+            change = f' ({percentage:+.0f}% vs {commit_label(previous)}){flag}'
+        print(f'  {name:<30} {seconds * 1000:10.1f} ms{change}')
+    if args.history != '':
+        print(f'Results added to {args.history}')
+
+def bench_history(args):
+    groups = {}
+    for entry in read_history(args.history):
+        groups.setdefault((entry['benchmark'], json.dumps(entry['params'], sort_keys=True)), []).append(entry)
+    if len(groups) == 0:
+        print(f'No results in {args.history}')
+    for (benchmark, params), entries in groups.items():
+        names = list(entries[-1]['results'])
+        print(f'{benchmark} {params}')
+        print(f'  {"date":<20} {"commit":<12}' + ''.join(f' {name[:14]:>14}' for name in names) + '  (ms)')
+        for entry in entries:
+            times = [f'{entry["results"][name] * 1000:14.1f}' if name in entry['results'] else f'{"-":>14}' for name in names]
+            print(f'  {entry["date"]:<20} {commit_label(entry):<12} ' + ' '.join(times))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks for gpx2czml.py')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the best one is reported')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    reader_parser = subparsers.add_parser('reader', help='gpx parsing into a track dataframe')
+    reader_parser.add_argument('--points', type=int, default=200000)
+    reader_parser.set_defaults(func=bench_reader)
+    tcx_parser = subparsers.add_parser('tcx', help='tcx parsing into a track dataframe')
+    tcx_parser.add_argument('--points', type=int, default=100000)
+    tcx_parser.set_defaults(func=bench_tcx)
+    smooth_parser = subparsers.add_parser('smooth', help='track smoothing and simplification')
+    smooth_parser.add_argument('--points', type=int, default=50000)
+    smooth_parser.add_argument('--iterations', type=int, default=10)
+    smooth_parser.add_argument('--tolerance', type=float, default=1)
+    smooth_parser.set_defaults(func=bench_smooth)
+    stats_parser = subparsers.add_parser('stats', help='track statistics')
+    stats_parser.add_argument('--points', type=int, default=200000)
+    stats_parser.set_defaults(func=bench_stats)
+    coordinates_parser = subparsers.add_parser('coordinates', help='czml coordinate list serialization')
+    coordinates_parser.add_argument('--points', type=int, default=1000000)
+    coordinates_parser.add_argument('--baseline-points', type=int, default=100000,
+                                    help='number of points to time the row by row baseline on')
+    coordinates_parser.set_defaults(func=bench_coordinates)
+    camera_parser = subparsers.add_parser('camera', help='camera path smoothing')
+    camera_parser.add_argument('--points', type=int, default=300000)
+    camera_parser.add_argument('--tracks', type=int, default=10)
+    camera_parser.set_defaults(func=bench_camera)
+    store_parser = subparsers.add_parser('store', help='combined track store')
+    store_parser.add_argument('--points', type=int, default=1000000)
+    store_parser.add_argument('--tracks', type=int, default=20)
+    store_parser.add_argument('--overlap', action='store_true', help='let consecutive tracks overlap in time')
+    store_parser.set_defaults(func=bench_store)
+    pipeline_parser = subparsers.add_parser('pipeline', help='the preprocessing stages on a synthetic dataset')
+    pipeline_parser.add_argument('--tracks', type=int, default=20)
+    pipeline_parser.add_argument('--points', type=int, default=10000, help='points per track')
+    pipeline_parser.add_argument('--tcx', type=int, default=2, help='number of the tracks written as tcx files')
+    pipeline_parser.add_argument('--photo-dirs', type=int, default=3)
+    pipeline_parser.add_argument('--photos', type=int, default=2000, help='photos per directory')
+    pipeline_parser.add_argument('--jobs', type=int, default=1, help='processes for loading tracks')
+    pipeline_parser.add_argument('--seed', type=int, default=0)
+    pipeline_parser.add_argument('--history', default=HISTORY_PATH, help="file to add the results to, '' to not record them")
+    pipeline_parser.add_argument('--threshold', type=float, default=10,
+                                 help='percentage slower than the previous run to flag as a regression')
+    pipeline_parser.set_defaults(func=bench_pipeline)
+    history_parser = subparsers.add_parser('history', help='results of previous pipeline runs')
+    history_parser.add_argument('--history', default=HISTORY_PATH)
+    history_parser.set_defaults(func=bench_history)
+    args = parser.parse_args()
+    args.func(args)
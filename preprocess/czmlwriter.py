@@ -0,0 +1,150 @@
+"""
+Streaming CZML writer.
+
+Packets are serialized and written one at a time, instead of collecting all packets in a list and
+dumping that at the end, so only a single packet has to be kept in memory. The output is the same
+JSON array json.dump() would write. The file is written next to its final path and only moved into
+place when it is complete, so the viewer never reads a partially written file.
+
+Precompressed .gz and .br versions can be written next to the output, for web servers that serve
+those directly (nginx gzip_static/brotli_static).
+"""
+import gzip
+import json
+import os
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODERS = ['json', 'orjson']
+
+# Compression format: file extension
+COMPRESSION_FORMATS = {'gzip': '.gz', 'brotli': '.br'}
+
+# Default compression level of each format (gzip 1-9, brotli 0-11). The maximum levels compress text only a little
+# better and are much slower (brotli 11 takes about 50 times as long as 5), so they have to be configured explicitly.
+COMPRESSION_LEVELS = {'gzip': 6, 'brotli': 5}
+
+class CzmlWriter():
+    # encoder is 'json' (standard library) or 'orjson' (faster, if installed).
+    # compact leaves out the whitespace between items, orjson output is always compact.
+    # compress is a list of COMPRESSION_FORMATS to write precompressed versions in, compress_levels overrides
+    # their COMPRESSION_LEVELS.
+    def __init__(self, path, encoder='json', compact=False, compress=(), compress_levels=None):
+        if encoder not in ENCODERS:
+            raise ValueError(f"Unknown JSON encoder '{encoder}', use one of {ENCODERS}")
+        if encoder == 'orjson' and orjson is None:
+            print("orjson is not installed, falling back to json")
+            encoder = 'json'
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.compress = compress
+        self.compress_levels = compress_levels
+        self.packet_count = 0
+        if encoder == 'orjson':
+            # orjson writes NaN as null and serializes numpy values natively
+            self.separator = b','
+            self.encode = lambda packet: orjson.dumps(packet, option=orjson.OPT_SERIALIZE_NUMPY)
+        else:
+            self.separator = b',' if compact else b', '
+            encoder = json.JSONEncoder(separators=(',', ':') if compact else None)
+            self.encode = lambda packet: encoder.encode(packet).encode('utf-8')
+        self.outfile = open(self.tmp_path, 'wb')
+        self.outfile.write(b'[')
+
+    # Writes a packet, named like list.append so the writer can be passed where a czml list is expected
+    def append(self, packet):
+        if self.packet_count > 0:
+            self.outfile.write(self.separator)
+        self.outfile.write(self.encode(packet))
+        self.packet_count += 1
+
+    def close(self):
+        if self.outfile.closed:
+            return
+        self.outfile.write(b']')
+        self.outfile.close()
+        os.replace(self.tmp_path, self.path)
+        compress_file(self.path, self.compress, self.compress_levels)
+
+    # Discards the output, e.g. after an error
+    def abort(self):
+        if not self.outfile.closed:
+            self.outfile.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def get_compression_formats(names):
+    formats = []
+    for name in names:
+        if name not in COMPRESSION_FORMATS:
+            raise ValueError(f"Unknown compression format '{name}', use one of {list(COMPRESSION_FORMATS)}")
+        if name == 'brotli' and brotli is None:
+            print("brotli is not installed, skipping brotli compression")
+            continue
+        formats.append(name)
+    return formats
+
+# Writes compressed versions of a file next to it (path + extension), levels overrides the COMPRESSION_LEVELS.
+# Compressed versions in other formats are removed, so a web server doesn't serve outdated versions.
+def compress_file(path, formats, levels=None):
+    levels = dict(COMPRESSION_LEVELS, **(levels or {}))
+    for name, extension in COMPRESSION_FORMATS.items():
+        compressed_path = path + extension
+        if not name in formats:
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
+            continue
+        tmp_path = compressed_path + '.tmp'
+        with open(path, 'rb') as infile, open(tmp_path, 'wb') as outfile:
+            if name == 'gzip':
+                # mtime 0 for reproducible output
+                with gzip.GzipFile(fileobj=outfile, mode='wb', compresslevel=levels['gzip'], mtime=0) as compressor:
+                    for chunk in iter(lambda: infile.read(1 << 20), b''):
+                        compressor.write(chunk)
+            else:
+                compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=levels['brotli'])
+                for chunk in iter(lambda: infile.read(1 << 20), b''):
+                    outfile.write(compressor.process(chunk))
+                outfile.write(compressor.finish())
+        os.replace(tmp_path, compressed_path)
+
+# Prints the size of the files (and of their compressed versions, if any). With parse, also the time it takes to parse
+# them, which reads each whole file into memory.
+def print_size_report(groups, parse=False):
+    print("Output size report:")
+    print(f"  {'':<24} {'files':>5} {'raw':>10} {'gzip':>10} {'brotli':>10}" + (f" {'parse':>9}" if parse else ''))
+    for name, paths in groups:
+        sizes = {'raw': 0}
+        parse_time = 0
+        for path in paths:
+            sizes['raw'] += os.path.getsize(path)
+            for format_name, extension in COMPRESSION_FORMATS.items():
+                if os.path.exists(path + extension):
+                    sizes[format_name] = sizes.get(format_name, 0) + os.path.getsize(path + extension)
+            if parse:
+                with open(path, 'rb') as infile:
+                    data = infile.read()
+                start = time.perf_counter()
+                json.loads(data)
+                parse_time += time.perf_counter() - start
+                del data
+        columns = [f"{sizes[key] / 1024:9.1f}k" if key in sizes else f"{'-':>10}" for key in ['raw', 'gzip', 'brotli']]
+        print(f"  {name:<24} {len(paths):>5} {' '.join(columns)}" + (f" {parse_time * 1000:7.1f}ms" if parse else ''))
@@ -0,0 +1,138 @@
+"""
+Incremental index of the EXIF data of photos.
+
+The EXIF data extracted by exiftool is stored in a SQLite database per dataset, keyed by photo
+directory and filename, together with the modification time and size of the file.
+Only new or changed photos are passed to exiftool. The index is then written out as the
+photos.csv file, in the same format as a full exiftool run over the directory.
+"""
+import csv
+import json
+import os
+import sqlite3
+import subprocess
+import tempfile
+
+EXIFTOOL_ARGS = ['-filename', '-gpslatitude#', '-gpslongitude#', '-gpsaltitude#', '-gpsdatestamp', '-gpstimestamp',
+                 '-datetimeoriginal', '-createdate', '-dateFormat', '%Y-%m-%d %H:%M:%S%z', '-T', '-csv']
+
+# Extensions (lower case) of the files in a photo directory that are passed to exiftool: photos and videos.
+# Other files (photos.csv, config.cfg, sidecars, readme files, ...) are skipped, like exiftool does when scanning a directory.
+PHOTO_EXTENSIONS = ['.jpg', '.jpeg', '.heic', '.heif', '.png', '.tif', '.tiff', '.webp', '.dng', '.cr2', '.cr3',
+                    '.nef', '.arw', '.orf', '.rw2', '.raf', '.mov', '.mp4', '.m4v', '.avi', '.3gp', '.mts']
+
+# Value exiftool uses for missing tags (-T implies -f)
+MISSING_VALUE = '-'
+
+def open_index(index_path):
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    connection = sqlite3.connect(index_path)
+    connection.execute('''CREATE TABLE IF NOT EXISTS photos (
+        dirname TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        tags TEXT,
+        PRIMARY KEY (dirname, filename))''')
+    return connection
+
+# Returns a dictionary of filename: (mtime, size) for all photos (and videos) in photo_dir
+def list_photos(photo_dir):
+    photos = {}
+    for entry in os.scandir(photo_dir):
+        if not entry.is_file() or entry.name.startswith('.'):
+            continue
+        if not os.path.splitext(entry.name)[1].lower() in PHOTO_EXTENSIONS:
+            continue
+        stat = entry.stat()
+        photos[entry.name] = (stat.st_mtime, stat.st_size)
+    return photos
+
+# Runs exiftool for the given files. Returns a dictionary of filename: row (dictionary of column: value), and the
+# filenames exiftool reported an error for (e.g. unsupported file types). Raises RuntimeError if exiftool failed.
+def run_exiftool(exiftool_dir, paths):
+    # Pass the file names in an argument file, so the command line doesn't get too long
+    with tempfile.NamedTemporaryFile('w', suffix='.args', delete=False, encoding='utf-8') as argfile:
+        argfile.write('\n'.join(paths))
+    try:
+        result = subprocess.run(['./exiftool', *EXIFTOOL_ARGS, '-charset', 'filename=utf8', '-@', argfile.name],
+                                cwd=exiftool_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8')
+    finally:
+        os.remove(argfile.name)
+    # Exit code 1 means that some files had errors, anything else (or being killed) that exiftool didn't complete
+    if not result.returncode in [0, 1]:
+        raise RuntimeError(f"exiftool failed with exit code {result.returncode}: {result.stderr.strip()}")
+    rows = {}
+    for row in csv.DictReader(result.stdout.splitlines()):
+        rows[os.path.basename(row['SourceFile'])] = row
+    # Errors are reported per file as "Error: <message> - <path>"
+    failed = {os.path.basename(line.rpartition(' - ')[2]) for line in result.stderr.splitlines()
+              if line.startswith('Error') and ' - ' in line}
+    if len(rows) == 0 and len(failed) == 0 and result.returncode != 0:
+        raise RuntimeError(f"exiftool failed: {result.stderr.strip()}")
+    return rows, failed
+
+# Adds the rows of an existing photos.csv to the index, so photos that were processed before aren't extracted again
+def import_csv(connection, dir_name, csv_path, photos):
+    with open(csv_path, newline='', encoding='utf-8') as infile:
+        for row in csv.DictReader(infile):
+            filename = os.path.basename(row.get('SourceFile', ''))
+            if filename in photos:
+                mtime, size = photos[filename]
+                connection.execute('INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?)',
+                                   (dir_name, filename, mtime, size, json.dumps(row)))
+
+# Brings the index up to date for the photos in photo_dir (running exiftool for new and changed photos only)
+# and writes the EXIF data of all photos to csv_path
+def update_exif_index(index_path, dir_name, photo_dir, csv_path, exiftool_dir=None, clean=False):
+    photos = list_photos(photo_dir)
+    with open_index(index_path) as connection:
+        if clean:
+            connection.execute('DELETE FROM photos WHERE dirname = ?', (dir_name,))
+        else:
+            indexed_count = connection.execute('SELECT COUNT(*) FROM photos WHERE dirname = ?', (dir_name,)).fetchone()[0]
+            if indexed_count == 0 and os.path.exists(csv_path):
+                import_csv(connection, dir_name, csv_path, photos)
+
+        indexed = {filename: (mtime, size) for filename, mtime, size in
+                   connection.execute('SELECT filename, mtime, size FROM photos WHERE dirname = ?', (dir_name,))}
+
+        # Forget deleted photos
+        removed = [filename for filename in indexed if not filename in photos]
+        connection.executemany('DELETE FROM photos WHERE dirname = ? AND filename = ?',
+                               [(dir_name, filename) for filename in removed])
+
+        # Extract new and changed photos
+        changed = sorted(filename for filename, stat in photos.items() if indexed.get(filename) != stat)
+        unreported = []
+        if len(changed) > 0:
+            print(f"Executing exiftool for {len(changed)} new or changed photos in {photo_dir}")
+            exiftool_dir = exiftool_dir or os.environ['EXIFTOOL_DIR']
+            rows, failed = run_exiftool(exiftool_dir, [os.path.join(photo_dir, filename) for filename in changed])
+            # Files exiftool reported an error for are stored without tags, so they aren't passed to exiftool on every
+            # run. Files it didn't report at all aren't stored, so they are extracted again the next time.
+            unreported = [filename for filename in changed if not filename in rows and not filename in failed]
+            if len(unreported) > 0:
+                print(f"exiftool didn't report {len(unreported)} photos in {photo_dir}, they are extracted again on the next run")
+            connection.executemany('INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?)',
+                                   [(dir_name, filename, *photos[filename],
+                                     json.dumps(rows[filename]) if filename in rows else None)
+                                    for filename in changed if filename in rows or filename in failed])
+        if len(removed) > 0 or len(changed) > 0:
+            print(f"EXIF index for {dir_name}: {len(changed) - len(unreported)} photos extracted, {len(removed)} removed")
+
+        rows = [json.loads(tags) for (tags,) in connection.execute(
+            'SELECT tags FROM photos WHERE dirname = ? AND tags IS NOT NULL ORDER BY filename', (dir_name,))]
+    connection.close()
+
+    write_csv(csv_path, rows)
+
+# Writes rows like exiftool's csv output, columns that are missing in some rows get the missing value
+def write_csv(csv_path, rows):
+    columns = []
+    for row in rows:
+        columns += [column for column in row if not column in columns]
+    with open(csv_path, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=columns, restval=MISSING_VALUE)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -2,15 +2,29 @@
 import math
 import pandas as pd
 import numpy as np
-import gpxpy
-from tcx2gpx import TCX2GPX
+from tcx2gpx import read_tcx_arrays, write_gpx
+from gpxreader import read_gpx_arrays, track_dataframe
+from tracksmooth import resample_uniform, simplify_rdp, smooth_track, smooth_values
+from trackstats import track_profile, track_statistics
+from exifindex import update_exif_index
+from intervals import IgnoreIntervals
+from photoresize import resize_photos
+from photocluster import cluster_grid, summarize_clusters
+from profiler import Profiler, measure
+from czmlwriter import COMPRESSION_FORMATS, COMPRESSION_LEVELS, CzmlWriter, get_compression_formats, print_size_report
+from trackstore import write_track_store
+from trackcache import code_version, evict_cache, load_cached_track, store_cached_track, track_cache_key
+from watcher import UpdateLog, Watcher, diff_packets, index_packets
+import argparse
 import json
 import os
-import sys
 import subprocess
+import sys
+import time
+import traceback
 import dotenv
-from bisect import bisect_left, bisect_right
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 import configparser
 
 # Adapted from Will Geary, "Visualizing a Bike Ride in 3D", https://willgeary.github.io/GPXto3D/
@@ -32,57 +46,53 @@ PHOTO_ID = "id"
 PHOTO_DIRNAME = "dirname"
 PHOTO_TIMESTAMP = "timestamp"
 PHOTO_INTERVAL = "interval"
+PHOTO_THUMBNAIL = "thumbnail"
+PHOTO_WEB = "web"
 LOCATION_SOURCES = ['exif', 'gpx', 'manual', 'interpolated']
-
-def gpx_to_dataframe(gpx):
-    lats = []
-    lons = []
-    elevations = []
-    times = []
-    timestamps = []
-
-    for track in gpx.tracks:
-        for segment in track.segments:
-            for point in segment.points:
-                lats.append(point.latitude)
-                lons.append(point.longitude)
-                elevations.append(point.elevation)
-                times.append(point.time)
-                timestamps.append(point.time.timestamp() if not point.time is None else None)
-
-    output = pd.DataFrame()
-    output['latitude'] = lats
-    output['longitude'] = lons
-    output['elevation'] = elevations
-    output['time'] = times
-    output['timestamp'] = timestamps
-    
-    # Mark first and last rows as boundaries
-    output['boundary'] = [0] * len(lats)
-    output.loc[0, 'boundary'] = 1
-    output.loc[output.index[-1], 'boundary'] = 1
-
-    output.sort_values('time', inplace=True)
-    output.reset_index(drop=True, inplace=True)
-    return output
-
-# Returns a coordinate list used for positioning a CZML entity
-def create_coordinate_list(df_input, includeTimestep=True):
-    results = []
-    start_timestamp = min(df_input['timestamp']) if includeTimestep else None
-    for i in df_input.index:
-        if includeTimestep:
-            timestamp = df_input.timestamp.iloc[i]
-            results.append(timestamp - start_timestamp)
-        results.append(df_input.longitude.iloc[i])
-        results.append(df_input.latitude.iloc[i])
-        results.append(df_input.elevation.iloc[i])
-    return results
-
-# Each track will represented by a polyline
-def create_polyline(path_id, df_input, metadata, color):
-    coordinate_list = create_coordinate_list(df_input, includeTimestep=False)
-    return {
+MAX_DISPLAY_DISTANCE = sys.float_info.max # Cesium's default far distance of a DistanceDisplayCondition
+CHUNKS_MANIFEST = "chunks.json"
+CHUNKS_DIR = "chunks"
+PROFILE_REPORT = "profile.json"
+PROFILE_DIR = "profile" # cProfile statistics
+TRACK_STORE = os.path.join('.cache', 'combined_tracks.bin') # see trackstore.py
+
+# Command line arguments, see parse_args
+args = None
+
+# Returns the number of decimals to round the CZML output to, from the output section of the dataset config.
+# None (the default) keeps full precision. quantize sets defaults of about 0.1 meter: 6 decimals for
+# coordinates (degrees) and 1 for elevations (meters).
+def get_output_precision(config):
+    quantize = config.getboolean('output', 'quantize', fallback=False)
+    defaults = {'coordinates': 6, 'elevation': 1, 'time': None} if quantize else {}
+    precision = {}
+    for name in ['coordinates', 'elevation', 'time']:
+        value = config.get('output', f'precision.{name}', fallback=defaults.get(name))
+        precision[name] = None if value is None else int(value)
+    return precision
+
+def round_values(values, decimals):
+    return values if decimals is None else np.round(values, decimals)
+
+# Returns a coordinate list used for positioning a CZML entity:
+# [(time offset,) longitude, latitude, elevation, ...] for all rows
+def create_coordinate_list(df_input, includeTimestep=True, precision=None):
+    precision = precision or {}
+    columns = [
+        round_values(df_input['longitude'].to_numpy(dtype=np.float64), precision.get('coordinates')),
+        round_values(df_input['latitude'].to_numpy(dtype=np.float64), precision.get('coordinates')),
+        round_values(df_input['elevation'].to_numpy(dtype=np.float64), precision.get('elevation')),
+    ]
+    if includeTimestep:
+        timestamps = df_input['timestamp'].to_numpy(dtype=np.float64)
+        columns.insert(0, round_values(timestamps - df_input['timestamp'].min(), precision.get('time')))
+    return np.column_stack(columns).ravel().tolist()
+
+# Each track will represented by a polyline.
+# display_distances optionally limits the camera distances (near, far) the polyline is shown at.
+def create_polyline(path_id, df_input, metadata, color, precision=None, display_distances=None):
+    coordinate_list = create_coordinate_list(df_input, includeTimestep=False, precision=precision)
+    packet = {
         "id": path_id,
         "name": str(min(df_input['time'])),
         "polyline": {
@@ -105,15 +115,68 @@ def create_polyline(path_id, df_input, metadata, color):
         },
         "properties": metadata
     }
+    if not display_distances is None:
+        packet["polyline"]["distanceDisplayCondition"] = {
+            "distanceDisplayCondition": list(display_distances)
+        }
+    return packet
+
+# Returns the levels of detail for the track polylines from the output section of the dataset config,
+# a list of (simplification tolerance, near, far) per level, the first level being the full track.
+# lod.tolerances are the simplification tolerances (meters) of the simplified levels,
+# lod.distances the camera distances (meters) at which to switch to the next level.
+def get_lod_levels(config):
+    tolerances = config.get('output', 'lod.tolerances', fallback='')
+    if tolerances == '':
+        return []
+    tolerances = [float(value) for value in tolerances.split(',')]
+    distances = [float(value) for value in config.get('output', 'lod.distances', fallback='').split(',') if value != '']
+    if len(distances) != len(tolerances):
+        raise ValueError("lod.distances should contain a distance for each of the lod.tolerances")
+    bounds = [0] + distances + [MAX_DISPLAY_DISTANCE]
+    return [(tolerance, bounds[level], bounds[level + 1]) for level, tolerance in enumerate([0] + tolerances)]
+
+# Returns the polyline packets of a track: the full track, and with levels of detail (see get_lod_levels)
+# a simplified version per level, each level simplified from the previous one.
+# The number of vertices of each level is added to vertex_counts, if given.
+def create_polylines(index, df, metadata, precision=None, lod_levels=None, vertex_counts=None):
+    color = get_color(index)
+    if not lod_levels:
+        if not vertex_counts is None:
+            vertex_counts[0] += df.shape[0]
+        return [create_polyline(f'line_{index}', df, metadata, color, precision)]
+
+    packets = []
+    level_df = df
+    for level, (tolerance, near, far) in enumerate(lod_levels):
+        if level == 0:
+            packets.append(create_polyline(f'line_{index}', df, metadata, color, precision, (near, far)))
+        else:
+            keep = simplify_rdp(level_df['latitude'].to_numpy(), level_df['longitude'].to_numpy(), tolerance)
+            level_df = level_df[keep]
+            # The simplified levels refer to the full track, which has the metadata
+            packets.append(create_polyline(f'lod_{index}_{level}', level_df, { "line": f'line_{index}' }, color,
+                                           precision, (near, far)))
+        if not vertex_counts is None:
+            vertex_counts[level] += level_df.shape[0]
+    return packets
+
+def print_lod_report(lod_levels, vertex_counts):
+    print("Polyline vertices per level of detail:")
+    for level, (tolerance, near, far) in enumerate(lod_levels):
+        share = vertex_counts[level] / vertex_counts[0] * 100 if vertex_counts[0] > 0 else 0
+        name = 'full track' if level == 0 else f'tolerance {tolerance:g} m'
+        shown = f'from {near:g} m' + (f' to {far:g} m' if far < MAX_DISPLAY_DISTANCE else '')
+        print(f"  {level}: {name:<20} {vertex_counts[level]:>10} vertices ({share:5.1f}%), shown {shown}")
 
 # The cursor is the entity that will be shown on the polyline,
 # so it will be at the exact location of the track.
 # Each track will have its own cursor. (see create_tracking_entity)
-def create_tracking_cursor(entity_id, df_input):
+# availability defaults to the time range of df_input, see get_availability.
+def create_tracking_cursor(entity_id, df_input, precision=None, availability=None):
     point_starttime = min(df_input['time']).isoformat()
-    point_stoptime = max(df_input['time']).isoformat()
-    point_availability = point_starttime + "/" + point_stoptime
-    coordinate_list = create_coordinate_list(df_input, includeTimestep=True)
+    point_availability = availability or get_availability(df_input)
+    coordinate_list = create_coordinate_list(df_input, includeTimestep=True, precision=precision)
     return {
         "id": entity_id,
         "availability": point_availability,
@@ -138,32 +201,11 @@ def create_tracking_cursor(entity_id, df_input):
 # it's based on a heavily smoothed version of the tracks, so the camera movement is smooth.
 # There will be one entity for the whole dataset, based on the combined tracks.
 # (also see create_tracking_cursor)
-def create_tracking_entity(entity_id, track_dfs):
-    # Create a smooth path for the camera to track
-    SMOOTHING_WINDOW_SIZE = 100
-    smoothed_tracks = []
-    for track in track_dfs:
-        # Apply padding to keep the start and end of the tracks at their current locations
-        padding_before = pd.DataFrame([track.iloc[0].copy()] * (int(SMOOTHING_WINDOW_SIZE / 2) + 1))
-        padding_after = pd.DataFrame([track.iloc[-1].copy()] * (int(SMOOTHING_WINDOW_SIZE / 2) + 1))
-        padded_track = get_combined_tracks([padding_before, track, padding_after])
-
-        # Actual smoothing
-        padded_track['longitude'] = padded_track['longitude'].rolling(SMOOTHING_WINDOW_SIZE, 1, True).mean()
-        padded_track['latitude'] = padded_track['latitude'].rolling(SMOOTHING_WINDOW_SIZE, 1, True).mean()
-        padded_track['elevation'] = padded_track['elevation'].rolling(SMOOTHING_WINDOW_SIZE, 1, True).mean()
-        padded_track['timestamp'] = padded_track['timestamp'].rolling(SMOOTHING_WINDOW_SIZE, 1, True).mean()
-        padded_track['time'] = padded_track['timestamp'].apply(lambda timestamp: datetime.fromtimestamp(timestamp))
-        smoothed_tracks.append(padded_track)
-
-    # Combine all the tracks into one
-    combined_tracks = get_combined_tracks(smoothed_tracks)
-
-    # Create and return the entity
-    point_starttime = min(combined_tracks['time']).isoformat()
-    point_stoptime = max(combined_tracks['time']).isoformat()
-    point_availability = point_starttime + "/" + point_stoptime
-    coordinate_list = create_coordinate_list(combined_tracks, includeTimestep=True)
+# tracking_path is the smoothed path, see create_tracking_path.
+def create_tracking_entity(entity_id, tracking_path, precision=None, availability=None):
+    point_starttime = min(tracking_path['time']).isoformat()
+    point_availability = availability or get_availability(tracking_path)
+    coordinate_list = create_coordinate_list(tracking_path, includeTimestep=True, precision=precision)
     return {
         "id": entity_id,
         "availability": point_availability,
@@ -183,22 +225,91 @@ def create_tracking_entity(entity_id, track_dfs):
         },
     }
 
-def create_document_packet(name, starttime, stoptime):
+# Returns a smooth path for the camera to track, based on the combined tracks (a trackstore.TrackStore).
+# Each track is smoothed with a centered window of window points (see tracksmooth.smooth_values), and
+# optionally resampled at a fixed interval of resample seconds.
+def create_tracking_path(combined_tracks, window=100, smoothing_filter='mean', resample=0):
+    columns = ['longitude', 'latitude', 'elevation', 'timestamp']
+    smoothed_tracks = []
+    for index in range(combined_tracks.track_count):
+        # Apply padding to keep the start and end of the tracks at their current locations
+        padding = int(window / 2) + 1
+        smoothed = [smooth_values(np.pad(combined_tracks.track(index, column), padding, mode='edge'),
+                                  window, smoothing_filter) for column in columns]
+        if resample > 0:
+            timestamps, smoothed[:3] = resample_uniform(smoothed[3], smoothed[:3], resample)
+            smoothed[3] = timestamps
+        smoothed_tracks.append(smoothed)
+
+    # Combine all the tracks into one
+    combined = [np.concatenate([smoothed[i] for smoothed in smoothed_tracks]) for i in range(len(columns))]
+    order = np.argsort(combined[3], kind='stable')
+    path = pd.DataFrame({column: values[order] for column, values in zip(columns, combined)})
+    path['time'] = timestamps_to_times(path['timestamp'].to_numpy())
+    return path
+
+# Returns the UTC times of POSIX timestamps, rounded to microseconds like datetime
+def timestamps_to_times(timestamps):
+    return pd.to_datetime(np.round(timestamps * 1e6).astype(np.int64), unit='us', utc=True)
+
+# Returns a track resampled at a fixed interval of step seconds, see tracksmooth.resample_uniform.
+# Parts of the track between two consecutive boundary points (gaps between combined tracks)
+# are resampled separately, so no samples are added in the gaps.
+def resample_track(df, step):
+    columns = ['longitude', 'latitude', 'elevation']
+    timestamps = df['timestamp'].to_numpy(dtype=np.float64)
+    values = [df[column].to_numpy(dtype=np.float64) for column in columns]
+    boundary = df['boundary'].to_numpy()
+    gaps = np.flatnonzero((boundary[:-1] == 1) & (boundary[1:] == 1)) + 1
+
+    pieces = []
+    for start, stop in zip(np.concatenate([[0], gaps]), np.concatenate([gaps, [len(df)]])):
+        piece_timestamps, piece_values = resample_uniform(timestamps[start:stop],
+                                                          [column[start:stop] for column in values], step)
+        piece = pd.DataFrame(dict(zip(columns, piece_values)))
+        piece['timestamp'] = piece_timestamps
+        piece['boundary'] = 0
+        piece.loc[[0, piece.shape[0] - 1], 'boundary'] = boundary[[start, stop - 1]]
+        pieces.append(piece)
+    resampled = pd.concat(pieces, ignore_index=True)
+    resampled['time'] = timestamps_to_times(resampled['timestamp'].to_numpy())
+    return resampled
+
+# Returns the track the cursor follows: the track itself, or resampled every resample seconds
+def get_cursor_track(df, resample=0):
+    if resample <= 0 or df.shape[0] < 2:
+        return df
+    resampled = resample_track(df, resample)
+    print(f"Resampled cursor from {df.shape[0]} to {resampled.shape[0]} samples")
+    return resampled
+
+# Returns the CZML availability (time interval) of a track
+def get_availability(df_input):
+    return min(df_input['time']).isoformat() + "/" + max(df_input['time']).isoformat()
+
+# Returns the git commit of the code that generates the output, for the document packet
+def get_build_info():
+    return {
+        "travelmap-sha": subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE).stdout.decode('utf-8').strip(),
+        "travelmap-dirty": subprocess.call('git diff-index --quiet HEAD', shell=True) != 0,
+        "travelmap-timestamp": subprocess.run(['git', 'show', '-s', '--format=%cd', '--date=format:%Y-%m-%dT%H:%M:%S'], stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+    }
+
+# build_info is the result of get_build_info(), which is called if not given
+def create_document_packet(name, starttime, stoptime, build_info=None):
     starttime = starttime.isoformat()
     stoptime = stoptime.isoformat()
     availability = starttime + "/" + stoptime
-    tm_sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
-    tm_dirty = subprocess.call('git diff-index --quiet HEAD', shell=True) != 0
-    tm_timestamp = subprocess.run(['git', 'show', '-s', '--format=%cd', '--date=format:%Y-%m-%dT%H:%M:%S'], stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+    build_info = build_info or get_build_info()
     generated_at = datetime.now().isoformat()
     return {
         "id": "document",
         "name": name,
         "version": "1.0",
         "author": "cesium-travelmap/gpx2czml.py",
-        "travelmap-sha": tm_sha,
-        "travelmap-dirty": tm_dirty,
-        "travelmap-timestamp": tm_timestamp,
+        "travelmap-sha": build_info["travelmap-sha"],
+        "travelmap-dirty": build_info["travelmap-dirty"],
+        "travelmap-timestamp": build_info["travelmap-timestamp"],
         "generated-at": generated_at,
         "clock": {
             "interval": availability,
@@ -220,78 +331,134 @@ def get_color(index):
     ][index % 7]
 
 # Returns a tuple of dataframe and metadata dictionary
-def load_track(path, config):
+# The point counts before and after smoothing are added to stage, if given (see profiler.py)
+def load_track(path, config, stage=None):
     print("Loading and processing track", path)
-    gpx_file = open(path, 'r')
-    gpx = gpxpy.parse(gpx_file)
-    gpx_point_count = gpx.get_points_no()
+    if path[-4:] == '.tcx':
+        lats, lons, elevations, epochs, segments = read_tcx_arrays(path)
+        if config.getboolean('tcx', 'export_gpx', fallback=False):
+            print(f"Exporting to gpx: {path}")
+            write_gpx(path[:-4] + '.gpx', lats, lons, elevations, epochs, os.path.basename(path)[:-4])
+    else:
+        lats, lons, elevations, epochs, segments = read_gpx_arrays(path)
+    point_count = len(lats)
 
     # Smoothen and resample track
-    if gpx_point_count > 1000:
-        for i in range(10):
-            gpx.smooth(vertical=True, horizontal=True, remove_extremes=True)
-        gpx.simplify(max_distance=1)
-        print(f"Reduced point count from {gpx_point_count} to {gpx.get_points_no()}")
+    if point_count > config.getint('smoothing', 'min_points', fallback=1000):
+        keep = smooth_track(lats, lons, elevations, segments,
+                            iterations=config.getint('smoothing', 'iterations', fallback=10),
+                            tolerance=config.getfloat('smoothing', 'tolerance', fallback=1),
+                            algorithm=config.get('smoothing', 'algorithm', fallback='rdp'))
+        # Start index of each segment after removing points
+        kept_before = np.concatenate([[0], np.cumsum(keep)])
+        segments = np.unique(kept_before[segments])
+        lats, lons, elevations, epochs = lats[keep], lons[keep], elevations[keep], epochs[keep]
+        segments = segments[segments < len(lats)]
+        print(f"Reduced point count from {point_count} to {len(lats)}")
     else:
-        print(f"Point count: {gpx_point_count}")
+        print(f"Point count: {point_count}")
+    if not stage is None:
+        stage.count(points_in=point_count, points_out=len(lats))
 
     # Extract meta data
-    minmax = gpx.get_elevation_extremes()
-    time_bounds = gpx.get_time_bounds()
-    updown_elevation = gpx.get_uphill_downhill()
-    metadata = {
-        "source": config.get('global', 'attribution', fallback=''),
-        "start_time": time_bounds.start_time.isoformat() if not time_bounds.start_time is None else None,
-        "end_time": time_bounds.end_time.isoformat() if not time_bounds.end_time is None else None,
-        "duration": gpx.get_duration(),
-        "length_2d": gpx.length_2d(),
-        "ascent": updown_elevation.uphill,
-        "descent": updown_elevation.downhill,
-        "min_elevation": minmax.minimum,
-        "max_elevation": minmax.maximum
-    }
-
-    return gpx_to_dataframe(gpx), metadata
+    stopped_speed = config.getfloat('statistics', 'stopped_speed', fallback=1) / 3.6
+    metadata = {"source": config.get('global', 'attribution', fallback='')}
+    metadata.update(track_statistics(lats, lons, elevations, epochs, segments, stopped_speed,
+                                     config.getfloat('statistics', 'elevation_threshold', fallback=0)))
+    profile = track_profile(lats, lons, elevations, epochs, segments,
+                            config.getint('statistics', 'profile_samples', fallback=100), stopped_speed)
+    if not profile is None:
+        metadata["profile"] = profile
+
+    return track_dataframe(lats, lons, elevations, epochs), metadata
+
+# Loads a track and measures it, returns the result of load_track and the profiler Stage
+def profile_load_track(path, config):
+    with measure(os.path.basename(path)) as stage:
+        result = load_track(path, config, stage)
+    return result, stage
+
+# Applies func to all items, in a pool of worker processes if jobs > 1.
+# Results are returned in the order of the items.
+def parallel_map(func, items, jobs, *func_args):
+    extra_args = [[arg] * len(items) for arg in func_args]
+    if jobs <= 1 or len(items) <= 1:
+        return list(map(func, items, *extra_args))
+    with ProcessPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        return list(executor.map(func, items, *extra_args))
+
+# Returns the paths of the gpx and tcx files in tracks_dir, tcx files are read directly unless there is
+# a gpx file with the same name (e.g. converted by an earlier version, or exported with export_gpx)
+def list_tracks(tracks_dir):
+    listdir = os.listdir(tracks_dir)
+    listdir.sort()
+    return [os.path.join(tracks_dir, file) for file in listdir if file[-4:] == '.gpx' or
+            (file[-4:] == '.tcx' and not file[:-4] + '.gpx' in listdir)]
 
-def load_tracks(tracks_dir):
+# Loads all tracks in tracks_dir (or only paths), tracks that are found in cache_dir aren't processed again
+def load_tracks(tracks_dir, jobs=1, cache_dir=None, profiler=None, paths=None):
+    profiler = profiler or Profiler()
     # Load config
     config = configparser.RawConfigParser()
     config_path = os.path.join(tracks_dir, 'config.cfg')
     config.read(config_path)
 
-    # Convert any unconverted tcx files
-    listdir = os.listdir(tracks_dir)
-    listdir.sort()
-    tcx_files = [os.path.join(tracks_dir, file) for file in listdir if file[-4:] == '.tcx']
-    tcx_to_process = [file for file in tcx_files if not os.path.exists(file[:-4] + '.gpx')]
-    for tcx_path in tcx_to_process:
-        print(f"Converting to gpx: {tcx_path}")
-        gps_object = TCX2GPX(tcx_path)
-        gps_object.convert()
-
-    # List and load gpx files
-    listdir = os.listdir(tracks_dir)
-    listdir.sort()
-    paths = [os.path.join(tracks_dir, file) for file in listdir if file[-4:] == '.gpx']
-    track_tuple = [load_track(path, config) for path in paths]
+    paths = list_tracks(tracks_dir) if paths is None else paths
+
+    # Get what we can from the cache
+    use_cache = not cache_dir is None and config.getboolean('cache', 'enabled', fallback=True)
+    track_tuple = [None] * len(paths)
+    if use_cache:
+        with profiler.stage('read cache') as stage:
+            version = code_version()
+            cache_keys = [track_cache_key(path, config, version) for path in paths]
+            for index, path in enumerate(paths):
+                track_tuple[index] = load_cached_track(cache_dir, cache_keys[index])
+                if not track_tuple[index] is None:
+                    print("Loaded track from cache", path)
+            stage.count(tracks=len(paths), cached=sum(not result is None for result in track_tuple))
+
+    # Load the remaining gpx files
+    to_load = [index for index in range(len(paths)) if track_tuple[index] is None]
+    with profiler.stage('load gpx') as stage:
+        loaded = parallel_map(profile_load_track, [paths[index] for index in to_load], jobs, config)
+        for index, (result, track_stage) in zip(to_load, loaded):
+            track_tuple[index] = result
+            stage.stages.append(track_stage)
+            stage.count(**track_stage.counts)
+        stage.count(tracks=len(to_load))
+
+    if use_cache:
+        with profiler.stage('write cache'):
+            for index in to_load:
+                store_cached_track(cache_dir, cache_keys[index], *track_tuple[index])
+            evict_cache(cache_dir, config.getfloat('cache', 'max_size', fallback=256) * 1024 * 1024)
     return track_tuple
 
-def process_track(data, czml, index):
+def process_track(data, czml, index, precision=None, lod_levels=None, vertex_counts=None, resample=0):
     df = data[0]
     metadata = data[1]
 
-    # Polyline
-    path_object = create_polyline(f'line_{index}', df, metadata, get_color(index))
-    czml.append(path_object)
+    # Polyline(s)
+    for path_object in create_polylines(index, df, metadata, precision, lod_levels, vertex_counts):
+        czml.append(path_object)
 
     # Point
-    cursor_object = create_tracking_cursor(f'point_{index}', df)
+    cursor_object = create_tracking_cursor(f'point_{index}', get_cursor_track(df, resample), precision)
     czml.append(cursor_object)
 
-def create_photo_markers(df, czml):
+# With cluster_levels (see get_cluster_levels) the photos are only shown individually up to the distance
+# at which they are clustered, and cluster markers are added for each level.
+def create_photo_markers(df, czml, cluster_levels=None):
     if df is None: return
     base_path = get_datadir(True) # relative path starting at data/
-    for index, row in df.iterrows():
+    clusters = get_photo_clusters(df, cluster_levels) if cluster_levels else []
+    marker_far = np.full(len(df), MAX_DISPLAY_DISTANCE)
+    for level, (near, far, counts, center_lat, center_lon, members) in enumerate(clusters):
+        for member_rows in [rows for rows, count in zip(members, counts) if count > 1]:
+            marker_far[member_rows] = np.minimum(marker_far[member_rows], near)
+
+    for position, (index, row) in enumerate(df.iterrows()):
 
         # Read data from dataframe
         lat = row[PHOTO_LAT]
@@ -318,84 +485,269 @@ def create_photo_markers(df, czml):
                 },
                 "outlineWidth": 2,
                 "pixelSize": 20,
-                "heightReference": "CLAMP_TO_GROUND"
+                "heightReference": "CLAMP_TO_GROUND",
+                **({"distanceDisplayCondition": {"distanceDisplayCondition": [0, marker_far[position]]}}
+                   if marker_far[position] < MAX_DISPLAY_DISTANCE else {})
             },
             "properties": {
                 "src": f'{base_path}/photos/{row[PHOTO_DIRNAME]}/{row[PHOTO_FILENAME]}',
-                "time": f'{row[EXIF_TAG_DATE_TIME].isoformat()}'
+                "time": f'{row[EXIF_TAG_DATE_TIME].isoformat()}',
+                # Resized versions, if available (see add_resized_photos)
+                **{name: f'{base_path}/{row[name]}' for name in [PHOTO_THUMBNAIL, PHOTO_WEB]
+                   if name in row and not row[name] is None}
             }
         })
 
-def get_photo_coordinates(photo_df, index, track, config, global_config):
-    photo_row = photo_df.iloc[index]
-
-    # 1) See if there is a manual entry for this photo
-    coords = config.get('manual_coords', photo_row[PHOTO_FILENAME], fallback=None)
-    if not coords is None:
-        return list(map(float, coords.split(','))), 2
+    for level, (near, far, counts, center_lat, center_lon, members) in enumerate(clusters):
+        for number in np.flatnonzero(counts > 1):
+            czml.append(create_photo_cluster(f'cluster_{level}_{number}', counts[number], center_lat[number],
+                                             center_lon[number], df[PHOTO_ID].iloc[members[number]].tolist(), (near, far)))
+
+# Returns the photo clustering levels from the output config: a list of (cell size, near, far) per level.
+# Photos within the same grid cell of cell size meters are shown as a cluster from near to far meters camera distance.
+def get_cluster_levels(config):
+    cell_sizes = config.get('output', 'cluster.cells', fallback='')
+    if cell_sizes == '':
+        return []
+    cell_sizes = [float(value) for value in cell_sizes.split(',')]
+    distances = [float(value) for value in config.get('output', 'cluster.distances', fallback='').split(',') if value != '']
+    if len(distances) != len(cell_sizes):
+        raise ValueError("cluster.distances should contain a distance for each of the cluster.cells")
+    if cell_sizes != sorted(cell_sizes) or distances != sorted(distances):
+        raise ValueError("cluster.cells and cluster.distances should be increasing")
+    bounds = distances + [MAX_DISPLAY_DISTANCE]
+    return [(cell_size, bounds[level], bounds[level + 1]) for level, cell_size in enumerate(cell_sizes)]
+
+# Clusters the photos that have coordinates for each of the cluster_levels.
+# Returns a list of (near, far, counts, center_lat, center_lon, members) per level (see summarize_clusters),
+# with the members as positions in df.
+def get_photo_clusters(df, cluster_levels):
+    located = np.flatnonzero(df[PHOTO_LAT].notna().to_numpy() & df[PHOTO_LON].notna().to_numpy())
+    lat = df[PHOTO_LAT].to_numpy(dtype=np.float64, na_value=np.nan)[located]
+    lon = df[PHOTO_LON].to_numpy(dtype=np.float64, na_value=np.nan)[located]
+    labels = cluster_grid(lat, lon, [cell_size for cell_size, near, far in cluster_levels])
+    clusters = []
+    for (cell_size, near, far), level_labels in zip(cluster_levels, labels):
+        counts, center_lat, center_lon, members = summarize_clusters(lat, lon, level_labels)
+        clusters.append((near, far, counts, center_lat, center_lon, [located[rows] for rows in members]))
+    return clusters
+
+# A cluster marker, with the number of photos as label and the photo ids in the properties,
+# so the visualizer can zoom in on them
+def create_photo_cluster(entity_id, count, lat, lon, member_ids, display_distances):
+    display_condition = {"distanceDisplayCondition": list(display_distances)}
+    return {
+        "id": entity_id,
+        "name": f'{count} photos',
+        "position": {
+            "cartographicDegrees": [lon, lat, 2]
+        },
+        "point": {
+            "color": {
+                "rgba": [0, 50, 200, 180]
+            },
+            "outlineColor": {
+                "rgba": [200, 200, 200, 255]
+            },
+            "outlineWidth": 2,
+            "pixelSize": round(min(24 + 4 * math.log2(count), 48)),
+            "heightReference": "CLAMP_TO_GROUND",
+            "distanceDisplayCondition": display_condition
+        },
+        "label": {
+            "text": str(count),
+            "font": "bold 14px sans-serif",
+            "fillColor": {
+                "rgba": [255, 255, 255, 255]
+            },
+            "horizontalOrigin": "CENTER",
+            "verticalOrigin": "CENTER",
+            "heightReference": "CLAMP_TO_GROUND",
+            "eyeOffset": {
+                "cartesian": [0, 0, -10] # in front of the point
+            },
+            "distanceDisplayCondition": display_condition
+        },
+        "properties": {
+            "count": int(count),
+            "members": member_ids
+        }
+    }
 
-    # 2) Read coordinates from EXIF data
+def print_cluster_report(df, cluster_levels):
+    if df is None: return
+    print("Photo markers per cluster level:")
+    for level, (near, far, counts, center_lat, center_lon, members) in enumerate(get_photo_clusters(df, cluster_levels)):
+        shown = f'from {near:g} m' + (f' to {far:g} m' if far < MAX_DISPLAY_DISTANCE else '')
+        print(f"  {level}: cells of {cluster_levels[level][0]:g} m {(counts > 1).sum():>8} clusters, "
+              f"{(counts == 1).sum():>8} single photos, shown {shown}")
+
+# Generates thumbnails and web sized versions of the photos that have coordinates (see photoresize.py)
+# and adds their paths to the PHOTO_THUMBNAIL and PHOTO_WEB columns
+def add_resized_photos(df, config, jobs=1):
+    located = df[PHOTO_LAT].notna()
+    photos = list(zip(df.loc[located, PHOTO_DIRNAME], df.loc[located, PHOTO_FILENAME]))
+    sizes = {
+        PHOTO_THUMBNAIL: config.getint('resize', 'thumbnail_size', fallback=300),
+        PHOTO_WEB: config.getint('resize', 'web_size', fallback=1600)
+    }
+    result = resize_photos(get_datadir(), photos, sizes, config.getint('resize', 'quality', fallback=85), jobs)
+    if result is None: return
+    for name, paths in result.items():
+        values = np.full(len(df), None, dtype=object)
+        values[located.to_numpy()] = paths
+        df[name] = values
+
+# Determines the coordinates of all photos in photo_df, in order of precedence:
+# 1) manual coordinates from the config, 2) EXIF coordinates, 3) the track position at the photo time.
+# Photos in one of the ignore_gpx_intervals get the interval name instead (intervals contains the name per photo, or None).
+# Photos without coordinates are interpolated between the other photos later, see interpolate_photo_coordinates.
+def get_photo_coordinates(photo_df, track, config, intervals):
+    count = photo_df.shape[0]
+    lats = np.full(count, None, dtype=object)
+    lons = np.full(count, None, dtype=object)
+    alts = np.full(count, None, dtype=object)
+    sources = np.full(count, -1)
+    filenames = photo_df[PHOTO_FILENAME]
+
+    # 1) Manual entries (option names are lower case in the config)
+    manual_coords = dict(config.items('manual_coords')) if config.has_section('manual_coords') else {}
+    manual = filenames.str.lower().map(manual_coords).to_numpy()
+    is_manual = pd.notna(manual)
+    for i in np.flatnonzero(is_manual):
+        lons[i], lats[i], alts[i] = list(map(float, manual[i].split(',')))[:3]
+    sources[is_manual] = 2
+
+    # 2) EXIF data
     ignore_duplicate_exif_coords = config.getboolean('global', 'ignore_duplicate_exif_coords', fallback=False)
     ignore_exif = config.get('global', 'ignore_exif', fallback='').split(',')
-    lat = photo_row[EXIF_TAG_LAT]
-    lon = photo_row[EXIF_TAG_LON]
-    alt = photo_row[EXIF_TAG_ALT]
-    if lat != '-' and lon != '-' and alt != '-':
-        # Check if the coordinates are accurate, which will not be the case
-        # if multiple photos are present with exactly the same coordinates.
-        # In that case, we ignore the EXIF and go on below
-        ignore_because_duplicate = ignore_duplicate_exif_coords and \
-                photo_df[photo_df[EXIF_TAG_LAT] == lat].shape[0] > 1 and \
-                photo_df[photo_df[EXIF_TAG_LON] == lon].shape[0] > 1
-        ignore_because_specified = photo_row[PHOTO_FILENAME] in ignore_exif
-        if not ignore_because_duplicate and not ignore_because_specified:
-            return [float(lon), float(lat), float(alt)], 0
-        print(f"Ignoring EXIF coordinates for {photo_row[PHOTO_FILENAME]}")
+    exif_lat = photo_df[EXIF_TAG_LAT]
+    exif_lon = photo_df[EXIF_TAG_LON]
+    exif_alt = photo_df[EXIF_TAG_ALT]
+    has_exif = ((exif_lat != '-') & (exif_lon != '-') & (exif_alt != '-')).to_numpy() & ~is_manual
+    # Check if the coordinates are accurate, which will not be the case
+    # if multiple photos are present with exactly the same coordinates.
+    # In that case, we ignore the EXIF and go on below
+    if ignore_duplicate_exif_coords:
+        ignore_because_duplicate = (exif_lat.duplicated(keep=False) & exif_lat.notna() &
+                                    exif_lon.duplicated(keep=False) & exif_lon.notna()).to_numpy()
+    else:
+        ignore_because_duplicate = np.zeros(count, dtype=bool)
+    ignore_because_specified = filenames.isin(ignore_exif).to_numpy()
+    ignored = has_exif & (ignore_because_duplicate | ignore_because_specified)
+    for filename in filenames[ignored]:
+        print(f"Ignoring EXIF coordinates for {filename}")
+    is_exif = has_exif & ~ignored
+    lats[is_exif] = exif_lat[is_exif].astype(float).tolist()
+    lons[is_exif] = exif_lon[is_exif].astype(float).tolist()
+    alts[is_exif] = exif_alt[is_exif].astype(float).tolist()
+    sources[is_exif] = 0
 
     # 3) No GPS data found; use photo time and GPS track to determine position
-    if track is None: return None, None
-    tt = photo_row[EXIF_TAG_DATE_TIME].timestamp()
-
-    # Check if time is inside any of the ignore_gpx_intervals
-    intervals = dict(global_config.items('ignore_gpx_intervals'))
-    for name, value in intervals.items():
-        interval = value.split(',')
-        d0 = datetime.fromisoformat(interval[0]).timestamp()
-        d1 = datetime.fromisoformat(interval[1]).timestamp()
-        if tt > d0 and tt < d1 and photo_row[PHOTO_DIRNAME] in interval[2:]:
-            photo_df.loc[index, PHOTO_INTERVAL] = name
-            return None, None
-
-    # Continue track interpolation
-    i0, i1 = get_closests(track, 'timestamp', tt)
-    track_row0 = track.iloc[i0]
-    track_row1 = track.iloc[i1]
-    if track_row0['boundary'] == 1 and track_row1['boundary'] == 1:
-        # It's between tracks
-        return None, None
-    t0 = track_row0['timestamp']
-    t1 = track_row1['timestamp']
-    fract = (tt - t0) / (t1 - t0)
-
-    # Discard any photos outside track time bounds
-    if fract < 0 or fract > 1:
-        return None, None
-
-    # Interpolate
-    lat = track_row0['latitude'] + fract * (track_row1['latitude'] - track_row0['latitude'])
-    lon = track_row0['longitude'] + fract * (track_row1['longitude'] - track_row0['longitude'])
-    alt = track_row0['elevation'] + fract * (track_row1['elevation'] - track_row0['elevation'])
-    return [float(lon), float(lat), float(alt)], 1
-
-def get_closests(df, col, val):
+    if not track is None:
+        remaining = sources == -1
+        in_interval = remaining & pd.notna(np.asarray(intervals, dtype=object))
+        photo_df[PHOTO_INTERVAL] = np.where(in_interval, np.asarray(intervals, dtype=object), None)
+        on_track = np.flatnonzero(remaining & ~in_interval)
+        if len(on_track) > 0:
+            track_lons, track_lats, track_alts, valid = interpolate_track(
+                track, photo_df[PHOTO_TIMESTAMP].to_numpy()[on_track])
+            on_track = on_track[valid]
+            lats[on_track] = track_lats[valid].tolist()
+            lons[on_track] = track_lons[valid].tolist()
+            alts[on_track] = track_alts[valid].tolist()
+            sources[on_track] = 1
+
+    photo_df[PHOTO_LAT] = lats
+    photo_df[PHOTO_LON] = lons
+    photo_df[PHOTO_ALT] = alts
+    photo_df[PHOTO_LOCATION_SOURCE] = sources
+
+# Interpolates the track positions at the given timestamps.
+# Returns arrays of longitudes, latitudes and altitudes, and a mask of the valid positions:
+# timestamps between two tracks or outside the track time bounds can't be interpolated.
+def interpolate_track(track, timestamps):
+    track_timestamps = track['timestamp']
+    boundary = track['boundary']
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+
+    i0, i1 = get_closests(track_timestamps, timestamps)
+
+    t0 = track_timestamps[i0]
+    t1 = track_timestamps[i1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fract = (timestamps - t0) / (t1 - t0)
+
+    # Discard photos between tracks and outside track time bounds
+    between_tracks = (boundary[i0] == 1) & (boundary[i1] == 1)
+    valid = ~between_tracks & ~(fract < 0) & ~(fract > 1)
+
+    positions = []
+    for column in ['longitude', 'latitude', 'elevation']:
+        values = track[column]
+        positions.append(values[i0] + fract * (values[i1] - values[i0]))
+    return positions[0], positions[1], positions[2], valid
+
+# Updates the track positions (location source gpx) of the photos within window (start, stop timestamps)
+# after the tracks changed there, see get_photo_coordinates. The other photos keep their coordinates.
+def update_track_coordinates(photo_df, track, window):
+    sources = photo_df[PHOTO_LOCATION_SOURCE].to_numpy().copy()
+    timestamps = photo_df[PHOTO_TIMESTAMP].to_numpy(dtype=np.float64)
+    affected = np.flatnonzero(np.isin(sources, [-1, 1]) & photo_df[PHOTO_INTERVAL].isna().to_numpy() &
+                              (timestamps >= window[0]) & (timestamps <= window[1]))
+    if len(affected) == 0:
+        return
+    lats = photo_df[PHOTO_LAT].to_numpy(dtype=object).copy()
+    lons = photo_df[PHOTO_LON].to_numpy(dtype=object).copy()
+    alts = photo_df[PHOTO_ALT].to_numpy(dtype=object).copy()
+    lats[affected] = None
+    lons[affected] = None
+    alts[affected] = None
+    sources[affected] = -1
+    if not track is None:
+        track_lons, track_lats, track_alts, valid = interpolate_track(track, timestamps[affected])
+        on_track = affected[valid]
+        lats[on_track] = track_lats[valid].tolist()
+        lons[on_track] = track_lons[valid].tolist()
+        alts[on_track] = track_alts[valid].tolist()
+        sources[on_track] = 1
+    photo_df[PHOTO_LAT] = lats
+    photo_df[PHOTO_LON] = lons
+    photo_df[PHOTO_ALT] = alts
+    photo_df[PHOTO_LOCATION_SOURCE] = sources
+
+# Returns the indices of the values before and after each of the given values (to interpolate between)
+# in a sorted array, clamped to stay within its bounds
+def get_closests(sorted_values, values):
     # Index before "insertion" point
-    i0 = bisect_left(df[col].tolist(), val) - 1
+    i0 = np.searchsorted(sorted_values, values, side='left') - 1
     # Make sure both i0 and i1 will be within bounds
-    i0 = min(max(i0, 0), df.shape[0] - 2)
+    i0 = np.minimum(np.maximum(i0, 0), len(sorted_values) - 2)
     i1 = i0 + 1
     return i0, i1
 
-def process_photos(dir_name, combined_tracks, global_config):
+# Parses the photo date/time strings (DATETIME_FORMAT) and adds delta.
+# Returns the date/times as timezone aware timestamps, keeping the utc offset of each photo,
+# and the corresponding POSIX timestamps.
+def parse_photo_times(values, delta):
+    # Parsing %z is slow in pandas, so parse the local time and the few distinct utc offsets separately
+    parts = values.str.extract(r'^(.*?)([+-]\d\d:?\d\d|Z)$')
+    if parts[1].isna().any():
+        raise ValueError(f"Photo date/time without utc offset: {values[parts[1].isna()].iloc[0]}")
+    local = pd.to_datetime(parts[0], format=DATETIME_FORMAT.removesuffix('%z')) + pd.Timedelta(delta)
+
+    times = pd.Series(None, index=values.index, dtype=object)
+    timestamps = np.empty(len(values))
+    for offset, group in local.groupby(parts[1]):
+        tz = datetime.strptime(offset, '%z').tzinfo
+        aware = group.dt.tz_localize(tz)
+        times[group.index] = aware.astype(object)
+        timestamps[values.index.get_indexer(group.index)] = \
+            (aware.to_numpy(dtype='datetime64[ns]').view(np.int64) // 1000) / 1e6
+    return times, timestamps
+
+def process_photos(dir_name, combined_tracks, ignore_intervals, clean=False, profiler=None):
+    profiler = profiler or Profiler()
     photo_dir = os.path.join(get_datadir(), 'photos', dir_name)
 
     # Read config
@@ -413,196 +765,428 @@ def process_photos(dir_name, combined_tracks, global_config):
         delta_minutes = float(config.get('global', 'delta.minutes', fallback=delta_minutes))
         delta_seconds = float(config.get('global', 'delta.seconds', fallback=delta_seconds))
 
-    # Clean if required
+    # Extract EXIF data of new and changed photos (all photos if clean is set) and write photos.csv
     csv_path = os.path.join(photo_dir, 'photos.csv')
-    do_clean = sys.argv[2] == 'clean' if len(sys.argv) > 2 else False
-    if do_clean:
-        os.remove(csv_path)
-
-    # Execute exiftool if photos.csv does not exist
-    if not os.path.exists(csv_path):
-        print("Executing exiftool for", photo_dir)
-        exiftool_path = os.environ['EXIFTOOL_DIR']
-        wd = os.getcwd()
-        os.chdir(exiftool_path)
-        exif_call = f'./exiftool -filename -gpslatitude# -gpslongitude# -gpsaltitude# -gpsdatestamp -gpstimestamp -datetimeoriginal -createdate -dateFormat "%Y-%m-%d %H:%M:%S%z" -fileOrder filename -T -csv --ext csv {photo_dir} > {csv_path}'
-        subprocess.call(exif_call, shell=True)
-        os.chdir(wd)
+    index_path = os.path.join(get_datadir(), '.cache', 'exif.sqlite')
+    with profiler.stage('exif index'):
+        update_exif_index(index_path, dir_name, photo_dir, csv_path, clean=clean)
 
     # Read and preprocess csv (exiftool output)
     print(f"Processing photos: ${photo_dir}")
-    df = pd.read_csv(csv_path)
+    with profiler.stage('read csv'):
+        df = pd.read_csv(csv_path)
     df = df.rename(str.lower, axis='columns')
 
     # Check if date/time are available
     count = df.shape[0]
-    df = df[df[EXIF_TAG_DATE_TIME] != '-'] # Discard when date/time is unavailable
+    df = df[df[EXIF_TAG_DATE_TIME] != '-'].copy() # Discard when date/time is unavailable
     discard_count = count - df.shape[0]
     if discard_count > 0: print(f"Discarded {discard_count} photos with date/time missing")
 
     # Apply date/time correction & sort
-    df[EXIF_TAG_DATE_TIME] = df[EXIF_TAG_DATE_TIME].apply(lambda s: datetime.strptime(s, DATETIME_FORMAT) + timedelta(hours=delta_hours, minutes=delta_minutes, seconds=delta_seconds))
+    delta = timedelta(hours=delta_hours, minutes=delta_minutes, seconds=delta_seconds)
+    df[EXIF_TAG_DATE_TIME], df[PHOTO_TIMESTAMP] = parse_photo_times(df[EXIF_TAG_DATE_TIME], delta)
     df.sort_values(EXIF_TAG_DATE_TIME, inplace=True)
     df.reset_index(drop=True, inplace=True)
 
     # Some other properties we want to store
-    df[PHOTO_TIMESTAMP] = df[EXIF_TAG_DATE_TIME].apply(lambda dt: dt.timestamp())
-    df[PHOTO_ATTRIBUTION] = [attribution] * df.shape[0]
-    df[PHOTO_DIRNAME] = [dir_name] * df.shape[0] # needed in get_photo_coords
+    df[PHOTO_ATTRIBUTION] = attribution
+    df[PHOTO_DIRNAME] = dir_name
+    df[PHOTO_ID] = f'photo_{dir_name}_' + df.index.astype(str)
+    df[PHOTO_INTERVAL] = None
 
     # Get coordinates from manual/exif/gpx if available
     # (interpolating between photos can only be done later, after all photos have been processed)
-    df[PHOTO_ID] = [None] * df.shape[0]
-    df[PHOTO_LAT] = [None] * df.shape[0]
-    df[PHOTO_LON] = [None] * df.shape[0]
-    df[PHOTO_ALT] = [None] * df.shape[0]
-    df[PHOTO_LOCATION_SOURCE] = [-1] * df.shape[0]
-    df[PHOTO_INTERVAL] = [None] * df.shape[0]
-    for index, row in df.iterrows():
-        df.loc[index, PHOTO_ID] = f'photo_{dir_name}_{index}'
-        coordinates, location_source = get_photo_coordinates(df, index, combined_tracks, config, global_config)
-        if not coordinates is None:
-            df.loc[index, PHOTO_LAT] = coordinates[1]
-            df.loc[index, PHOTO_LON] = coordinates[0]
-            df.loc[index, PHOTO_ALT] = coordinates[2]
-            df.loc[index, PHOTO_LOCATION_SOURCE] = location_source
+    with profiler.stage('coordinates'):
+        intervals = ignore_intervals.lookup(dir_name, df[PHOTO_TIMESTAMP])
+        get_photo_coordinates(df, combined_tracks, config, intervals)
+    profiler.count(photos=count, discarded=discard_count)
 
     return df
 
-def copy_position(source_row, target_df, target_index):
-    target_df.loc[target_index, PHOTO_TIMESTAMP] = source_row['timestamp']
-    target_df.loc[target_index, PHOTO_LAT] = source_row['latitude']
-    target_df.loc[target_index, PHOTO_LON] = source_row['longitude']
-    target_df.loc[target_index, PHOTO_ALT] = source_row['elevation']
-
-def insert_trackpoints(df, trackpoint0, trackpoint1):
-    df.loc[-2] = None # we'll sort later
-    df.loc[-1] = None
-    copy_position(trackpoint0, df, -2)
-    copy_position(trackpoint1, df, -1)
+# Interpolates positions at the given timestamps between anchors: points with known positions.
+# anchor_timestamps must be sorted, anchor_positions has a row (latitude, longitude, altitude) per anchor.
+# Optionally, extra anchors are added per timestamp: extra_timestamps has shape (timestamps, k),
+# extra_positions (timestamps, k, 3).
+# Returns the interpolated positions (a row per timestamp) and a mask of the valid positions:
+# timestamps outside the anchor time bounds can't be interpolated.
+def interpolate_anchors(anchor_timestamps, anchor_positions, timestamps, extra_timestamps=None, extra_positions=None):
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    anchor_count = len(anchor_timestamps)
+
+    # Only the two anchors on either side of a timestamp (or the first/last two) can be used to interpolate,
+    # so take those as candidates and merge in the extra anchors
+    insert_index = np.searchsorted(anchor_timestamps, timestamps, side='left')
+    candidates = insert_index[:, None] + np.arange(-2, 2)[None, :]
+    is_candidate = (candidates >= 0) & (candidates < anchor_count)
+    candidates = np.clip(candidates, 0, max(anchor_count - 1, 0))
+    if anchor_count > 0:
+        candidate_timestamps = anchor_timestamps[candidates]
+        candidate_positions = anchor_positions[candidates]
+    else:
+        candidate_timestamps = np.zeros(candidates.shape)
+        candidate_positions = np.zeros(candidates.shape + (3,))
+    if not extra_timestamps is None:
+        candidate_timestamps = np.concatenate([candidate_timestamps, extra_timestamps], axis=1)
+        candidate_positions = np.concatenate([candidate_positions, extra_positions], axis=1)
+        is_candidate = np.concatenate([is_candidate, np.ones(extra_timestamps.shape, dtype=bool)], axis=1)
+    candidate_timestamps = np.where(is_candidate, candidate_timestamps, np.inf)
+
+    # Sort the candidates and select the ones before and after each timestamp, like get_closests
+    order = np.argsort(candidate_timestamps, axis=1, kind='stable')
+    candidate_timestamps = np.take_along_axis(candidate_timestamps, order, axis=1)
+    candidate_positions = np.take_along_axis(candidate_positions, order[:, :, None], axis=1)
+    candidate_count = is_candidate.sum(axis=1)
+    before_count = (candidate_timestamps < timestamps[:, None]).sum(axis=1)
+    i0 = np.maximum(np.minimum(np.maximum(before_count - 1, 0), candidate_count - 2), 0)
+    i1 = i0 + 1
+    rows = np.arange(len(timestamps))
+
+    t0 = candidate_timestamps[rows, i0]
+    t1 = candidate_timestamps[rows, np.minimum(i1, candidate_timestamps.shape[1] - 1)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fract = (timestamps - t0) / (t1 - t0)
+
+    # Discard any photos outside time bounds
+    valid = (candidate_count >= 2) & ~(fract < 0) & ~(fract > 1)
+
+    p0 = candidate_positions[rows, i0]
+    p1 = candidate_positions[rows, np.minimum(i1, candidate_positions.shape[1] - 1)]
+    return p0 + fract[:, None] * (p1 - p0), valid
+
+# Returns the time range (start, stop timestamps) of the photos whose interpolated coordinates can depend on changes
+# between start and stop: up to the closest anchors (photos with coordinates, and track points) before and after the
+# changes, of the photos outside the ignore_gpx_intervals and of those in each interval (see interpolate_photo_coordinates)
+def get_interpolation_window(df, ignore_intervals, combined_tracks, start, stop):
+    anchors = df[df[PHOTO_LOCATION_SOURCE].isin([0, 1, 2])]
+    anchor_timestamps = anchors[PHOTO_TIMESTAMP].to_numpy(dtype=np.float64)
+    groups = [anchor_timestamps if combined_tracks is None else
+              np.concatenate([anchor_timestamps, combined_tracks['timestamp']])]
+    for name in df[PHOTO_INTERVAL].dropna().unique():
+        groups.append(anchor_timestamps[anchors[PHOTO_DIRNAME].isin(ignore_intervals.dir_names.get(name, [])).to_numpy()])
+    window_start, window_stop = start, stop
+    for timestamps in groups:
+        before = timestamps[timestamps < start]
+        after = timestamps[timestamps > stop]
+        window_start = min(window_start, before.max() if len(before) > 0 else -np.inf)
+        window_stop = max(window_stop, after.min() if len(after) > 0 else np.inf)
+    return window_start, window_stop
+
+# With window (start, stop timestamps), only the photos within it are interpolated, see IncrementalBuild
+def interpolate_photo_coordinates(df, ignore_intervals, combined_tracks, window=None):
     df.sort_values(PHOTO_TIMESTAMP, inplace=True)
     df.reset_index(drop=True, inplace=True)
+    # Photos interpolated earlier (in watch mode) aren't anchors
+    photos_with_coords = df[df[PHOTO_LOCATION_SOURCE].isin([0, 1, 2])]
+    anchor_timestamps = photos_with_coords[PHOTO_TIMESTAMP].to_numpy(dtype=np.float64)
+    anchor_positions = photos_with_coords[[PHOTO_LAT, PHOTO_LON, PHOTO_ALT]].to_numpy(dtype=np.float64)
+    anchor_dirnames = photos_with_coords[PHOTO_DIRNAME].to_numpy()
+
+    timestamps = df[PHOTO_TIMESTAMP].to_numpy(dtype=np.float64)
+    to_interpolate = df[PHOTO_LAT].isna().to_numpy()
+    if not window is None:
+        to_interpolate &= (timestamps >= window[0]) & (timestamps <= window[1])
+    positions = np.full((df.shape[0], 3), np.nan)
+    valid = np.zeros(df.shape[0], dtype=bool)
+
+    # Determine interval and photo selection to interpolate in
+    if combined_tracks is None:
+        groups = [(to_interpolate, None)]
+    else:
+        intervals = df[PHOTO_INTERVAL]
+        groups = [(to_interpolate & intervals.isna().to_numpy(), None)]
+        for name in intervals[to_interpolate].dropna().unique():
+            # Only use the photos in the directories for this interval
+            groups.append((to_interpolate & (intervals == name).to_numpy(), ignore_intervals.dir_names.get(name, [])))
+
+    for mask, dir_names in groups:
+        if not mask.any():
+            continue
+        extra_timestamps = None
+        extra_positions = None
+        selection = np.ones(len(anchor_timestamps), dtype=bool) if dir_names is None else np.isin(anchor_dirnames, dir_names)
+        if not combined_tracks is None and dir_names is None:
+            # Add closest track points
+            track_timestamps = combined_tracks['timestamp']
+            i0, i1 = get_closests(track_timestamps, timestamps[mask])
+            extra_timestamps = np.stack([track_timestamps[i0], track_timestamps[i1]], axis=1)
+            # Only the closest points are gathered from the track columns
+            columns = [combined_tracks[column] for column in ['latitude', 'longitude', 'elevation']]
+            extra_positions = np.stack([np.stack([values[i] for values in columns], axis=1) for i in (i0, i1)], axis=1)
+        positions[mask], valid[mask] = interpolate_anchors(anchor_timestamps[selection], anchor_positions[selection],
+                                                           timestamps[mask], extra_timestamps, extra_positions)
+
+    for index in np.flatnonzero(to_interpolate & ~valid):
+        row = df.iloc[index]
+        print(f"Could not interpolate {row[PHOTO_DIRNAME]}/{row[PHOTO_FILENAME]} at {row[EXIF_TAG_DATE_TIME]}")
 
-def interpolate_photo_coordinates(df, global_config, combined_tracks):
-    df.sort_values(PHOTO_TIMESTAMP, inplace=True)
-    df.reset_index(drop=True, inplace=True)
-    photos_with_coords = df[df[PHOTO_LOCATION_SOURCE] > -1]
-    for index, row in df.iterrows():
-        if row[PHOTO_LAT] is None:
-            # Determine interval and photo selection to interpolate in
-            filtered_photos = photos_with_coords
-            if not combined_tracks is None:
-                if not row[PHOTO_INTERVAL] is None:
-                    interval = global_config.get('ignore_gpx_intervals', row[PHOTO_INTERVAL], fallback='').split(',')
-                    dir_names = interval[2:]
-                    filtered_photos = photos_with_coords[photos_with_coords[PHOTO_DIRNAME].isin(dir_names)]
-                    # filtered_photos = filtered_photos.copy(deep=True) # to prevent SettingWithCopyError
-                    # filtered_photos.reset_index(drop=True, inplace=True)
-                    # # Add track points around interval
-                    # d0 = datetime.fromisoformat(interval[0]).timestamp()
-                    # d1 = datetime.fromisoformat(interval[1]).timestamp()
-                    # i0, _ = get_closests(combined_tracks, 'timestamp', d0)
-                    # _, i1 = get_closests(combined_tracks, 'timestamp', d1)
-                    # insert_trackpoints(filtered_photos, combined_tracks.iloc[i0], combined_tracks.iloc[i1])
-                else:
-                    # Add closest track points
-                    filtered_photos = filtered_photos.copy(deep=True) # to prevent SettingWithCopyError
-                    i0, i1 = get_closests(combined_tracks, 'timestamp', row[PHOTO_TIMESTAMP])
-                    insert_trackpoints(filtered_photos, combined_tracks.iloc[i0], combined_tracks.iloc[i1])
-
-            # Find reference points for interpolation
-            tt = row[PHOTO_TIMESTAMP]
-            i0, i1 = get_closests(filtered_photos, PHOTO_TIMESTAMP, tt)
-            row0 = filtered_photos.iloc[i0]
-            row1 = filtered_photos.iloc[i1]
-            t0 = row0[PHOTO_TIMESTAMP]
-            t1 = row1[PHOTO_TIMESTAMP]
-            fract = (tt - t0) / (t1 - t0)
-
-            # Discard any photos outside time bounds
-            if fract < 0 or fract > 1:
-                print(f"Could not interpolate {row[PHOTO_DIRNAME]}/{row[PHOTO_FILENAME]} at {row[EXIF_TAG_DATE_TIME]}")
-                continue
-
-            # Interpolate
-            df.loc[index, PHOTO_LAT] = row0[PHOTO_LAT] + fract * (row1[PHOTO_LAT] - row0[PHOTO_LAT])
-            df.loc[index, PHOTO_LON] = row0[PHOTO_LON] + fract * (row1[PHOTO_LON] - row0[PHOTO_LON])
-            df.loc[index, PHOTO_ALT] = row0[PHOTO_ALT] + fract * (row1[PHOTO_ALT] - row0[PHOTO_ALT])
-            df.loc[index, PHOTO_LOCATION_SOURCE] = 3
-
-def get_datadir(relative=False):
+    # Interpolate
+    interpolated = df.index[to_interpolate & valid]
+    df.loc[interpolated, PHOTO_LAT] = positions[to_interpolate & valid, 0]
+    df.loc[interpolated, PHOTO_LON] = positions[to_interpolate & valid, 1]
+    df.loc[interpolated, PHOTO_ALT] = positions[to_interpolate & valid, 2]
+    df.loc[interpolated, PHOTO_LOCATION_SOURCE] = 3
+
+# Returns the directory of dataset key, by default the one being built (args.key)
+def get_datadir(relative=False, key=None):
     base_dir = 'data' if relative else os.environ['DATA_DIR']
-    key_dir = sys.argv[1] if len(sys.argv) > 1 else ''
+    key_dir = key if not key is None else args.key if not args is None else ''
     return f'{base_dir}/{key_dir}'
 
-def get_combined_tracks(tracks):
-    if len(tracks) == 0: return None
-    combined_tracks = pd.concat(tracks)
-    combined_tracks.sort_values('time', inplace=True)
-    combined_tracks.reset_index(drop=True, inplace=True)
-    return combined_tracks
+# Returns the rows of a track within [start, stop) (timestamps), plus the rows just before and after,
+# so positions can be interpolated up to the bounds. None if there are no rows within the range.
+def get_track_slice(df, start, stop):
+    timestamps = df['timestamp'].to_numpy()
+    first, last = np.searchsorted(timestamps, [start, stop], side='left')
+    if first == last: return None
+    return df.iloc[max(first - 1, 0):min(last + 1, df.shape[0])].reset_index(drop=True)
+
+# Removes the time chunks of a previous run, see write_chunked_czml
+def remove_chunks(data_dir):
+    manifest_path = os.path.join(data_dir, CHUNKS_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    chunk_dir = os.path.join(data_dir, CHUNKS_DIR)
+    if os.path.isdir(chunk_dir):
+        extensions = tuple(['.czml'] + ['.czml' + extension for extension in COMPRESSION_FORMATS.values()])
+        for name in os.listdir(chunk_dir):
+            if name.endswith(extensions):
+                os.remove(os.path.join(chunk_dir, name))
+
+# Writes the output split up in time chunks of chunk_hours (aligned to UTC midnight for whole days),
+# so the visualizer only needs to load the chunks around the current time:
+# - combined.czml, with the document packet and the photo markers
+# - a chunks/<start>.czml file per chunk with the track polylines, cursors and the tracking entity samples
+#   of that time range. Cursor and tracking entity samples of different chunks are merged by the visualizer.
+# - chunks.json, the manifest that lists the chunks with their time range
+# Returns the paths of the chunk files.
+def write_chunked_czml(data_dir, document_packet, track_tuples, combined_tracks, all_photos, chunk_hours, precision, writer_options,
+                       lod_levels=None, vertex_counts=None, camera_options=None, resample=0, cluster_levels=None):
+    with CzmlWriter(os.path.join(data_dir, 'combined.czml'), **writer_options) as czml:
+        czml.append(document_packet)
+        create_photo_markers(all_photos, czml, cluster_levels)
+
+    tracks = [track_tuple[0] for track_tuple in track_tuples]
+    tracking_path = create_tracking_path(combined_tracks, **(camera_options or {}))
+    tracking_availability = get_availability(tracking_path)
+    track_availabilities = [get_availability(track) for track in tracks]
+    cursor_tracks = [get_cursor_track(track, resample) for track in tracks]
+    chunk_size = chunk_hours * 3600
+    start_timestamp = min(track['timestamp'].min() for track in tracks)
+    stop_timestamp = max(track['timestamp'].max() for track in tracks)
+
+    chunk_dir = os.path.join(data_dir, CHUNKS_DIR)
+    os.makedirs(chunk_dir, exist_ok=True)
+    manifest = []
+    for chunk_index in range(math.floor(start_timestamp / chunk_size), math.floor(stop_timestamp / chunk_size) + 1):
+        start = chunk_index * chunk_size
+        stop = start + chunk_size
+        tracks_in_chunk = [index for index, track in enumerate(tracks)
+                           if track['timestamp'].min() < stop and track['timestamp'].max() >= start]
+        if len(tracks_in_chunk) == 0:
+            continue
+
+        # The polylines of a track are only written to the chunk it starts in, the visualizer keeps that chunk
+        # loaded until lines_stop, the end of the last of its tracks
+        lines_in_chunk = [index for index in tracks_in_chunk
+                          if math.floor(tracks[index]['timestamp'].min() / chunk_size) == chunk_index]
+        lines_stop = max([tracks[index]['timestamp'].max() for index in lines_in_chunk], default=start)
+
+        start_time = datetime.fromtimestamp(start, timezone.utc)
+        chunk_path = os.path.join(chunk_dir, start_time.strftime('%Y%m%dT%H%M%S') + '.czml')
+        with CzmlWriter(chunk_path, **writer_options) as czml:
+            czml.append({ "id": "document", "version": "1.0" })
+            for index in tracks_in_chunk:
+                if index in lines_in_chunk:
+                    df, metadata = track_tuples[index]
+                    for path_object in create_polylines(index, df, metadata, precision, lod_levels, vertex_counts):
+                        czml.append(path_object)
+                track_slice = get_track_slice(cursor_tracks[index], start, stop)
+                if not track_slice is None:
+                    czml.append(create_tracking_cursor(f'point_{index}', track_slice, precision, track_availabilities[index]))
+            path_slice = get_track_slice(tracking_path, start, stop)
+            if not path_slice is None:
+                czml.append(create_tracking_entity('track_entity', path_slice, precision, tracking_availability))
+        manifest.append({
+            "start": start_time.isoformat(),
+            "stop": datetime.fromtimestamp(stop, timezone.utc).isoformat(),
+            "lines_stop": datetime.fromtimestamp(lines_stop, timezone.utc).isoformat(),
+            "path": f'{CHUNKS_DIR}/{os.path.basename(chunk_path)}'
+        })
+
+    path = os.path.join(data_dir, CHUNKS_MANIFEST)
+    print(f"Writing {len(manifest)} chunks of {chunk_hours} hours, manifest {path}")
+    with open(path, 'w') as outfile:
+        json.dump({ "chunks": manifest }, outfile)
+    return [os.path.join(data_dir, chunk['path']) for chunk in manifest]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Combine gpx tracks and photos into a czml file')
+    parser.add_argument('key', nargs='?', default='', help='dataset directory (KEY_DIR) inside DATA_DIR')
+    parser.add_argument('clean', nargs='?', choices=['clean'], help='rerun exiftool for all photos')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes for loading tracks and resizing photos, or for building datasets '
+                             'with --all, 0 to use all cores (default: 1)')
+    parser.add_argument('--all', action='store_true',
+                        help='build all datasets in DATA_DIR (the directories with tracks or photos) and print a summary')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and update the output when tracks or photos are added or changed')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='seconds between checks for changes in watch mode (default: 10)')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'time the preprocessing stages and write a report to {PROFILE_REPORT} in the dataset directory')
+    parser.add_argument('--cprofile', action='store_true',
+                        help=f'like --profile, and also dump cProfile statistics per stage to {PROFILE_DIR}/')
+    args = parser.parse_args(argv)
+    if args.all:
+        # There's no key with --all, so 'clean' ends up as the key
+        if args.key == 'clean' and args.clean is None:
+            args.key, args.clean = '', 'clean'
+        if args.key != '':
+            parser.error('a dataset key cannot be combined with --all')
+        if args.watch:
+            parser.error('--watch cannot be combined with --all')
+    if args.jobs < 1:
+        args.jobs = os.cpu_count() or 1
+    return args
 
 def create_config(combined_tracks):
     return {
         "home_rect": {
-            "west": min(combined_tracks['longitude'] / 180 * math.pi),
-            "south": min(combined_tracks['latitude'] / 180 * math.pi),
-            "east": max(combined_tracks['longitude'] / 180 * math.pi),
-            "north": max(combined_tracks['latitude'] / 180 * math.pi)
+            "west": float(np.min(combined_tracks['longitude'] / 180 * math.pi)),
+            "south": float(np.min(combined_tracks['latitude'] / 180 * math.pi)),
+            "east": float(np.max(combined_tracks['longitude'] / 180 * math.pi)),
+            "north": float(np.max(combined_tracks['latitude'] / 180 * math.pi))
         }
     }
 
-if __name__ == "__main__":
-    dotenv.load_dotenv()
+# Returns the options for CzmlWriter from the output section of the dataset config
+def get_writer_options(config):
+    return {
+        'encoder': config.get('output', 'encoder', fallback='json'),
+        'compact': config.getboolean('output', 'compact', fallback=False),
+        'compress': get_compression_formats(
+            [name for name in config.get('output', 'compress', fallback='gzip,brotli').split(',') if name != '']),
+        'compress_levels': {
+            'gzip': config.getint('output', 'compress.gzip', fallback=COMPRESSION_LEVELS['gzip']),
+            'brotli': config.getint('output', 'compress.brotli', fallback=COMPRESSION_LEVELS['brotli'])
+        }
+    }
+
+# Returns the options for create_tracking_path from the output section of the dataset config
+def get_camera_options(config):
+    return {
+        'window': config.getint('output', 'camera.window', fallback=100),
+        'smoothing_filter': config.get('output', 'camera.filter', fallback='mean'),
+        'resample': config.getfloat('output', 'camera.resample', fallback=config.getfloat('output', 'resample', fallback=0))
+    }
+
+# Returns the start and stop time of the dataset: of the tracks, or of the photos if there are no tracks
+def get_time_bounds(combined_tracks, all_photos):
+    if combined_tracks is None:
+        return min(all_photos[EXIF_TAG_DATE_TIME]), max(all_photos[EXIF_TAG_DATE_TIME])
+    return combined_tracks.time_bounds()
+
+# Builds the output of a single dataset (options.key), options as returned by parse_args().
+# build_info is the git info for the document packet, see get_build_info().
+# Returns the number of tracks, located photos, output files and bytes written.
+def build_dataset(options, build_info=None):
+    global args
+    args = options
     data_dir = get_datadir()
-    czml = []
+    profiler = Profiler(options.profile or options.cprofile, os.path.join(data_dir, PROFILE_DIR) if options.cprofile else None)
 
     # Load global config
     global_config = configparser.RawConfigParser()
     config_path = os.path.join(data_dir, 'config.cfg')
     if os.path.exists(config_path):
         global_config.read(config_path)
+    precision = get_output_precision(global_config)
+    lod_levels = get_lod_levels(global_config)
+    vertex_counts = [0] * max(len(lod_levels), 1)
+    cluster_levels = get_cluster_levels(global_config)
 
-    # Process tracks
+    # Load tracks
     print(f"Loading and combining tracks")
-    track_tuples = load_tracks(os.path.join(data_dir, 'tracks'))
-    for index, track_tuple in enumerate(track_tuples):
-        process_track(track_tuple, czml, index)
-    
+    with profiler.stage('load tracks'):
+        tracks_dir = os.path.join(data_dir, 'tracks')
+        track_tuples = load_tracks(tracks_dir, options.jobs, os.path.join(data_dir, '.cache', 'tracks'), profiler) \
+            if os.path.isdir(tracks_dir) else []
+
     # Combined tracks
-    tracks = list(map(lambda el: el[0], track_tuples))
-    combined_tracks = get_combined_tracks(tracks)
-    #combined_tracks.to_csv(os.path.join(get_datadir(), 'tracks_combined.csv'))
+    with profiler.stage('combine tracks') as stage:
+        tracks = list(map(lambda el: el[0], track_tuples))
+        combined_tracks = write_track_store(os.path.join(data_dir, TRACK_STORE), tracks)
+        stage.count(tracks=len(tracks), points=0 if combined_tracks is None else len(combined_tracks))
 
     # Process photos
+    ignore_intervals = IgnoreIntervals(global_config)
     photo_dfs = []
     photo_dir = os.path.join(data_dir, 'photos')
-    photo_dirs = [name for name in os.listdir(photo_dir) if os.path.isdir(os.path.join(photo_dir, name))]
+    photo_dirs = [name for name in os.listdir(photo_dir) if os.path.isdir(os.path.join(photo_dir, name))] \
+        if os.path.isdir(photo_dir) else []
     photo_dirs.sort()
-    for dir_name in photo_dirs:
-        photo_dfs.append(process_photos(dir_name, combined_tracks, global_config))
-    all_photos = pd.concat(photo_dfs) if len(photo_dfs) > 0 else None
-    # Now that all photos have been processed, interpolate any photos that still miss a location
-    interpolate_photo_coordinates(all_photos, global_config, combined_tracks)
-    create_photo_markers(all_photos, czml)
-
-    # Tracking entity
-    # ! Do this after processing the photos, since we'll smoothen the tracks in-place
-    if len(tracks) > 0:
-        tracking_entity = create_tracking_entity(f'track_entity', tracks)
-        czml.append(tracking_entity)
+    with profiler.stage('process photos') as photos_stage:
+        for dir_name in photo_dirs:
+            with profiler.stage(dir_name):
+                photo_dfs.append(process_photos(dir_name, combined_tracks, ignore_intervals, options.clean == 'clean', profiler))
+        all_photos = pd.concat(photo_dfs) if len(photo_dfs) > 0 else None
+    # The photo stages are skipped for datasets with tracks only (the markers and cluster report skip them as well)
+    if not all_photos is None:
+        # Now that all photos have been processed, interpolate any photos that still miss a location
+        with profiler.stage('interpolate photos'):
+            interpolate_photo_coordinates(all_photos, ignore_intervals, combined_tracks)
+        # Photos by location source
+        sources = all_photos[PHOTO_LOCATION_SOURCE].dropna().astype(int).value_counts()
+        photos_stage.count(photos=len(all_photos), **{f'location_{LOCATION_SOURCES[source]}': count for source, count in sources.items()})
+        if global_config.getboolean('resize', 'enabled', fallback=True):
+            with profiler.stage('resize photos') as stage:
+                add_resized_photos(all_photos, global_config, options.jobs)
+                stage.count(photos=all_photos[PHOTO_LAT].notna().sum())
 
     # Define document packet (now that we know the global start/stop times)
-    starttime = min(all_photos[EXIF_TAG_DATE_TIME]) if combined_tracks is None else min(combined_tracks['time'])
-    stoptime = max(all_photos[EXIF_TAG_DATE_TIME]) if combined_tracks is None else max(combined_tracks['time'])
-    document_packet = create_document_packet("cesium-travelmap", starttime, stoptime)
-    czml.insert(0, document_packet) # put at start
+    document_packet = create_document_packet("cesium-travelmap", *get_time_bounds(combined_tracks, all_photos), build_info)
 
-    # Write output
+    # Write output, packet by packet, starting with the document packet
     path = os.path.join(data_dir, 'combined.czml')
     print(f"Writing output to {path}")
-    with open(path, 'w') as outfile:
-        json.dump(czml, outfile)
+    writer_options = get_writer_options(global_config)
+    chunk_hours = global_config.getfloat('output', 'chunk.hours', fallback=0)
+    resample = global_config.getfloat('output', 'resample', fallback=0)
+    camera_options = get_camera_options(global_config)
+    remove_chunks(data_dir)
+    chunk_paths = []
+    with profiler.stage('write czml') as write_stage:
+        if chunk_hours > 0 and len(tracks) > 0:
+            chunk_paths = write_chunked_czml(data_dir, document_packet, track_tuples, combined_tracks, all_photos, chunk_hours, precision, writer_options,
+                               lod_levels, vertex_counts, camera_options, resample, cluster_levels)
+        else:
+            with CzmlWriter(path, **writer_options) as czml:
+                czml.append(document_packet)
+
+                with profiler.stage('tracks'):
+                    for index, track_tuple in enumerate(track_tuples):
+                        process_track(track_tuple, czml, index, precision, lod_levels, vertex_counts, resample)
+
+                with profiler.stage('photo markers'):
+                    create_photo_markers(all_photos, czml, cluster_levels)
+
+                # Tracking entity
+                if len(tracks) > 0:
+                    with profiler.stage('tracking entity'):
+                        tracking_path = create_tracking_path(combined_tracks, **camera_options)
+                        tracking_entity = create_tracking_entity(f'track_entity', tracking_path, precision)
+                        czml.append(tracking_entity)
+            write_stage.count(packets=czml.packet_count)
+        write_stage.count(files=1 + len(chunk_paths), bytes=sum(os.path.getsize(file) for file in [path] + chunk_paths))
+
+    if len(lod_levels) > 0:
+        print_lod_report(lod_levels, vertex_counts)
+    if len(cluster_levels) > 0:
+        print_cluster_report(all_photos, cluster_levels)
+    # Parsing the output to time it reads it into memory, so only when profiling
+    print_size_report([('combined.czml', [path])] + ([('chunks', chunk_paths)] if len(chunk_paths) > 0 else []),
+                      options.profile or options.cprofile)
 
     # Write config
     if not combined_tracks is None: # TODO: handle photo-only datasets
@@ -611,3 +1195,300 @@ if __name__ == "__main__":
         print(f"Writing config to {path}")
         with open(path, 'w') as outfile:
             json.dump(out_config, outfile)
+
+    profiler.write(os.path.join(data_dir, PROFILE_REPORT))
+    return {
+        'tracks': len(tracks),
+        'photos': 0 if all_photos is None else int(all_photos[PHOTO_LAT].notna().sum()),
+        'files': write_stage.counts['files'],
+        'bytes': write_stage.counts['bytes']
+    }
+
+# Returns the keys of all datasets in DATA_DIR: the directories with a tracks or photos directory
+def find_datasets():
+    base_dir = get_datadir(key='')
+    keys = [name for name in sorted(os.listdir(base_dir))
+            if os.path.isdir(os.path.join(base_dir, name, 'tracks')) or os.path.isdir(os.path.join(base_dir, name, 'photos'))]
+    return keys
+
+# Builds a dataset, catching any error so the other datasets are still built.
+# Returns a summary with the key, the wall time and either the result of build_dataset or the error.
+def build_dataset_isolated(options, build_info=None):
+    start = time.perf_counter()
+    summary = {'key': options.key, 'error': None}
+    try:
+        summary.update(build_dataset(options, build_info))
+    except Exception as error:
+        traceback.print_exc()
+        summary['error'] = f'{type(error).__name__}: {error}'
+    summary['time'] = time.perf_counter() - start
+    return summary
+
+# Builds all datasets in DATA_DIR. With more than one job the datasets are built concurrently in a single
+# pool of jobs processes, each dataset in one process (so a dataset's own tracks and photos aren't split up further).
+# Returns the number of datasets that failed.
+def build_all(options):
+    keys = find_datasets()
+    build_info = get_build_info()
+    print(f"Building {len(keys)} datasets: {', '.join(keys)}")
+    dataset_options = [argparse.Namespace(**{**vars(options), 'key': key, 'jobs': 1 if options.jobs > 1 else options.jobs})
+                       for key in keys]
+    start = time.perf_counter()
+    if options.jobs <= 1 or len(keys) <= 1:
+        summaries = [build_dataset_isolated(dataset, build_info) for dataset in dataset_options]
+    else:
+        with ProcessPoolExecutor(max_workers=min(options.jobs, len(keys))) as executor:
+            futures = [executor.submit(build_dataset_isolated, dataset, build_info) for dataset in dataset_options]
+            summaries = []
+            for key, future in zip(keys, futures):
+                # Errors within a dataset are caught in the worker, this only happens if a worker process died
+                try:
+                    summaries.append(future.result())
+                except Exception as error:
+                    summaries.append({'key': key, 'error': f'{type(error).__name__}: {error}', 'time': None})
+    print_build_summary(summaries, time.perf_counter() - start)
+    return sum(not summary['error'] is None for summary in summaries)
+
+def print_build_summary(summaries, total_time):
+    print("Datasets:")
+    print(f"  {'dataset':<24} {'time':>9} {'tracks':>7} {'photos':>7} {'files':>6} {'size':>10}  status")
+    for summary in summaries:
+        duration = f"{summary['time']:8.1f}s" if not summary['time'] is None else f"{'-':>9}"
+        if summary['error'] is None:
+            print(f"  {summary['key']:<24} {duration} {summary['tracks']:>7} {summary['photos']:>7} {summary['files']:>6} "
+                  f"{summary['bytes'] / 1024:>9.1f}k  ok")
+        else:
+            print(f"  {summary['key']:<24} {duration} {'':>7} {'':>7} {'':>6} {'':>10}  failed: {summary['error']}")
+    failed = sum(not summary['error'] is None for summary in summaries)
+    print(f"  {len(summaries) - failed} of {len(summaries)} datasets built in {total_time:.1f}s")
+
+# Returns a POSIX timestamp as ISO 8601 time for messages, or unbounded for infinite timestamps
+def format_timestamp(timestamp, unbounded):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if np.isfinite(timestamp) else unbounded
+
+# The columns of the photos that their interpolation depends on, as a set of rows, to find the changed photos
+def get_photo_states(photo_dirs):
+    columns = [PHOTO_DIRNAME, PHOTO_FILENAME, PHOTO_TIMESTAMP, PHOTO_LAT, PHOTO_LON, PHOTO_ALT, PHOTO_LOCATION_SOURCE, PHOTO_INTERVAL]
+    return {(row[0], row[1], float(row[2])) + tuple(str(value) for value in row[3:])
+            for df in photo_dirs.values() for row in df[columns].itertuples(index=False)}
+
+# Watch mode (--watch): keeps the processed tracks and photos of a dataset between rebuilds, so after a change
+# only the changed tracks and photo directories are processed again, and only the photos whose coordinates
+# can depend on the change are interpolated again. Each rebuild writes the full output (a single combined.czml,
+# without time chunks) and config.json, and the packets that changed as an update (see watcher.py).
+class IncrementalBuild():
+    def __init__(self, options, build_info=None):
+        global args
+        args = options
+        self.options = options
+        self.build_info = build_info
+        self.data_dir = get_datadir()
+        self.tracks_dir = os.path.join(self.data_dir, 'tracks')
+        self.photo_dir = os.path.join(self.data_dir, 'photos')
+        self.rebuild()
+
+    # Loads the global config and processes everything, starting a new update session
+    def rebuild(self):
+        self.failed = False
+        self.config = configparser.RawConfigParser()
+        config_path = os.path.join(self.data_dir, 'config.cfg')
+        if os.path.exists(config_path):
+            self.config.read(config_path)
+        self.ignore_intervals = IgnoreIntervals(self.config)
+        self.tracks = {}         # path: (dataframe, metadata), in the order of list_tracks
+        self.track_packets = {}  # (index, path): packets of the track
+        self.tracking_entity = None
+        self.combined_tracks = None
+        self.photo_dirs = {}     # directory name: photos with coordinates, before interpolation
+        self.all_photos = None
+        self.packets = None      # the packets of the output, see watcher.index_packets
+        self.update_log = UpdateLog(self.data_dir, get_writer_options(self.config))
+        remove_chunks(self.data_dir)
+
+        self.update_tracks(None)
+        self.update_photos(None, None, self.options.clean == 'clean')
+        self.publish()
+
+    # Processes the changed files (paths relative to the dataset directory) and publishes the changes
+    def update(self, changed):
+        if self.failed or 'config.cfg' in changed:
+            self.rebuild()
+            return
+        # If this update fails, the state isn't consistent anymore, so everything is processed again the next time
+        self.failed = True
+
+        track_paths = {os.path.join(self.data_dir, *path.split('/')) for path in changed if path.startswith('tracks/')}
+        had_tracks = not self.combined_tracks is None
+        track_window = None
+        if len(track_paths) > 0:
+            all_tracks = os.path.join(self.tracks_dir, 'config.cfg') in track_paths
+            track_window = self.update_tracks(None if all_tracks else track_paths)
+
+        dir_names = {path.split('/')[1] for path in changed if path.startswith('photos/')}
+        if had_tracks != (not self.combined_tracks is None):
+            # Photos are only assigned to the ignore_gpx_intervals if there are tracks
+            dir_names = None
+        if dir_names is None or len(dir_names) > 0 or not track_window is None:
+            self.update_photos(dir_names, track_window)
+        self.publish()
+        self.failed = False
+
+    # Loads the added and changed tracks (all tracks if paths is None) and drops the removed ones.
+    # Returns the time range (start, stop timestamps) of the changed tracks, before and after the change, or None.
+    def update_tracks(self, paths):
+        current = list_tracks(self.tracks_dir) if os.path.isdir(self.tracks_dir) else []
+        to_load = [path for path in current if paths is None or path in paths or not path in self.tracks]
+        changed = [track_tuple[0] for path, track_tuple in self.tracks.items() if not path in current or path in to_load]
+        if len(to_load) > 0:
+            loaded = load_tracks(self.tracks_dir, self.options.jobs, os.path.join(self.data_dir, '.cache', 'tracks'),
+                                 paths=to_load)
+            for path, track_tuple in zip(to_load, loaded):
+                self.tracks[path] = track_tuple
+                changed.append(track_tuple[0])
+        self.tracks = {path: self.tracks[path] for path in current}
+
+        changed = [df for df in changed if df.shape[0] > 0]
+        if len(changed) == 0:
+            return None
+        # Unmap the previous store before its file is replaced (which Windows doesn't allow while it's mapped)
+        self.combined_tracks = None
+        self.combined_tracks = write_track_store(os.path.join(self.data_dir, TRACK_STORE), [df for df, _ in self.tracks.values()])
+        self.track_packets = {key: packets for key, packets in self.track_packets.items() if not key[1] in to_load}
+        self.tracking_entity = None
+        return min(df['timestamp'].min() for df in changed), max(df['timestamp'].max() for df in changed)
+
+    # Processes the added and changed photo directories (all directories if dir_names is None), and updates the
+    # track positions of the photos in the other directories within track_window (see update_tracks).
+    # Then interpolates the photos whose coordinates can depend on these changes, the others keep their coordinates.
+    def update_photos(self, dir_names, track_window, clean=False):
+        current = sorted(name for name in os.listdir(self.photo_dir) if os.path.isdir(os.path.join(self.photo_dir, name))) \
+            if os.path.isdir(self.photo_dir) else []
+        previous_states = get_photo_states(self.photo_dirs)
+        photo_dirs = {}
+        for name in current:
+            if dir_names is None or name in dir_names or not name in self.photo_dirs:
+                photo_dirs[name] = process_photos(name, self.combined_tracks, self.ignore_intervals, clean)
+            else:
+                photo_dirs[name] = self.photo_dirs[name]
+                if not track_window is None:
+                    update_track_coordinates(photo_dirs[name], self.combined_tracks, track_window)
+        self.photo_dirs = photo_dirs
+        if len(photo_dirs) == 0:
+            self.all_photos = None
+            return
+        all_photos = pd.concat(photo_dirs.values())
+
+        # Time range of the changes: of the photos that changed (before and after), and of the changed tracks
+        window = None
+        if not dir_names is None and not self.all_photos is None:
+            changed_timestamps = [state[2] for state in previous_states ^ get_photo_states(photo_dirs)]
+            if not track_window is None:
+                changed_timestamps += list(track_window)
+            if len(changed_timestamps) == 0:
+                window = (np.inf, -np.inf) # nothing changed
+            else:
+                window = get_interpolation_window(all_photos, self.ignore_intervals, self.combined_tracks,
+                                                  min(changed_timestamps), max(changed_timestamps))
+                print(f"Interpolating photos from {format_timestamp(window[0], 'the start')} "
+                      f"to {format_timestamp(window[1], 'the end')}")
+
+            # Keep the earlier interpolated coordinates of the photos outside of the window
+            previous = self.all_photos[self.all_photos[PHOTO_LOCATION_SOURCE] == 3].set_index([PHOTO_DIRNAME, PHOTO_FILENAME])
+            keys = pd.MultiIndex.from_frame(all_photos[[PHOTO_DIRNAME, PHOTO_FILENAME]])
+            timestamps = all_photos[PHOTO_TIMESTAMP].to_numpy(dtype=np.float64)
+            keep = all_photos[PHOTO_LAT].isna().to_numpy() & keys.isin(previous.index) & \
+                ((timestamps < window[0]) | (timestamps > window[1]))
+            kept = previous.loc[keys[keep]]
+            for column in [PHOTO_LAT, PHOTO_LON, PHOTO_ALT]:
+                values = all_photos[column].to_numpy(dtype=object).copy()
+                values[keep] = kept[column].to_numpy()
+                all_photos[column] = values
+            sources = all_photos[PHOTO_LOCATION_SOURCE].to_numpy().copy()
+            sources[keep] = 3
+            all_photos[PHOTO_LOCATION_SOURCE] = sources
+
+        interpolate_photo_coordinates(all_photos, self.ignore_intervals, self.combined_tracks, window)
+        if self.config.getboolean('resize', 'enabled', fallback=True):
+            add_resized_photos(all_photos, self.config, self.options.jobs)
+        self.all_photos = all_photos
+
+    # Writes combined.czml and config.json, and the packets that changed since the previous time as an update
+    def publish(self):
+        if self.combined_tracks is None and self.all_photos is None:
+            print("No tracks and photos, nothing to write")
+            return
+        precision = get_output_precision(self.config)
+        resample = self.config.getfloat('output', 'resample', fallback=0)
+        packets = []
+        track_packets = {}
+        for index, (path, track_tuple) in enumerate(self.tracks.items()):
+            key = (index, path)
+            if not key in self.track_packets:
+                self.track_packets[key] = []
+                process_track(track_tuple, self.track_packets[key], index, precision, get_lod_levels(self.config), None, resample)
+            track_packets[key] = self.track_packets[key]
+            packets += track_packets[key]
+        self.track_packets = track_packets
+        create_photo_markers(self.all_photos, packets, get_cluster_levels(self.config))
+        if len(self.tracks) > 0:
+            if self.tracking_entity is None:
+                tracking_path = create_tracking_path(self.combined_tracks, **get_camera_options(self.config))
+                self.tracking_entity = create_tracking_entity('track_entity', tracking_path, precision)
+            packets.append(self.tracking_entity)
+        packets = index_packets(packets)
+
+        document_packet = create_document_packet("cesium-travelmap", *get_time_bounds(self.combined_tracks, self.all_photos),
+                                                 self.build_info)
+        if not self.packets is None:
+            changes = diff_packets(self.packets, packets)
+            # The clock changes if tracks were added before or after all others
+            if document_packet["clock"]["interval"] != self.document_packet["clock"]["interval"]:
+                changes.insert(0, { "id": "document", "version": "1.0", "clock": document_packet["clock"] })
+            path = self.update_log.add(changes)
+            print(f"Update with {len(changes)} changed packets written to {path}" if not path is None else "No changed packets")
+        self.packets = packets
+        self.document_packet = document_packet
+
+        document_packet["travelmap-update"] = self.update_log.document_info()
+        path = os.path.join(self.data_dir, 'combined.czml')
+        print(f"Writing output to {path}")
+        with CzmlWriter(path, **get_writer_options(self.config)) as czml:
+            czml.append(document_packet)
+            for packet, _ in packets.values():
+                czml.append(packet)
+        if not self.combined_tracks is None:
+            with open(os.path.join(self.data_dir, 'config.json'), 'w') as outfile:
+                json.dump(create_config(self.combined_tracks), outfile)
+        self.update_log.write_manifest()
+
+# Builds the dataset, then updates it whenever its input files change, until interrupted
+def watch_dataset(options):
+    build = IncrementalBuild(options, get_build_info())
+    watcher = Watcher(build.data_dir, options.interval)
+    polling = f" every {options.interval:g} seconds" if watcher.observer is None else ""
+    print(f"Watching {build.data_dir} for changes{polling}, press Ctrl+C to stop")
+    try:
+        while True:
+            changed = watcher.wait()
+            print(f"Changed: {', '.join(sorted(changed))}")
+            start = time.perf_counter()
+            try:
+                build.update(changed)
+                print(f"Updated in {time.perf_counter() - start:.1f}s")
+            except Exception:
+                traceback.print_exc()
+                print("Update failed, everything is processed again after the next change")
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        watcher.stop()
+
+if __name__ == "__main__":
+    args = parse_args()
+    dotenv.load_dotenv()
+    if args.all:
+        sys.exit(1 if build_all(args) > 0 else 0)
+    if args.watch:
+        watch_dataset(args)
+    else:
+        build_dataset(args)
@@ -0,0 +1,111 @@
+"""
+Streaming GPX reader.
+Reads track points straight from the XML into numeric arrays, without building a gpxpy object tree,
+and converts them into the track dataframe used by gpx2czml.py.
+"""
+import array
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+# int64 value numpy/pandas use for NaT, used for points without a time
+NAT = np.iinfo(np.int64).min
+
+# Returns the name of an element tag without its namespace, e.g. 'trkpt' for
+# '{http://www.topografix.com/GPX/1/1}trkpt'
+def local_name(tag):
+    return tag.rpartition('}')[2]
+
+# Converts a list of ISO 8601 time strings (None if missing) to int64 epoch nanoseconds
+def parse_times(times):
+    if len(times) == 0:
+        return np.empty(0, dtype=np.int64)
+    return pd.to_datetime(times, utc=True, format='ISO8601').asi8.copy()
+
+# Returns a tuple of arrays (latitudes, longitudes, elevations, epochs, segments) for all track points in a gpx file,
+# in file order. Elevations are NaN where missing, epochs are int64 nanoseconds (NAT where missing).
+# segments contains the index of the first point of each track segment.
+def read_gpx_arrays(path):
+    lats = array.array('d')
+    lons = array.array('d')
+    elevations = array.array('d')
+    times = []
+    segment_ends = [0]
+
+    parents = [] # the elements that are open, starting with the root
+    in_point = 0 # > 0 inside a trkpt
+    # Local names of the tags, determined once per distinct tag
+    names = {}
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        name = names.get(elem.tag) or names.setdefault(elem.tag, local_name(elem.tag))
+        if event == 'start':
+            parents.append(elem)
+            if name == 'trkpt':
+                in_point += 1
+            continue
+        parents.pop()
+
+        if name == 'trkseg':
+            segment_ends.append(len(lats))
+        elif name == 'trkpt':
+            in_point -= 1
+            elevation = np.nan
+            time = None
+            for child in elem:
+                child_name = names.get(child.tag) or names.setdefault(child.tag, local_name(child.tag))
+                if child_name == 'ele':
+                    if child.text:
+                        elevation = float(child.text)
+                elif child_name == 'time':
+                    if child.text:
+                        time = child.text.strip()
+            lats.append(float(elem.get('lat')))
+            lons.append(float(elem.get('lon')))
+            elevations.append(elevation)
+            times.append(time)
+
+        # Remove the processed element from the tree, so memory use stays low for big files (clearing it would
+        # leave an empty element per point in its segment). The children of a point are kept until the point ends.
+        if in_point == 0 and len(parents) > 0:
+            parents[-1].remove(elem)
+
+    segments = np.unique(np.array(segment_ends, dtype=np.int64))
+    return (np.frombuffer(lats, dtype=np.float64),
+            np.frombuffer(lons, dtype=np.float64),
+            np.frombuffer(elevations, dtype=np.float64),
+            parse_times(times),
+            segments[segments < len(lats)])
+
+# Returns the POSIX timestamps of epochs (int64 nanoseconds), NaN where missing
+def epochs_to_timestamps(epochs):
+    # Go through microseconds to get the same floats as datetime.timestamp()
+    timestamps = (epochs // 1000) / 1e6
+    timestamps[epochs == NAT] = np.nan
+    return timestamps
+
+# Builds the track dataframe from point arrays in file order.
+# The first and last points (in file order) are marked as boundaries, then the points are sorted by time.
+def track_dataframe(lats, lons, elevations, epochs):
+    epochs = np.asarray(epochs, dtype=np.int64)
+    timestamps = epochs_to_timestamps(epochs)
+
+    boundary = np.zeros(len(epochs), dtype=np.int64)
+    if len(boundary) > 0:
+        boundary[0] = 1
+        boundary[-1] = 1
+
+    output = pd.DataFrame({
+        'latitude': lats,
+        'longitude': lons,
+        'elevation': elevations,
+        'time': pd.to_datetime(epochs, utc=True),
+        'timestamp': timestamps,
+        'boundary': boundary,
+    })
+    output.sort_values('time', inplace=True, kind='stable')
+    output.reset_index(drop=True, inplace=True)
+    return output
+
+def read_gpx(path):
+    lats, lons, elevations, epochs, _ = read_gpx_arrays(path)
+    return track_dataframe(lats, lons, elevations, epochs)
@@ -0,0 +1,76 @@
+"""
+Interval lookups for the ignore_gpx_intervals section of the dataset config.
+"""
+from datetime import datetime
+import numpy as np
+
+# Index of (possibly overlapping) open intervals, that finds the first interval containing each of a set of values.
+# The boundaries of all intervals split the value range into slots: the boundary values themselves and the
+# open ranges between them. Every slot is either fully inside or fully outside each interval, so the first
+# containing interval can be determined per slot up front, and a lookup is a binary search for the slot.
+class IntervalIndex():
+    def __init__(self, starts, ends):
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        self.points = np.unique(np.concatenate([starts, ends]))
+
+        # Slot 2j + 1 is the boundary value points[j], slot 2j is the open range (points[j - 1], points[j])
+        slot_count = 2 * len(self.points) + 1
+        low = np.full(slot_count, -np.inf)
+        high = np.full(slot_count, np.inf)
+        low[1::2] = self.points
+        high[1::2] = self.points
+        low[2::2] = self.points
+        high[0:-1:2] = self.points
+        exact = np.zeros(slot_count, dtype=bool)
+        exact[1::2] = True
+
+        # A boundary value is inside an interval if start < value < end,
+        # an open range if start <= low and high <= end
+        inside = np.where(exact[:, None],
+                          (starts[None, :] < low[:, None]) & (high[:, None] < ends[None, :]),
+                          (starts[None, :] <= low[:, None]) & (high[:, None] <= ends[None, :]))
+        self.first = np.where(inside.any(axis=1), inside.argmax(axis=1), -1) if len(starts) > 0 \
+            else np.full(slot_count, -1)
+
+    # Returns the position (in the order the index was created with) of the first interval containing
+    # each value, -1 for values that aren't in any interval
+    def lookup(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        position = np.searchsorted(self.points, values, side='left')
+        exact = (position < len(self.points)) & (self.points[np.minimum(position, len(self.points) - 1)] == values) \
+            if len(self.points) > 0 else np.zeros(len(values), dtype=bool)
+        result = self.first[2 * position + exact]
+        result[np.isnan(values)] = -1
+        return result
+
+# The parsed ignore_gpx_intervals config section, entries are of the form
+#   name=start,end,dir_name1,dir_name2,...
+# Photos in one of the directories taken between start and end should not be located using the tracks.
+class IgnoreIntervals():
+    def __init__(self, global_config):
+        self.dir_names = {} # interval name: list of photo directory names
+        self.indexes = {} # photo directory name: (IntervalIndex, list of interval names)
+        if not global_config.has_section('ignore_gpx_intervals'):
+            return
+
+        per_dir = {}
+        for name, value in global_config.items('ignore_gpx_intervals'):
+            interval = value.split(',')
+            start = datetime.fromisoformat(interval[0]).timestamp()
+            end = datetime.fromisoformat(interval[1]).timestamp()
+            self.dir_names[name] = interval[2:]
+            for dir_name in interval[2:]:
+                per_dir.setdefault(dir_name, []).append((start, end, name))
+
+        for dir_name, intervals in per_dir.items():
+            starts, ends, names = zip(*intervals)
+            self.indexes[dir_name] = (IntervalIndex(starts, ends), list(names))
+
+    # Returns the name of the first interval (in config order) that applies to each timestamp
+    # of photos in the given directory, None if no interval applies
+    def lookup(self, dir_name, timestamps):
+        if not dir_name in self.indexes:
+            return [None] * len(timestamps)
+        index, names = self.indexes[dir_name]
+        return [names[position] if position >= 0 else None for position in index.lookup(timestamps)]
@@ -0,0 +1,44 @@
+"""
+Spatial clustering of the photo markers.
+
+With thousands of photos a marker per photo clutters zoomed out views and slows down rendering.
+The photos are grouped in a grid per zoom band instead: the photos in the same grid cell are shown as
+a single cluster marker with the number of photos, and the visualizer expands a cluster by zooming in.
+The grids are nested, so photos that are clustered at one band are also clustered at all coarser bands.
+"""
+import numpy as np
+
+EARTH_RADIUS = 6371000 # meters
+
+# Returns the cluster number of each point, for each of the grid cell sizes (meters, increasing).
+# Cluster numbers are consecutive from 0 for each cell size.
+def cluster_grid(lat, lon, cell_sizes):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if len(lat) == 0:
+        return [np.zeros(0, dtype=np.int64) for _ in cell_sizes]
+
+    # Equirectangular projection, scaled at the mean latitude so the cells are roughly square
+    scale = np.cos(np.radians(np.mean(lat)))
+    x = np.radians(lon) * EARTH_RADIUS * scale
+    y = np.radians(lat) * EARTH_RADIUS
+
+    labels = []
+    cell_x, cell_y, previous_size = x, y, 1
+    for size in cell_sizes:
+        # Each cell is assigned to the coarser cell containing its corner, which keeps the grids nested
+        cell_x = np.floor(cell_x * previous_size / size)
+        cell_y = np.floor(cell_y * previous_size / size)
+        previous_size = size
+        _, inverse = np.unique(np.column_stack([cell_x, cell_y]), axis=0, return_inverse=True)
+        labels.append(inverse.ravel())
+    return labels
+
+# Returns the number of points, the mean latitude and longitude and the point indices of each cluster
+def summarize_clusters(lat, lon, labels):
+    counts = np.bincount(labels)
+    center_lat = np.bincount(labels, weights=lat) / counts
+    center_lon = np.bincount(labels, weights=lon) / counts
+    order = np.argsort(labels, kind='stable')
+    members = np.split(order, np.cumsum(counts)[:-1])
+    return counts, center_lat, center_lon, members
@@ -0,0 +1,103 @@
+"""
+Resized versions of the photos for the visualizer.
+
+Small thumbnails are used in the photo timeline and web sized versions in the infobox, so the
+visualizer doesn't have to download the full resolution originals. The resized photos are written to
+DATA_DIR/KEY_DIR/resized/<size>/<photo dir>/ and are only generated again when the original changed.
+Resizing requires Pillow, without it the visualizer falls back to the originals.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+RESIZED_DIR = 'resized'
+
+# Returns the path of a resized photo, relative to the dataset directory (with forward slashes, as used in urls).
+# The original extension is kept in the name, so e.g. IMG_1.JPG and IMG_1.png don't share a resized file.
+def resized_path(size, dir_name, filename):
+    return '/'.join([RESIZED_DIR, str(size), dir_name, filename + '.jpg'])
+
+# Returns whether Pillow can read files with the extension of filename, videos and other files are skipped
+def is_image(filename):
+    return os.path.splitext(filename)[1].lower() in Image.registered_extensions()
+
+# Resizes a photo to fit each of the sizes (pixels, long edge) and writes it to the corresponding path.
+# Returns the error message if the photo can't be resized, None otherwise.
+def resize_photo(source_path, targets, quality):
+    try:
+        with Image.open(source_path) as image:
+            # Let the JPEG decoder downscale already, which is much faster than decoding the full image
+            largest = max(size for size, _ in targets)
+            image.draft('RGB', (largest, largest))
+            resized = ImageOps.exif_transpose(image).convert('RGB')
+        # Largest first, so each size is resized from the previous one
+        for size, path in sorted(targets, reverse=True):
+            resized.thumbnail((size, size), Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            resized.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        return str(error)
+    return None
+
+# Generates the resized versions of photos (a list of (dir_name, filename) tuples) for each of sizes
+# (a dictionary of name: size), in jobs parallel processes.
+# Returns a dictionary of name: list of resized paths (relative to data_dir, None for photos that
+# couldn't be resized and files that aren't images), or None if Pillow isn't installed.
+def resize_photos(data_dir, photos, sizes, quality=85, jobs=1):
+    if Image is None:
+        print("Pillow is not installed, not generating resized photos")
+        return None
+
+    tasks = []
+    failed = set()
+    for dir_name, filename in photos:
+        if not is_image(filename):
+            failed.add(os.path.join(data_dir, 'photos', dir_name, filename))
+            continue
+        source_path = os.path.join(data_dir, 'photos', dir_name, filename)
+        source_mtime = os.path.getmtime(source_path)
+        targets = []
+        for size in sizes.values():
+            path = os.path.join(data_dir, resized_path(size, dir_name, filename))
+            if not os.path.exists(path) or os.path.getmtime(path) < source_mtime:
+                targets.append((size, path))
+        if len(targets) > 0:
+            tasks.append((source_path, targets))
+
+    if len(tasks) > 0:
+        print(f"Resizing {len(tasks)} new or changed photos")
+    arguments = ([source_path for source_path, _ in tasks], [targets for _, targets in tasks], [quality] * len(tasks))
+    if jobs <= 1 or len(tasks) <= 1:
+        errors = list(map(resize_photo, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            errors = list(executor.map(resize_photo, *arguments, chunksize=8))
+    for (source_path, targets), error in zip(tasks, errors):
+        if not error is None:
+            print(f"Could not resize {source_path}: {error}")
+            failed.add(source_path)
+
+    result = {name: [] for name in sizes}
+    for dir_name, filename in photos:
+        ok = not os.path.join(data_dir, 'photos', dir_name, filename) in failed
+        for name, size in sizes.items():
+            result[name].append(resized_path(size, dir_name, filename) if ok else None)
+    print_resize_report(data_dir, photos, result)
+    return result
+
+def print_resize_report(data_dir, photos, result):
+    original_size = sum(os.path.getsize(os.path.join(data_dir, 'photos', dir_name, filename)) for dir_name, filename in photos)
+    print(f"Resized photos: {len(photos)} originals, {original_size / 1024 / 1024:.1f} MB")
+    for name, paths in result.items():
+        # Photos that couldn't be resized are loaded at their original size
+        size = sum(os.path.getsize(os.path.join(data_dir, path)) if not path is None else
+                   os.path.getsize(os.path.join(data_dir, 'photos', dir_name, filename))
+                   for path, (dir_name, filename) in zip(paths, photos))
+        saved = (1 - size / original_size) * 100 if original_size > 0 else 0
+        print(f"  {name:<10} {size / 1024 / 1024:8.1f} MB, {(original_size - size) / 1024 / 1024:.1f} MB ({saved:.0f}%) saved")
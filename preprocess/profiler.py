@@ -0,0 +1,136 @@
+"""
+Stage timing for the preprocessing pipeline (gpx2czml.py --profile).
+
+Each stage records its wall clock and CPU time, the peak memory use (RSS) of the process at the end of
+the stage, and item counts. Stages can be nested, e.g. a substep per track file or photo directory.
+Substeps that run in worker processes are measured there and added to the report afterwards.
+The report is printed and written as JSON. Optionally every top level stage is also run under
+cProfile, and the statistics are dumped to a .prof file per stage (e.g. for snakeviz or pstats).
+"""
+import cProfile
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+# Returns the peak resident set size in MB of this process, or of its terminated worker processes
+def peak_rss(children=False):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+class Stage():
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0
+        self.cpu_time = 0
+        self.peak_rss = None
+        self.counts = {}
+        self.stages = []
+
+    # Adds to the item counts of the stage, e.g. stage.count(points_in=1000, points_out=100)
+    def count(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + int(value)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'wall_time': round(self.wall_time, 6),
+            'cpu_time': round(self.cpu_time, 6),
+            'peak_rss_mb': round(self.peak_rss, 1) if not self.peak_rss is None else None,
+            'counts': self.counts,
+            'stages': [stage.to_dict() for stage in self.stages]
+        }
+
+# Measures a single stage, without a profiler (e.g. in a worker process). The Stage is returned, so it
+# can be passed back to the main process and added to the profiler with Profiler.add().
+@contextmanager
+def measure(name):
+    stage = Stage(name)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield stage
+    finally:
+        stage.wall_time = time.perf_counter() - wall_start
+        stage.cpu_time = time.process_time() - cpu_start
+        stage.peak_rss = peak_rss()
+
+class Profiler():
+    # Stages are always measured (which is cheap), but only reported if enabled.
+    # With cprofile_dir, each top level stage is run under cProfile and dumped to that directory.
+    def __init__(self, enabled=False, cprofile_dir=None):
+        self.enabled = enabled
+        self.cprofile_dir = cprofile_dir
+        self.root = Stage('total')
+        self.stack = [self.root]
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    # Measures the code in the with block as a substage of the current stage, yields the Stage
+    @contextmanager
+    def stage(self, name):
+        profile = None
+        if not self.cprofile_dir is None and len(self.stack) == 1:
+            profile = cProfile.Profile()
+            profile.enable()
+        with measure(name) as stage:
+            self.stack[-1].stages.append(stage)
+            self.stack.append(stage)
+            try:
+                yield stage
+            finally:
+                self.stack.pop()
+                if not profile is None:
+                    profile.disable()
+                    os.makedirs(self.cprofile_dir, exist_ok=True)
+                    profile.dump_stats(os.path.join(self.cprofile_dir, f'{len(self.root.stages):02d}_{name}.prof'))
+
+    # Adds a stage that was measured elsewhere (see measure()) as a substage of the current stage
+    def add(self, stage):
+        self.stack[-1].stages.append(stage)
+
+    # Adds to the item counts of the current stage
+    def count(self, **counts):
+        self.stack[-1].count(**counts)
+
+    def report(self):
+        self.root.wall_time = time.perf_counter() - self.wall_start
+        self.root.cpu_time = time.process_time() - self.cpu_start
+        self.root.peak_rss = peak_rss()
+        report = self.root.to_dict()
+        children_rss = peak_rss(children=True)
+        report['peak_rss_workers_mb'] = round(children_rss, 1) if not children_rss is None else None
+        return report
+
+    # Prints the report and writes it as JSON to path
+    def write(self, path):
+        if not self.enabled:
+            return
+        report = self.report()
+        print("Profile:")
+        print(f"  {'stage':<40} {'wall':>9} {'cpu':>9} {'peak rss':>10}  counts")
+        print_stage(report, 0)
+        if not report['peak_rss_workers_mb'] is None:
+            print(f"  Peak RSS of worker processes: {report['peak_rss_workers_mb']:.1f} MB")
+        with open(path, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+        print(f"Profile written to {path}" +
+              (f", cProfile statistics to {self.cprofile_dir}" if not self.cprofile_dir is None else ''))
+
+def print_stage(stage, depth):
+    name = '  ' * depth + stage['name']
+    rss = f"{stage['peak_rss_mb']:.1f} MB" if not stage['peak_rss_mb'] is None else '-'
+    counts = ', '.join(f'{key} {value}' for key, value in stage['counts'].items())
+    print(f"  {name:<40} {stage['wall_time']:8.3f}s {stage['cpu_time']:8.3f}s {rss:>10}  {counts}")
+    for substage in stage['stages']:
+        print_stage(substage, depth + 1)
@@ -1,102 +1,94 @@
 """
-Copied from https://gitlab.com/nshephard/tcx2gpx, as the package doesn't seem to expose the TCX2GPX class.
-Also fixed date format to support fractional seconds.
----
-Class for converting tcx to gpx
-"""
-import logging
-from datetime import datetime
-from pathlib import Path
-import dateutil.parser
-
-from gpxpy import gpx
-from tcxparser import TCXParser
-
-# pylint: disable=logging-format-interpolation
-# pylint: disable=logging-fstring-interpolation
+Streaming TCX reader.
+Reads the trackpoints of a tcx file (as exported by Garmin devices) in a single pass straight into numeric arrays,
+in the same form as gpxreader.read_gpx_arrays(), so tcx files go through the track pipeline without converting
+them to gpx first. A gpx version can still be written with write_gpx(), as an optional export.
 
-LOGGER = logging.getLogger('tcx2gpx')
-
-
-class TCX2GPX():
-    """
-    Convert tcx files to gpx.
-    """
-    def __init__(self, tcx_path: str, outdir: str = None):
-        """
-        Initialise the class.
+Originally based on the TCX2GPX class of https://gitlab.com/nshephard/tcx2gpx.
+"""
+import array
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+import numpy as np
 
-        Parameter
-        ---------
-        tcx_path: str
-            Valid path to a TCX file.
-        outdir: str
-            Output directory, if not specified uses the default.
-        """
-        self.tcx_path = Path(tcx_path)
-        self.outdir = outdir
-        self.tcx = None
-        self.track_points = None
-        self.gpx = gpx.GPX()
+from gpxreader import NAT, local_name, parse_times
 
-    def convert(self):
-        """
-        Convert tcx to gpx.
-        """
-        self.read_tcx()
-        self.extract_track_points()
-        self.create_gpx()
-        self.write_gpx()
+# Returns a tuple of arrays (latitudes, longitudes, elevations, epochs, segments) for all trackpoints with a position
+# in a tcx file, in file order. Elevations are NaN where missing, epochs are int64 nanoseconds (NAT where missing).
+# All points form a single segment (the laps of an activity are consecutive), like the converted gpx files did.
+def read_tcx_arrays(path):
+    lats = array.array('d')
+    lons = array.array('d')
+    elevations = array.array('d')
+    times = []
+    # Local names of the tags, determined once per distinct tag (activity files contain millions of elements)
+    names = {}
+    parents = [] # the elements that are open, starting with the root
+    in_point = 0 # > 0 inside a Trackpoint
 
-    def read_tcx(self):
-        """
-        Read a TCX file.
-        """
-        try:
-            self.tcx = TCXParser(str(self.tcx_path.resolve()))
-            LOGGER.info(f'Reading                     : {self.tcx_path}')
-        except TypeError as not_pathlib:
-            raise TypeError('File path did not resolve.') from not_pathlib
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        is_point = (names.get(elem.tag) or names.setdefault(elem.tag, local_name(elem.tag))) == 'Trackpoint'
+        if event == 'start':
+            parents.append(elem)
+            in_point += is_point
+            continue
+        parents.pop()
+        in_point -= is_point
+        # Remove the processed element from the tree, so memory use stays low for big files (clearing it would leave
+        # an empty element per point in its track). The children of a point are kept until the point ends.
+        if in_point == 0 and len(parents) > 0:
+            parents[-1].remove(elem)
+        if not is_point:
+            continue
 
-    def extract_track_points(self):
-        """
-        Extract and combine features from tcx
-        """
-        self.track_points = zip(self.tcx.position_values(),
-                                self.tcx.altitude_points(),
-                                self.tcx.time_values())
-        LOGGER.info(f'Extracting track points from : {self.tcx_path}')
+        lat = None
+        lon = None
+        elevation = np.nan
+        time = None
+        for child in elem:
+            name = names.get(child.tag) or names.setdefault(child.tag, local_name(child.tag))
+            if name == 'Position':
+                for coordinate in child:
+                    coordinate_name = names.get(coordinate.tag) or names.setdefault(coordinate.tag, local_name(coordinate.tag))
+                    if coordinate_name == 'LatitudeDegrees':
+                        lat = float(coordinate.text)
+                    elif coordinate_name == 'LongitudeDegrees':
+                        lon = float(coordinate.text)
+            elif name == 'AltitudeMeters':
+                if child.text:
+                    elevation = float(child.text)
+            elif name == 'Time':
+                if child.text:
+                    time = child.text.strip()
+        # Points without a position (e.g. before the GPS fix, or heart rate only) are skipped
+        if not lat is None and not lon is None:
+            lats.append(lat)
+            lons.append(lon)
+            elevations.append(elevation)
+            times.append(time)
 
-    def create_gpx(self):
-        """
-        Create GPX object.
-        """
-        self.gpx.name = dateutil.parser.parse(
-            self.tcx.started_at).strftime('%Y-%m-%d %H:%M:%S')
-        self.gpx.description = ''
-        gpx_track = gpx.GPXTrack(name=dateutil.parser.parse(
-            self.tcx.started_at).strftime('%Y-%m-%d %H:%M:%S'),
-                                 description='')
-        gpx_track.type = self.tcx.activity_type
-        # gpx_track.extensions = '<topografix:color>c0c0c0</topografix:color>'
-        self.gpx.tracks.append(gpx_track)
-        gpx_segment = gpx.GPXTrackSegment()
-        gpx_track.segments.append(gpx_segment)
-        for track_point in self.track_points:
-            gpx_trackpoint = gpx.GPXTrackPoint(latitude=track_point[0][0],
-                                               longitude=track_point[0][1],
-                                               elevation=track_point[1],
-                                               time=datetime.strptime(
-                                                   track_point[2],
-                                                   '%Y-%m-%dT%H:%M:%S.%f%z'))
-            gpx_segment.points.append(gpx_trackpoint)
-        LOGGER.info(f'Creating GPX for             : {self.tcx_path}')
+    return (np.frombuffer(lats, dtype=np.float64),
+            np.frombuffer(lons, dtype=np.float64),
+            np.frombuffer(elevations, dtype=np.float64),
+            parse_times(times),
+            np.zeros(1 if len(lats) > 0 else 0, dtype=np.int64))
 
-    def write_gpx(self):
-        """
-        Write GPX object to file.
-        """
-        out = Path(str(self.tcx_path.resolve()).replace('.tcx', '.gpx'))
-        with out.open('w', encoding='utf8') as output:
-            output.write(self.gpx.to_xml())
-        LOGGER.info(f'GPX written to               : {out}')
+# Writes points (arrays as returned by read_tcx_arrays) as a gpx file with a single track segment
+def write_gpx(path, lats, lons, elevations, epochs, name=''):
+    epochs = np.asarray(epochs, dtype=np.int64)
+    # Whole seconds, or the fraction all times need. The 'auto' unit would drop the time of day at midnight.
+    timed = epochs[epochs != NAT]
+    unit = next(unit for unit, divisor in [('s', 10**9), ('ms', 10**6), ('us', 10**3), ('ns', 1)] if np.all(timed % divisor == 0))
+    times = np.datetime_as_string(epochs.astype('datetime64[ns]'), unit=unit)
+    with open(path, 'w', encoding='utf8') as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        outfile.write('<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="cesium-travelmap">\n')
+        outfile.write(f'<trk><name>{escape(name)}</name><trkseg>\n')
+        for lat, lon, elevation, epoch, time in zip(lats.tolist(), lons.tolist(), elevations.tolist(), epochs.tolist(), times):
+            outfile.write(f'<trkpt lat="{lat!r}" lon="{lon!r}">')
+            if not np.isnan(elevation):
+                outfile.write(f'<ele>{elevation!r}</ele>')
+            if epoch != NAT:
+                outfile.write(f'<time>{time}Z</time>')
+            outfile.write('</trkpt>\n')
+        outfile.write('</trkseg></trk></gpx>\n')
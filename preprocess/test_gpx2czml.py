@@ -0,0 +1,107 @@
+"""
+Tests for building a dataset with gpx2czml.py.
+
+    python3 -m pytest preprocess
+"""
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import gpx2czml
+
+BUILD_INFO = { "travelmap-sha": None, "travelmap-dirty": False, "travelmap-timestamp": None }
+
+# Writes a gpx file with a single track of point_count points, 5 seconds apart, zigzagging so it can't be simplified
+# to a straight line
+def write_gpx(path, point_count=20, start=datetime(2019, 10, 15, 7, 0, tzinfo=timezone.utc)):
+    with open(path, 'w', encoding='utf8') as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        outfile.write('<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="test"><trk><trkseg>\n')
+        for i in range(point_count):
+            time = (start + timedelta(seconds=5 * i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            outfile.write(f'<trkpt lat="{44 + i * 0.0001 + abs(i % 40 - 20) * 0.0001}" lon="{7.6 + i * 0.0001}"><ele>{700 + i}</ele><time>{time}</time></trkpt>\n')
+        outfile.write('</trkseg></trk></gpx>\n')
+
+# Number of polyline vertices (line_ and lod_ packets) per packet id
+def polyline_vertices(packets):
+    return {packet['id']: len(packet['polyline']['positions']['cartographicDegrees']) // 3 for packet in packets
+            if packet['id'].startswith(('line_', 'lod_'))}
+
+# Test case with a dataset tracks-only in a temporary DATA_DIR
+class DatasetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.previous_data_dir = os.environ.get('DATA_DIR')
+        os.environ['DATA_DIR'] = self.data_dir.name
+        self.dataset_dir = os.path.join(self.data_dir.name, 'tracks-only')
+        os.makedirs(os.path.join(self.dataset_dir, 'tracks'))
+
+    def tearDown(self):
+        if self.previous_data_dir is None:
+            del os.environ['DATA_DIR']
+        else:
+            os.environ['DATA_DIR'] = self.previous_data_dir
+        self.data_dir.cleanup()
+
+class TrackOnlyDatasetTest(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        write_gpx(os.path.join(self.dataset_dir, 'tracks', 'day0.gpx'))
+
+    def build(self):
+        summary = gpx2czml.build_dataset(gpx2czml.parse_args(['tracks-only']), BUILD_INFO)
+        self.assertEqual(summary['tracks'], 1)
+        self.assertEqual(summary['photos'], 0)
+        with open(os.path.join(self.dataset_dir, 'combined.czml')) as infile:
+            packets = json.load(infile)
+        self.assertEqual(packets[0]['id'], 'document')
+        self.assertIn('track_entity', [packet['id'] for packet in packets])
+        self.assertTrue(os.path.exists(os.path.join(self.dataset_dir, 'config.json')))
+
+    def test_without_photo_directory(self):
+        self.build()
+
+    def test_with_empty_photo_directory(self):
+        os.makedirs(os.path.join(self.dataset_dir, 'photos'))
+        self.build()
+
+class ChunkedDatasetTest(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        # A track of about 3.5 hours, and a short one that starts during it
+        write_gpx(os.path.join(self.dataset_dir, 'tracks', 'long.gpx'), 2500)
+        write_gpx(os.path.join(self.dataset_dir, 'tracks', 'short.gpx'), 20,
+                  datetime(2019, 10, 15, 9, 30, tzinfo=timezone.utc))
+
+    def build(self, chunk_hours):
+        with open(os.path.join(self.dataset_dir, 'config.cfg'), 'w') as outfile:
+            outfile.write(f'[output]\nchunk.hours={chunk_hours}\nlod.tolerances=20,200\nlod.distances=20000,200000\n')
+        summary = gpx2czml.build_dataset(gpx2czml.parse_args(['tracks-only']), BUILD_INFO)
+        self.assertEqual(summary['tracks'], 2)
+
+    def test_polylines_are_written_once(self):
+        self.build(0)
+        with open(os.path.join(self.dataset_dir, 'combined.czml')) as infile:
+            expected = polyline_vertices(json.load(infile))
+        self.assertEqual(len(expected), 6) # full track and two levels of detail per track
+
+        self.build(1)
+        with open(os.path.join(self.dataset_dir, 'chunks.json')) as infile:
+            chunks = json.load(infile)['chunks']
+        self.assertEqual(len(chunks), 4)
+        vertices = {}
+        for chunk in chunks:
+            with open(os.path.join(self.dataset_dir, chunk['path'])) as infile:
+                chunk_vertices = polyline_vertices(json.load(infile))
+            self.assertEqual(set(vertices) & set(chunk_vertices), set())
+            vertices.update(chunk_vertices)
+        self.assertEqual(vertices, expected)
+
+        # The chunk of the long track is needed until it ends
+        self.assertEqual(datetime.fromisoformat(chunks[0]['lines_stop']),
+                         datetime(2019, 10, 15, 7, 0, tzinfo=timezone.utc) + timedelta(seconds=5 * 2499))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+Tests of the track readers, smoothing, statistics and photo coordinates against the previous gpxpy and pandas
+implementations (the baselines in benchmark.py).
+
+    python3 -m pytest preprocess
+"""
+import configparser
+import os
+import tempfile
+import unittest
+
+import gpxpy
+import numpy as np
+import pandas as pd
+
+from benchmark import create_coordinate_list_iloc, gpx_to_dataframe, gpxpy_statistics, normalize_track_dataframe, \
+    read_tcx, read_tcx_via_gpx, write_synthetic_gpx, write_synthetic_tcx
+from gpx2czml import EXIF_TAG_ALT, EXIF_TAG_LAT, EXIF_TAG_LON, PHOTO_ALT, PHOTO_FILENAME, PHOTO_INTERVAL, PHOTO_LAT, \
+    PHOTO_LOCATION_SOURCE, PHOTO_LON, PHOTO_TIMESTAMP, create_coordinate_list, get_photo_coordinates
+from gpxreader import read_gpx, read_gpx_arrays, track_dataframe
+from tracksmooth import smooth_track
+from trackstats import track_statistics
+from trackstore import combine_tracks, time_order
+
+START = 1571122800 # 2019-10-15T07:00:00Z
+
+# Returns the points (latitude, longitude, elevation, time) of a zigzagging track, one point per second
+def track_points(point_count, offset=0):
+    return [(44 + i * 0.0001, 7.6 + (i % 3) * 0.00007, 700 + (i * 7) % 13,
+             pd.Timestamp(START + offset + i, unit='s').strftime('%Y-%m-%dT%H:%M:%SZ')) for i in range(point_count)]
+
+# Writes a gpx file with a track segment per list of points, elevation and time are left out where they're None
+def write_gpx(path, segments):
+    with open(path, 'w', encoding='utf8') as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        outfile.write('<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="test"><trk>\n')
+        for points in segments:
+            outfile.write('<trkseg>\n')
+            for lat, lon, ele, time in points:
+                outfile.write(f'<trkpt lat="{lat}" lon="{lon}">' + (f'<ele>{ele}</ele>' if not ele is None else '') +
+                              (f'<time>{time}</time>' if not time is None else '') + '</trkpt>\n')
+            outfile.write('</trkseg>\n')
+        outfile.write('</trk></gpx>\n')
+
+# Track files with edge cases: name: segments
+EDGE_CASES = {
+    'empty_segments': [[], track_points(10), [], track_points(5, 20)],
+    'two_points': [track_points(2)],
+    'missing_elevation': [[(lat, lon, None if i % 3 == 0 else ele, time)
+                           for i, (lat, lon, ele, time) in enumerate(track_points(10))]],
+    'missing_time': [[(lat, lon, ele, None if i == 4 else time)
+                      for i, (lat, lon, ele, time) in enumerate(track_points(10))]]
+}
+
+class TrackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    # Returns the paths of a synthetic gpx track with GPS noise and of the EDGE_CASES files
+    def gpx_paths(self):
+        paths = []
+        path = os.path.join(self.tmp_dir.name, 'synthetic.gpx')
+        write_synthetic_gpx(path, 3000, noise=True)
+        paths.append(path)
+        for name, segments in EDGE_CASES.items():
+            path = os.path.join(self.tmp_dir.name, name + '.gpx')
+            write_gpx(path, segments)
+            paths.append(path)
+        return paths
+
+class ReaderTest(TrackTestCase):
+    def test_same_as_gpxpy(self):
+        for path in self.gpx_paths():
+            with self.subTest(os.path.basename(path)):
+                with open(path, 'r') as gpx_file:
+                    expected = normalize_track_dataframe(gpx_to_dataframe(gpxpy.parse(gpx_file)))
+                pd.testing.assert_frame_equal(expected, read_gpx(path))
+
+    def test_segments(self):
+        path = os.path.join(self.tmp_dir.name, 'empty_segments.gpx')
+        write_gpx(path, EDGE_CASES['empty_segments'])
+        lats, _, _, _, segments = read_gpx_arrays(path)
+        self.assertEqual(len(lats), 15)
+        self.assertEqual(list(segments), [0, 10])
+
+    def test_tcx_same_as_tcxparser(self):
+        for point_count in [3000, 2]:
+            with self.subTest(point_count=point_count):
+                path = os.path.join(self.tmp_dir.name, f'track{point_count}.tcx')
+                write_synthetic_tcx(path, point_count, noise=True)
+                pd.testing.assert_frame_equal(read_tcx_via_gpx(path), read_tcx(path))
+
+class SmoothTest(TrackTestCase):
+    def test_same_as_gpxpy(self):
+        for path in self.gpx_paths():
+            with self.subTest(os.path.basename(path)):
+                with open(path, 'r') as gpx_file:
+                    gpx = gpxpy.parse(gpx_file)
+                for _ in range(10):
+                    gpx.smooth(vertical=True, horizontal=True, remove_extremes=True)
+                gpx.simplify(max_distance=1)
+                expected = normalize_track_dataframe(gpx_to_dataframe(gpx))
+
+                lats, lons, elevations, epochs, segments = read_gpx_arrays(path)
+                keep = smooth_track(lats, lons, elevations, segments, 10, 1)
+                # keep is in file order, the dataframe in time order
+                actual = read_gpx(path)[np.asarray(keep)[time_order(epochs)]].reset_index(drop=True)
+                # The boundaries are those of the whole track, not of the simplified one
+                pd.testing.assert_frame_equal(expected.drop(columns='boundary'), actual.drop(columns='boundary'))
+
+class StatisticsTest(TrackTestCase):
+    def test_same_as_gpxpy(self):
+        for path in self.gpx_paths():
+            with self.subTest(os.path.basename(path)):
+                arrays = read_gpx_arrays(path)
+                expected = gpxpy_statistics(*arrays)
+                actual = track_statistics(*arrays)
+                self.assertEqual({key: actual[key] for key in expected}, expected)
+
+class CoordinatesTest(unittest.TestCase):
+    def test_same_as_row_by_row(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'latitude': 44.0 + np.cumsum(rng.normal(0, 0.00005, 1000)),
+            'longitude': 7.6 + np.cumsum(rng.normal(0, 0.00005, 1000)),
+            'elevation': 700 + np.cumsum(rng.normal(0, 0.5, 1000)),
+            'timestamp': START + 5.0 * np.arange(1000),
+        })
+        self.assertEqual(create_coordinate_list(df), create_coordinate_list_iloc(df))
+        self.assertEqual(create_coordinate_list(df, includeTimestep=False), create_coordinate_list_iloc(df, False))
+
+class PhotoCoordinatesTest(unittest.TestCase):
+    def test_location_sources(self):
+        # Two tracks of 11 points, 10 seconds apart, with a gap of 100 seconds in between
+        tracks = []
+        for offset in [0, 200]:
+            epochs = (START + offset + 10 * np.arange(11)) * 10**9
+            tracks.append(track_dataframe(44 + np.arange(11) * 0.001, 7.6 + np.arange(11) * 0.002,
+                                          700.0 + np.arange(11), epochs.astype(np.int64)))
+        track = combine_tracks(tracks)
+
+        config = configparser.RawConfigParser()
+        config.read_string('[global]\nignore_duplicate_exif_coords=true\n[manual_coords]\nmanual.jpg=8.1,45.1,900\n')
+        photos = [
+            # filename, exif latitude, longitude, altitude, time (seconds after START), interval
+            ('manual.jpg', '44.4', '7.3', '10', 15, None),
+            ('exif.jpg', '44.5', '7.5', '10', 15, None),
+            ('duplicate1.jpg', '44.6', '7.4', '20', 25, None),
+            ('duplicate2.jpg', '44.6', '7.4', '20', 35, None),
+            ('first_track.jpg', '-', '-', '-', 45, None),
+            ('second_track.jpg', '-', '-', '-', 205, None),
+            ('between_tracks.jpg', '-', '-', '-', 150, None),
+            ('after_tracks.jpg', '-', '-', '-', 400, None),
+            ('ignored_interval.jpg', '-', '-', '-', 50, 'x'),
+        ]
+        photo_df = pd.DataFrame(photos, columns=[PHOTO_FILENAME, EXIF_TAG_LAT, EXIF_TAG_LON, EXIF_TAG_ALT,
+                                                 PHOTO_TIMESTAMP, PHOTO_INTERVAL])
+        photo_df[PHOTO_TIMESTAMP] = START + photo_df[PHOTO_TIMESTAMP].astype(np.float64)
+        intervals = photo_df.pop(PHOTO_INTERVAL).tolist()
+        get_photo_coordinates(photo_df, track, config, intervals)
+
+        # Manual 2, EXIF 0, track 1, none -1
+        self.assertEqual(photo_df[PHOTO_LOCATION_SOURCE].tolist(), [2, 0, 1, 1, 1, 1, -1, -1, -1])
+        self.assertEqual(photo_df.loc[0, [PHOTO_LAT, PHOTO_LON, PHOTO_ALT]].tolist(), [45.1, 8.1, 900])
+        self.assertEqual(photo_df.loc[1, [PHOTO_LAT, PHOTO_LON, PHOTO_ALT]].tolist(), [44.5, 7.5, 10])
+        # Halfway between points 2 and 3, and between points 0 and 1 of the second track
+        np.testing.assert_allclose(photo_df.loc[2, [PHOTO_LAT, PHOTO_LON, PHOTO_ALT]].astype(float), [44.0025, 7.605, 702.5])
+        np.testing.assert_allclose(photo_df.loc[5, [PHOTO_LAT, PHOTO_LON, PHOTO_ALT]].astype(float), [44.0005, 7.601, 700.5])
+        self.assertTrue(photo_df.loc[6:, PHOTO_LAT].isna().all())
+        self.assertEqual(photo_df[PHOTO_INTERVAL].tolist(), [None] * 8 + ['x'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Cache of processed tracks, so only new or changed tracks have to be loaded and smoothed again.
+
+Each entry is an .npz file holding the track dataframe columns and the metadata dictionary.
+The entry name is a hash of the source file contents, the track config and the preprocessing code,
+so entries are invalidated automatically when any of those change. The least recently used
+entries are evicted when the cache grows beyond its maximum size.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Bump when the format of the cache entries changes
+CACHE_FORMAT_VERSION = 1
+
+# Source files of the code that produces the cached tracks, any change to them invalidates the cache
+CODE_FILES = ['gpx2czml.py', 'gpxreader.py', 'tracksmooth.py', 'tcx2gpx.py', 'trackstats.py']
+
+CACHE_EXTENSION = '.npz'
+
+def file_digest(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest
+
+def code_version():
+    digest = hashlib.sha256(str(CACHE_FORMAT_VERSION).encode())
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        path = os.path.join(code_dir, name)
+        if os.path.exists(path):
+            file_digest(path, digest)
+    return digest.hexdigest()
+
+# Returns the cache key of a track, based on the file contents, the config and the code version
+def track_cache_key(path, config, version):
+    digest = file_digest(path)
+    config_values = {section: dict(config.items(section)) for section in config.sections() if section != 'cache'}
+    digest.update(json.dumps(config_values, sort_keys=True).encode())
+    digest.update(version.encode())
+    return digest.hexdigest()
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + CACHE_EXTENSION)
+
+# Returns a tuple of dataframe and metadata dictionary, or None if the track isn't cached
+def load_cached_track(cache_dir, key):
+    path = cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            df = pd.DataFrame({
+                'latitude': data['latitude'],
+                'longitude': data['longitude'],
+                'elevation': data['elevation'],
+                'time': pd.to_datetime(data['time'], utc=True),
+                'timestamp': data['timestamp'],
+                'boundary': data['boundary'],
+            })
+            metadata = json.loads(str(data['metadata']))
+    except (OSError, ValueError, KeyError) as error:
+        print(f"Ignoring unreadable cache entry {path}: {error}")
+        return None
+    os.utime(path) # mark as recently used
+    return df, metadata
+
+def store_cached_track(cache_dir, key, df, metadata):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, key)
+    # Write to a temporary file first, so an interrupted run doesn't leave a corrupt entry
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as outfile:
+        np.savez(outfile,
+                 latitude=df['latitude'].to_numpy(dtype=np.float64),
+                 longitude=df['longitude'].to_numpy(dtype=np.float64),
+                 elevation=df['elevation'].to_numpy(dtype=np.float64),
+                 time=df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+                 timestamp=df['timestamp'].to_numpy(dtype=np.float64),
+                 boundary=df['boundary'].to_numpy(dtype=np.int64),
+                 metadata=np.array(json.dumps(metadata)))
+    os.replace(tmp_path, path)
+
+# Removes the least recently used entries until the cache is at most max_size bytes
+def evict_cache(cache_dir, max_size):
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(CACHE_EXTENSION):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, name in entries:
+        if total_size <= max_size:
+            break
+        print(f"Evicting cached track {name}")
+        os.remove(os.path.join(cache_dir, name))
+        total_size -= size
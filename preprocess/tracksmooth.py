@@ -0,0 +1,267 @@
+"""
+Track smoothing and simplification on coordinate arrays.
+
+remove_extremes() and simplify_rdp() reproduce gpxpy's GPXTrackSegment.smooth(vertical=True, horizontal=True,
+remove_extremes=True) and GPXTrackSegment.simplify(), but operate on numpy arrays instead of point objects.
+simplify_visvalingam() is an alternative simplification algorithm.
+"""
+import heapq
+import math
+import numpy as np
+
+# Same constants as gpxpy.geo
+EARTH_RADIUS = 6378.137 * 1000
+ONE_DEGREE = (2 * np.pi * EARTH_RADIUS) / 360
+
+SIMPLIFY_ALGORITHMS = ['rdp', 'visvalingam']
+
+# Vectorized equivalent of gpxpy.geo.distance() without elevation:
+# a flat approximation for close points, haversine for points more than 0.2 degrees apart
+def distance_2d(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (lat1, lon1, lat2, lon2)])
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = [a.ravel() for a in (lat1, lon1, lat2, lon2)]
+    coef = np.cos(np.radians(lat1))
+    x = lat1 - lat2
+    y = (lon1 - lon2) * coef
+    flat = np.sqrt(x * x + y * y) * ONE_DEGREE
+
+    far = (np.abs(lat1 - lat2) > .2) | (np.abs(lon1 - lon2) > .2)
+    if not np.any(far):
+        return flat.reshape(shape)
+    d_lon = np.radians(lon1[far] - lon2[far])
+    rad_lat1 = np.radians(lat1[far])
+    rad_lat2 = np.radians(lat2[far])
+    a = np.sin((rad_lat1 - rad_lat2) / 2) ** 2 + np.sin(d_lon / 2) ** 2 * np.cos(rad_lat1) * np.cos(rad_lat2)
+    flat[far] = EARTH_RADIUS * 2 * np.arcsin(np.sqrt(a))
+    return flat.reshape(shape)
+
+# Returns a boolean mask of the points to keep after one pass of gpxpy's smooth() with
+# vertical, horizontal and remove_extremes enabled. Note that with remove_extremes gpxpy
+# doesn't move any points, it only removes the outliers.
+def remove_extremes(lats, lons, elevations):
+    count = len(lats)
+    keep = np.ones(count, dtype=bool)
+    if count <= 3:
+        return keep
+
+    has_elevation = ~np.isnan(elevations)
+    ele = np.where(has_elevation, elevations, 0)
+    lat = np.nan_to_num(lats)
+    lon = np.nan_to_num(lons)
+
+    # Average distance and elevation difference between consecutive points
+    distances = distance_2d(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    distances = distances[distances != 0]
+    avg_distance = distances.mean() if len(distances) > 0 else 0
+    both_elevations = has_elevation[:-1] & has_elevation[1:]
+    elevation_deltas = np.abs(ele[1:] - ele[:-1])[both_elevations]
+    avg_elevation_delta = elevation_deltas.mean() if len(elevation_deltas) > 0 else 1
+
+    remove_2d_extremes_threshold = 1.75 * avg_distance
+    remove_elevation_extremes_threshold = avg_elevation_delta * 5
+
+    # Vertical: (gpxpy compares the elevation change with the 2d threshold)
+    prev_ele, cur_ele, next_ele = ele[:-2], ele[1:-1], ele[2:]
+    new_ele = 0.4 * prev_ele + 0.2 * cur_ele + 0.4 * next_ele
+    check_vertical = (prev_ele != 0) & (cur_ele != 0) & (next_ele != 0)
+    keep_vertical = (np.minimum(np.abs(cur_ele - prev_ele), np.abs(cur_ele - next_ele)) < remove_elevation_extremes_threshold) & \
+        (np.abs(cur_ele - new_ele) < remove_2d_extremes_threshold)
+    removed_vertical = check_vertical & ~keep_vertical
+
+    # Horizontal
+    prev_lat, cur_lat, next_lat = lat[:-2], lat[1:-1], lat[2:]
+    prev_lon, cur_lon, next_lon = lon[:-2], lon[1:-1], lon[2:]
+    new_lat = 0.4 * prev_lat + 0.2 * cur_lat + 0.4 * next_lat
+    new_lon = 0.4 * prev_lon + 0.2 * cur_lon + 0.4 * next_lon
+    d1 = distance_2d(prev_lat, prev_lon, cur_lat, cur_lon)
+    d2 = distance_2d(next_lat, next_lon, cur_lat, cur_lon)
+    dist = distance_2d(prev_lat, prev_lon, next_lat, next_lon)
+    check_horizontal = d1 + d2 > dist * 1.5
+    moved = distance_2d(cur_lat, cur_lon, new_lat, new_lon)
+    removed_horizontal = check_horizontal & ~(moved < remove_2d_extremes_threshold)
+
+    keep[1:-1] = ~(removed_vertical | removed_horizontal)
+    return keep
+
+# Scalar version of distance_2d(), numpy call overhead dominates for single points
+def point_distance_2d(lat1, lon1, lat2, lon2):
+    if abs(lat1 - lat2) > .2 or abs(lon1 - lon2) > .2:
+        d_lon = math.radians(lon1 - lon2)
+        rad_lat1 = math.radians(lat1)
+        rad_lat2 = math.radians(lat2)
+        a = math.sin((rad_lat1 - rad_lat2) / 2) ** 2 + math.sin(d_lon / 2) ** 2 * math.cos(rad_lat1) * math.cos(rad_lat2)
+        return EARTH_RADIUS * 2 * math.asin(math.sqrt(a))
+    coef = math.cos(math.radians(lat1))
+    x = lat1 - lat2
+    y = (lon1 - lon2) * coef
+    return math.sqrt(x * x + y * y) * ONE_DEGREE
+
+# Distance (meters) of a point to the line through two points, see gpxpy.geo.distance_from_line()
+def distance_from_line(lat, lon, lat1, lon1, lat2, lon2):
+    a = point_distance_2d(lat1, lon1, lat2, lon2)
+    b = point_distance_2d(lat1, lon1, lat, lon)
+    if not a:
+        return b
+    c = point_distance_2d(lat2, lon2, lat, lon)
+    s = (a + b + c) / 2
+    return 2 * math.sqrt(abs(s * (s - a) * (s - b) * (s - c))) / a
+
+# Returns a boolean mask of the points to keep after Ramer-Douglas-Peucker simplification with
+# max_distance in meters. Like gpxpy.geo.simplify_polyline(), the most distant point is
+# selected in plain latitude/longitude space, and only its distance is computed in meters.
+def simplify_rdp(lats, lons, max_distance):
+    count = len(lats)
+    keep = np.ones(count, dtype=bool)
+    if count < 3:
+        return keep
+
+    keep[1:-1] = False
+    # Python floats for the scalar computations below
+    lat_list = lats.tolist()
+    lon_list = lons.tolist()
+    stack = [(0, count - 1)]
+    while stack:
+        begin, end = stack.pop()
+        if end - begin < 2:
+            continue
+        lat = lats[begin + 1:end]
+        lon = lons[begin + 1:end]
+        if lon_list[begin] == lon_list[end]:
+            line_distances = np.abs(lon - lon_list[begin])
+        else:
+            slope = (lat_list[begin] - lat_list[end]) / (lon_list[begin] - lon_list[end])
+            offset = lat_list[begin] - lon_list[begin] * slope
+            line_distances = np.abs(lat - slope * lon - offset)
+        position = begin + 1 + int(line_distances.argmax())
+
+        real_max_distance = distance_from_line(lat_list[position], lon_list[position],
+                                               lat_list[begin], lon_list[begin], lat_list[end], lon_list[end])
+        if real_max_distance < max_distance:
+            continue
+        keep[position] = True
+        stack.append((position, end))
+        stack.append((begin, position))
+    return keep
+
+# Returns a boolean mask of the points to keep after Visvalingam-Whyatt simplification:
+# points are removed, smallest first, while their effective triangle area is below
+# max_distance^2 (square meters).
+def simplify_visvalingam(lats, lons, max_distance):
+    count = len(lats)
+    keep = np.ones(count, dtype=bool)
+    if count < 3:
+        return keep
+
+    # Project to a local plane in meters
+    y = lats * ONE_DEGREE
+    x = lons * ONE_DEGREE * np.cos(np.radians(np.nanmean(lats)))
+    min_area = max_distance ** 2
+
+    def area(i0, i1, i2):
+        return abs((x[i1] - x[i0]) * (y[i2] - y[i0]) - (x[i2] - x[i0]) * (y[i1] - y[i0])) / 2
+
+    previous = np.arange(-1, count - 1)
+    following = np.arange(1, count + 1)
+    areas = np.full(count, np.inf)
+    areas[1:-1] = np.abs((x[1:-1] - x[:-2]) * (y[2:] - y[:-2]) - (x[2:] - x[:-2]) * (y[1:-1] - y[:-2])) / 2
+    heap = [(areas[i], i) for i in range(1, count - 1)]
+    heapq.heapify(heap)
+
+    while heap:
+        point_area, i = heapq.heappop(heap)
+        if not keep[i] or point_area != areas[i]:
+            continue # already removed or stale entry
+        if point_area >= min_area:
+            break
+        keep[i] = False
+        p, n = previous[i], following[i]
+        following[p] = n
+        previous[n] = p
+        # Effective area never decreases, so a removed point doesn't cause its neighbours to be removed earlier
+        for neighbour in (p, n):
+            if 0 < neighbour < count - 1:
+                areas[neighbour] = max(area(previous[neighbour], neighbour, following[neighbour]), point_area)
+                heapq.heappush(heap, (areas[neighbour], neighbour))
+    return keep
+
+# Smooths and simplifies a track, per segment, returns a boolean mask of the points to keep.
+# segments contains the start index of each segment.
+def smooth_track(lats, lons, elevations, segments, iterations=10, tolerance=1, algorithm='rdp'):
+    if algorithm not in SIMPLIFY_ALGORITHMS:
+        raise ValueError(f"Unknown simplification algorithm '{algorithm}', use one of {SIMPLIFY_ALGORITHMS}")
+    simplify = simplify_rdp if algorithm == 'rdp' else simplify_visvalingam
+
+    keep = np.zeros(len(lats), dtype=bool)
+    bounds = list(segments) + [len(lats)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        indices = np.arange(start, stop)
+        for _ in range(iterations):
+            mask = remove_extremes(lats[indices], lons[indices], elevations[indices])
+            if mask.all():
+                break # nothing left to remove, further passes would be identical
+            indices = indices[mask]
+        indices = indices[simplify(lats[indices], lons[indices], tolerance)]
+        keep[indices] = True
+    return keep
+
+SMOOTHING_FILTERS = ['mean', 'gaussian']
+
+# Offsets of a centered window of window samples, relative to the sample in the middle,
+# the same window pandas' rolling(window, center=True) uses (for even sizes one more sample before than after)
+def window_bounds(window):
+    before = window // 2
+    return before, window - 1 - before
+
+# Centered moving average over window samples, ignoring NaN values, with partial windows at the edges.
+# Same as pandas' rolling(window, min_periods=1, center=True).mean(), but computed with cumulative sums.
+def moving_average(values, window):
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    valid = ~np.isnan(values)
+    # Subtract a reference value to limit the rounding errors of the cumulative sums
+    reference = values[valid][0] if valid.any() else 0
+    sums = np.concatenate([[0], np.cumsum(np.where(valid, values - reference, 0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    before, after = window_bounds(window)
+    index = np.arange(count)
+    start = np.maximum(index - before, 0)
+    stop = np.minimum(index + after + 1, count)
+    window_counts = counts[stop] - counts[start]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = (sums[stop] - sums[start]) / window_counts + reference
+    means[window_counts == 0] = np.nan
+    return means
+
+# Centered Gaussian weighted average over window samples (about +/- 3 standard deviations), ignoring NaN values
+def gaussian_average(values, window):
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    reference = values[valid][0] if valid.any() else 0
+    before, after = window_bounds(window)
+    sigma = max(window / 6, 1e-6)
+    weights = np.exp(-0.5 * (np.arange(-before, after + 1) / sigma) ** 2)
+    padding = (before, after)
+    weighted_sums = np.correlate(np.pad(np.where(valid, values - reference, 0), padding), weights, 'valid')
+    weight_sums = np.correlate(np.pad(valid.astype(np.float64), padding), weights, 'valid')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = weighted_sums / weight_sums + reference
+    means[weight_sums == 0] = np.nan
+    return means
+
+def smooth_values(values, window, smoothing_filter='mean'):
+    if smoothing_filter not in SMOOTHING_FILTERS:
+        raise ValueError(f"Unknown smoothing filter '{smoothing_filter}', use one of {SMOOTHING_FILTERS}")
+    if smoothing_filter == 'gaussian':
+        return gaussian_average(values, window)
+    return moving_average(values, window)
+
+# Resamples columns (arrays of the same length as timestamps, which are increasing) at a fixed interval
+# of step seconds, by linear interpolation. The first and last samples are kept.
+# Returns the new timestamps and columns.
+def resample_uniform(timestamps, columns, step):
+    if len(timestamps) < 2:
+        return timestamps, columns
+    uniform = np.arange(timestamps[0], timestamps[-1], step)
+    uniform = np.append(uniform, timestamps[-1])
+    return uniform, [np.interp(uniform, timestamps, column) for column in columns]
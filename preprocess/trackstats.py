@@ -0,0 +1,185 @@
+"""
+Track statistics on coordinate arrays.
+
+track_statistics() computes the metadata of a track from the point arrays in a single pass, instead of
+building a gpxpy object tree and walking it once per statistic. The elevation extremes, time bounds,
+duration, 2d length and ascent/descent are the same as those of gpxpy's GPX.get_elevation_extremes(),
+get_time_bounds(), get_duration(), length_2d() and get_uphill_downhill() (with the default elevation threshold).
+track_profile() downsamples the elevation and speed along the track, for the profiles shown in the visualizer.
+"""
+import numpy as np
+import pandas as pd
+
+from gpxreader import NAT
+from tracksmooth import distance_2d
+
+# Speed (m/s) below which a point counts as stopped, 1 km/h like gpxpy's get_moving_data()
+STOPPED_SPEED = 1 / 3.6
+
+# Fraction of the moving time at the highest speeds that is ignored for the maximum speed, like gpxpy ignores
+# the highest 5% of the speeds
+MAX_SPEED_EXTREMES = 0.05
+
+# Returns the (start, stop) index pairs of the segments, segments contains the index of the first point of each segment
+def segment_ranges(segments, count):
+    bounds = [int(start) for start in segments if start < count] + [count]
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+def epoch_to_datetime(epoch):
+    return pd.Timestamp(epoch, tz='UTC').to_pydatetime()
+
+# Total ascent and descent of elevations (without missing values). Elevation changes are only counted once the
+# elevation has risen (or dropped) at least threshold meters from the last turning point, so noise doesn't add up.
+def ascent_descent(elevations, threshold=0):
+    if len(elevations) < 2:
+        return 0., 0.
+    deltas = np.diff(elevations)
+    if threshold <= 0:
+        # Sequential sums, to get exactly the same result as gpxpy
+        return float(np.cumsum(np.where(deltas > 0, deltas, 0))[-1]), float(np.cumsum(np.where(deltas > 0, 0, -deltas))[-1])
+
+    # Only the turning points (and both ends) can confirm a change of direction
+    elevations = elevations[np.concatenate([[True], deltas != 0])]
+    deltas = np.diff(elevations)
+    turning = np.flatnonzero(np.sign(deltas[1:]) != np.sign(deltas[:-1])) + 1
+    points = elevations[np.concatenate([[0], turning, [len(elevations) - 1]])].tolist()
+
+    ascent = descent = 0.
+    direction = 0 # 1 when climbing, -1 when descending, 0 until the first change of at least threshold
+    low = high = reference = extreme = points[0]
+    for elevation in points[1:]:
+        if direction == 1:
+            if elevation > extreme:
+                extreme = elevation
+            elif extreme - elevation >= threshold:
+                ascent += extreme - reference
+                reference, extreme, direction = extreme, elevation, -1
+        elif direction == -1:
+            if elevation < extreme:
+                extreme = elevation
+            elif elevation - extreme >= threshold:
+                descent += reference - extreme
+                reference, extreme, direction = extreme, elevation, 1
+        else:
+            low, high = min(low, elevation), max(high, elevation)
+            if elevation - low >= threshold:
+                reference, extreme, direction = low, elevation, 1
+            elif high - elevation >= threshold:
+                reference, extreme, direction = high, elevation, -1
+    if direction == 1:
+        ascent += extreme - reference
+    elif direction == -1:
+        descent += reference - extreme
+    return ascent, descent
+
+# Returns the metadata of a track, from the point arrays as returned by gpxreader.read_gpx_arrays():
+# start_time, end_time (ISO 8601), duration (seconds), length_2d (meters), ascent, descent, min_elevation,
+# max_elevation (meters), moving_time, stopped_time (seconds), max_speed and avg_speed (while moving, m/s).
+# Points slower than stopped_speed (m/s) count as stopped, see ascent_descent() for elevation_threshold.
+def track_statistics(lats, lons, elevations, epochs, segments, stopped_speed=STOPPED_SPEED, elevation_threshold=0):
+    count = len(lats)
+    ranges = segment_ranges(segments, count)
+    has_time = epochs != NAT
+    has_elevation = ~np.isnan(elevations)
+
+    # Distance and time between consecutive points, not across segment boundaries. The distance is measured from
+    # each point to the previous one, like gpxpy does, which matters for the last digits.
+    distances = distance_2d(lats[1:], lons[1:], lats[:-1], lons[:-1]) if count > 1 else np.zeros(0)
+    in_segment = np.ones(max(count - 1, 0), dtype=bool)
+    in_segment[[start - 1 for start, _ in ranges[1:]]] = False
+    time_deltas = np.where(has_time[:-1] & has_time[1:], (epochs[1:] - epochs[:-1]) / 1e9, np.nan) if count > 1 else np.zeros(0)
+
+    # Time bounds: the first and last point with a time
+    timed = np.flatnonzero(has_time)
+    start_time = epoch_to_datetime(epochs[timed[0]]).isoformat() if len(timed) > 0 else None
+    end_time = epoch_to_datetime(epochs[timed[-1]]).isoformat() if len(timed) > 0 else None
+
+    duration = 0.
+    length = 0.
+    ascent = 0.
+    descent = 0.
+    for start, stop in ranges:
+        # Duration from the first to the last point, or the second (to last) if that one doesn't have a time
+        if not duration is None and stop - start >= 2:
+            first = start if has_time[start] else start + 1
+            last = stop - 1 if has_time[stop - 1] else stop - 2
+            if not has_time[first] or not has_time[last] or epochs[last] < epochs[first]:
+                duration = None
+            else:
+                duration += (epoch_to_datetime(epochs[last]) - epoch_to_datetime(epochs[first])).total_seconds()
+        if stop - start >= 2:
+            length += float(np.cumsum(distances[start:stop - 1])[-1])
+
+        # Ascent and descent, of the elevations smoothed with their neighbours
+        segment_elevations = elevations[start:stop][has_elevation[start:stop]]
+        smoothed = segment_elevations.copy()
+        if len(smoothed) >= 3:
+            smoothed[1:-1] = segment_elevations[:-2] * .3 + segment_elevations[1:-1] * .4 + segment_elevations[2:] * .3
+        segment_ascent, segment_descent = ascent_descent(smoothed, elevation_threshold)
+        ascent += segment_ascent
+        descent += segment_descent
+
+    # Moving time and speeds
+    timed_steps = in_segment & (time_deltas > 0)
+    speeds = np.zeros(len(distances))
+    speeds[timed_steps] = distances[timed_steps] / time_deltas[timed_steps]
+    moving = timed_steps & (speeds > stopped_speed)
+    moving_time = float(time_deltas[moving].sum())
+    stopped_time = float(time_deltas[timed_steps & ~moving].sum())
+    avg_speed = float(distances[moving].sum()) / moving_time if moving_time > 0 else None
+
+    # Maximum speed, ignoring the highest speeds during a small fraction of the moving time, which are mostly
+    # measurement errors. Weighted by time instead of per step like gpxpy, as simplified tracks have uneven steps.
+    max_speed = None
+    if moving_time > 0:
+        order = np.argsort(speeds[moving], kind='stable')
+        moving_times = np.cumsum(time_deltas[moving][order])
+        index = np.searchsorted(moving_times, moving_times[-1] * (1 - MAX_SPEED_EXTREMES))
+        max_speed = float(speeds[moving][order][min(index, len(order) - 1)])
+
+    return {
+        "start_time": start_time,
+        "end_time": end_time,
+        "duration": duration,
+        "length_2d": length,
+        "ascent": ascent,
+        "descent": descent,
+        "min_elevation": float(np.min(elevations[has_elevation])) if np.any(has_elevation) else None,
+        "max_elevation": float(np.max(elevations[has_elevation])) if np.any(has_elevation) else None,
+        "moving_time": moving_time,
+        "stopped_time": stopped_time,
+        "max_speed": max_speed,
+        "avg_speed": avg_speed
+    }
+
+# Returns the elevation and speed profile of a track, sampled at samples + 1 equally spaced distances along the track
+# (step meters apart): the elevation at each distance, and the average speed while moving between them.
+# Values are None where unknown. Returns None for tracks without length.
+def track_profile(lats, lons, elevations, epochs, segments, samples=100, stopped_speed=STOPPED_SPEED):
+    count = len(lats)
+    if count < 2 or samples < 1:
+        return None
+    distances = distance_2d(lats[1:], lons[1:], lats[:-1], lons[:-1])
+    time_deltas = np.where((epochs[:-1] != NAT) & (epochs[1:] != NAT), (epochs[1:] - epochs[:-1]) / 1e9, 0)
+    # Don't count the gaps between segments, nor the time spent stopped
+    distances[[start - 1 for start, _ in segment_ranges(segments, count)[1:]]] = 0
+    moving = (time_deltas > 0) & (distances > stopped_speed * time_deltas)
+    cumulative_distance = np.concatenate([[0], np.cumsum(distances)])
+    cumulative_time = np.concatenate([[0], np.cumsum(np.where(moving, time_deltas, 0))])
+    if cumulative_distance[-1] <= 0:
+        return None
+
+    sample_distances = np.linspace(0, cumulative_distance[-1], samples + 1)
+    has_elevation = ~np.isnan(elevations)
+    elevation = np.interp(sample_distances, cumulative_distance[has_elevation], elevations[has_elevation]) \
+        if np.any(has_elevation) else np.full(samples + 1, np.nan)
+    sample_times = np.interp(sample_distances, cumulative_distance, cumulative_time)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.diff(sample_distances) / np.diff(sample_times)
+    speed[~np.isfinite(speed)] = np.nan
+
+    return {
+        "step": round(float(sample_distances[1]), 1),
+        "elevation": [None if np.isnan(value) else value for value in np.round(elevation, 1).tolist()],
+        "speed": [None if np.isnan(value) else value for value in np.round(speed, 2).tolist()]
+    }
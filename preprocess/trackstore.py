@@ -0,0 +1,149 @@
+"""
+Compact store of the combined tracks.
+
+The points of all tracks are kept as columns: int64 epochs (nanoseconds), float64 coordinates and uint8 boundary
+flags, track after track, with a table of the offset of each track in the columns. There are no datetime objects,
+and the timestamps (POSIX seconds) are computed from the epochs when they're needed. If the tracks overlap in time,
+the permutation of the points to time order is stored as well, otherwise the columns are in time order already.
+
+write_track_store() writes the columns once to a single file, which is then memory-mapped (read-only) by the
+stages of a build that use the combined tracks, in the building process.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from gpxreader import NAT, epochs_to_timestamps
+
+STORE_MAGIC = b'TRAVELMAP-TRACKS'
+ALIGNMENT = 64 # bytes, the start of each column in the file
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# Returns the epochs (int64 nanoseconds, NAT where missing) of the times of a track dataframe
+def track_epochs(df):
+    return df['time'].values.astype('datetime64[ns]').view(np.int64)
+
+# Returns the order of the points by time. Points without a time come last, and points with the same time keep
+# their order, so the tracks are combined in track order.
+def time_order(epochs):
+    has_time = epochs != NAT
+    timed = np.flatnonzero(has_time)
+    return np.concatenate([timed[np.argsort(epochs[timed], kind='stable')], np.flatnonzero(~has_time)])
+
+# Returns the columns of the combined tracks (track dataframes as returned by gpxreader.track_dataframe)
+def combine_columns(tracks):
+    columns = {
+        'epoch': np.concatenate([track_epochs(df) for df in tracks]),
+        'latitude': np.concatenate([df['latitude'].to_numpy(dtype=np.float64) for df in tracks]),
+        'longitude': np.concatenate([df['longitude'].to_numpy(dtype=np.float64) for df in tracks]),
+        'elevation': np.concatenate([df['elevation'].to_numpy(dtype=np.float64) for df in tracks]),
+        'boundary': np.concatenate([df['boundary'].to_numpy(dtype=np.uint8) for df in tracks]),
+        'offsets': np.cumsum([0] + [df.shape[0] for df in tracks], dtype=np.int64)
+    }
+    order = time_order(columns['epoch'])
+    if np.any(order != np.arange(len(order))):
+        columns['order'] = order
+    return columns
+
+class TrackStore():
+    # columns as returned by combine_columns, path is the file they're memory-mapped from (None if in memory)
+    def __init__(self, columns, path=None):
+        self.columns = columns
+        self.path = path
+        self.sorted_columns = {}
+
+    # Number of points
+    def __len__(self):
+        return len(self.columns['epoch'])
+
+    @property
+    def track_count(self):
+        return len(self.columns['offsets']) - 1
+
+    # Returns a column of all points in time order: epoch, latitude, longitude, elevation, boundary, or
+    # timestamp. Without overlapping tracks, this is the memory-mapped column itself (the timestamps are computed).
+    def __getitem__(self, name):
+        if name in self.sorted_columns:
+            return self.sorted_columns[name]
+        order = self.columns.get('order')
+        if name == 'timestamp':
+            values = epochs_to_timestamps(self['epoch'])
+        elif order is None:
+            return self.columns[name]
+        else:
+            values = self.columns[name][order]
+        self.sorted_columns[name] = values
+        return values
+
+    # Returns a column of the points of track index, in time order (like the track dataframe)
+    def track(self, index, name):
+        start, stop = self.columns['offsets'][index:index + 2]
+        if name == 'timestamp':
+            return epochs_to_timestamps(self.columns['epoch'][start:stop])
+        return self.columns[name][start:stop]
+
+    # Returns the first and last time of the points, as UTC timestamps
+    def time_bounds(self):
+        epochs = self['epoch']
+        epochs = epochs[epochs != NAT]
+        if len(epochs) == 0:
+            return pd.NaT, pd.NaT
+        return pd.Timestamp(epochs[0], tz='UTC'), pd.Timestamp(epochs[-1], tz='UTC')
+
+# Returns a store of the tracks in memory, or None if there are no tracks
+def combine_tracks(tracks):
+    if len(tracks) == 0:
+        return None
+    return TrackStore(combine_columns(tracks))
+
+# Writes the combined tracks to a file at path, and returns the store mapped from it (None if there are no tracks).
+# The file has a JSON header with the type, offset and length of each column, followed by the columns.
+def write_track_store(path, tracks):
+    if len(tracks) == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    columns = combine_columns(tracks)
+    header = {}
+    size = 0
+    for name, values in columns.items():
+        header[name] = { 'dtype': values.dtype.str, 'offset': size, 'length': len(values) }
+        size = align(size + values.nbytes)
+    encoded_header = json.dumps(header).encode('utf8')
+    data_start = align(len(STORE_MAGIC) + 4 + len(encoded_header))
+
+    # Replace the file only when it's complete, a store mapped from the previous version keeps its data
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(STORE_MAGIC)
+        outfile.write(len(encoded_header).to_bytes(4, 'little'))
+        outfile.write(encoded_header)
+        for name, values in columns.items():
+            outfile.seek(data_start + header[name]['offset'])
+            outfile.write(values.tobytes())
+        outfile.truncate(data_start + size)
+    os.replace(tmp_path, path)
+    return open_track_store(path)
+
+# Returns the columns of the store file at path, as read-only views of a single memory map
+def read_columns(path):
+    with open(path, 'rb') as infile:
+        if infile.read(len(STORE_MAGIC)) != STORE_MAGIC:
+            raise ValueError(f"{path} is not a track store")
+        header_length = int.from_bytes(infile.read(4), 'little')
+        header = json.loads(infile.read(header_length))
+    data_start = align(len(STORE_MAGIC) + 4 + header_length)
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    columns = {}
+    for name, column in header.items():
+        dtype = np.dtype(column['dtype'])
+        start = data_start + column['offset']
+        columns[name] = data[start:start + column['length'] * dtype.itemsize].view(dtype)
+    return columns
+
+def open_track_store(path):
+    return TrackStore(read_columns(path), path)
@@ -0,0 +1,170 @@
+"""
+Change detection and incremental output for watch mode (gpx2czml.py --watch).
+
+The input files of a dataset (the global config, the tracks and the photo directories) are polled for changes.
+If watchdog is installed, file system events (inotify on Linux) wake up the polling loop right away instead.
+After each rebuild the packets that changed are written as an update: a small CZML file with the new and changed
+packets and a delete packet for each removed one, listed in updates.json. The visualizer polls updates.json and
+applies the updates to the loaded data with CzmlDataSource.process, so it doesn't have to reload everything.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from czmlwriter import COMPRESSION_FORMATS, CzmlWriter
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+UPDATES_MANIFEST = "updates.json"
+UPDATES_DIR = "updates"
+MAX_UPDATES = 100 # updates listed in the manifest, a visualizer that is further behind reloads everything
+SETTLE_TIME = 2 # seconds without changes before a change is processed, e.g. while photos are still being copied
+
+# Files written by the preprocessing itself, which aren't input
+IGNORED_FILES = ['photos.csv']
+
+# Returns {path: (modification time, size)} of the input files of the dataset in data_dir: the global config,
+# the files in tracks/ and in each directory in photos/. Paths are relative to data_dir, with forward slashes.
+def snapshot(data_dir):
+    files = {}
+    def add_files(relative_dir):
+        directory = os.path.join(data_dir, relative_dir)
+        if not os.path.isdir(directory):
+            return
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name in IGNORED_FILES and not entry.name.startswith('.'):
+                stat = entry.stat()
+                files[f'{relative_dir}/{entry.name}'] = (stat.st_mtime_ns, stat.st_size)
+
+    config_path = os.path.join(data_dir, 'config.cfg')
+    if os.path.exists(config_path):
+        stat = os.stat(config_path)
+        files['config.cfg'] = (stat.st_mtime_ns, stat.st_size)
+    add_files('tracks')
+    photo_dir = os.path.join(data_dir, 'photos')
+    if os.path.isdir(photo_dir):
+        for entry in os.scandir(photo_dir):
+            if entry.is_dir():
+                add_files(f'photos/{entry.name}')
+    return files
+
+# Returns the paths that were added, removed or changed between two snapshots
+def changed_files(previous, current):
+    return {path for path in previous.keys() | current.keys() if previous.get(path) != current.get(path)}
+
+class Watcher():
+    # Polls the input files of the dataset in data_dir every interval seconds, or as soon as watchdog reports an event
+    def __init__(self, data_dir, interval=10):
+        self.data_dir = data_dir
+        self.interval = interval
+        self.files = snapshot(data_dir)
+        self.event = threading.Event()
+        self.observer = None
+        if not Observer is None:
+            handler = FileSystemEventHandler()
+            handler.on_any_event = lambda event: self.event.set()
+            self.observer = Observer()
+            self.observer.schedule(handler, data_dir, recursive=True)
+            self.observer.start()
+
+    # Blocks until input files change, and returns the changed paths (relative to data_dir)
+    def wait(self):
+        while True:
+            self.event.wait(self.interval)
+            self.event.clear()
+            files = snapshot(self.data_dir)
+            if files == self.files:
+                continue
+            # Wait until the files stop changing
+            while True:
+                time.sleep(SETTLE_TIME)
+                settled = snapshot(self.data_dir)
+                if settled == files:
+                    break
+                files = settled
+            changed = changed_files(self.files, files)
+            self.files = files
+            if len(changed) > 0:
+                return changed
+
+    def stop(self):
+        if not self.observer is None:
+            self.observer.stop()
+            self.observer.join()
+
+# Returns the packets by id, with their JSON encoding to compare them by (NaN isn't equal to itself)
+def index_packets(packets):
+    return {packet["id"]: (packet, json.dumps(packet)) for packet in packets}
+
+# Returns the packets that turn a visualizer's previous packets into the current ones (both as returned by
+# index_packets): a delete packet for each removed packet, and the new and changed packets. Changed packets are
+# deleted first as well, because CzmlDataSource.process merges a packet into the existing entity, which would
+# keep the properties that are left out of the new packet.
+def diff_packets(previous, current):
+    packets = [{ "id": id, "delete": True } for id in previous if not id in current]
+    for id, (packet, encoded) in current.items():
+        if id in previous and previous[id][1] != encoded:
+            packets.append({ "id": id, "delete": True })
+        if not id in previous or previous[id][1] != encoded:
+            packets.append(packet)
+    return packets
+
+class UpdateLog():
+    # Starts a new session, removing the updates of a previous session. A visualizer that loaded the
+    # data of another session (see document_info) reloads everything.
+    def __init__(self, data_dir, writer_options=None):
+        self.data_dir = data_dir
+        # Updates are small and only read once by the visualizers that are open, not worth compressing
+        self.writer_options = dict(writer_options or {}, compress=())
+        self.session = datetime.now().isoformat()
+        self.sequence = 0
+        self.updates = []
+        update_dir = os.path.join(data_dir, UPDATES_DIR)
+        if os.path.isdir(update_dir):
+            for name in os.listdir(update_dir):
+                os.remove(os.path.join(update_dir, name))
+        self.write_manifest()
+
+    # The update state to add to the document packet of the full output, so a visualizer knows
+    # which updates it still needs to apply
+    def document_info(self):
+        return { "session": self.session, "sequence": self.sequence }
+
+    # Writes packets as the next update. Returns its path, or None if there are no packets.
+    def add(self, packets):
+        if len(packets) == 0:
+            return None
+        self.sequence += 1
+        path = os.path.join(self.data_dir, UPDATES_DIR, f'{self.sequence:06d}.czml')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with CzmlWriter(path, **self.writer_options) as czml:
+            czml.append({ "id": "document", "version": "1.0" })
+            for packet in packets:
+                czml.append(packet)
+        self.updates.append({
+            "sequence": self.sequence,
+            "path": f'{UPDATES_DIR}/{os.path.basename(path)}',
+            "packets": len(packets),
+            "generated-at": datetime.now().isoformat()
+        })
+        for update in self.updates[:-MAX_UPDATES]:
+            for extension in [''] + list(COMPRESSION_FORMATS.values()):
+                old_path = os.path.join(self.data_dir, update['path'] + extension)
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+        self.updates = self.updates[-MAX_UPDATES:]
+        return path
+
+    # Writes the manifest, call it after the full output is written as well
+    def write_manifest(self):
+        path = os.path.join(self.data_dir, UPDATES_MANIFEST)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as outfile:
+            json.dump({ "session": self.session, "sequence": self.sequence, "updates": self.updates }, outfile)
+        os.replace(tmp_path, path)
@@ -54,7 +54,11 @@ let poiEntities;   // entityList
 let lastSelectedFlyToEntity; // tracked to determine camera position when flying to a new entity
 let lastSelectedInfoboxEntity;
 let trackedEntity; //entity to track
+let czmlDataSource; // the data source of combined.czml and any time chunks
+let chunks = [];    // time chunks, see loadChunks
 let isFlyingToEntity = false; // a flag to indicate if the camera is moving because of a flyToEntity call
+let loadedUpdate;   // session and sequence of the loaded data in watch mode, see watchUpdates
+const UPDATE_INTERVAL = 30000; // ms between checks for updates in watch mode
 
 // "Class" that keeps track of a list of entities and the selected entity,
 // has previous/next functions that also update the viewer.selectedEntity
@@ -84,7 +88,9 @@ const entityList = (entities) => {
 const updateInfobox = entity => {
   lastSelectedInfoboxEntity = entity;
   document.querySelector('#track-metadata').style.display = 'none'; // hide metadata
-  document.querySelector('#selectedPhoto').src = entity.properties.src;
+  // Show the web sized version if one was generated, the original otherwise
+  document.querySelector('#selectedPhoto').src = entity.properties.hasProperty('web') ?
+    entity.properties.web : entity.properties.src;
   document.querySelector('#selectedPhotoCaption').innerHTML = entity.name;
   document.querySelector("#selectedPhoto").style.display = ''; // show photo
   document.querySelector(".cesium-infoBox").style.display = ''; // show the box
@@ -98,6 +104,37 @@ const updateInfoboxPOI = entity => {
   document.querySelector(".cesium-infoBox").style.display = ''; // show the box
 }
 
+const formatDuration = d => `${Math.floor(d / 3600)}h ${Math.floor((d % 3600) / 60)}m ${Math.floor(d % 60)}s`;
+
+// Returns the points attribute of an SVG polyline for values (null where unknown) at equal distances,
+// scaled to the width and height of the view box
+const profilePoints = (values, width, height) => {
+  const known = values.filter(v => v !== null);
+  const min = Math.min(...known);
+  const range = Math.max(...known) - min || 1;
+  return values
+    .map((v, i) => v === null ? null : `${(i / (values.length - 1) * width).toFixed(1)},${(height - (v - min) / range * height).toFixed(1)}`)
+    .filter(p => p !== null)
+    .join(' ');
+}
+
+// Returns an inline SVG with the elevation profile of a track, and its speed (the average between the
+// elevation samples) as a thinner line
+const createProfile = profile => {
+  const width = 300;
+  const height = 60;
+  const lines = [];
+  if (profile.elevation.some(v => v !== null)) {
+    lines.push(`<polyline points="${profilePoints(profile.elevation, width, height)}" fill="none" stroke="#78beff" stroke-width="2" />`);
+  }
+  if (profile.speed.some(v => v !== null)) {
+    lines.push(`<polyline points="${profilePoints(profile.speed, width, height)}" fill="none" stroke="#ffbe78" stroke-width="1" />`);
+  }
+  const distance = (profile.step * (profile.elevation.length - 1) / 1000).toFixed(1);
+  return `<svg viewBox="0 0 ${width} ${height}" width="100%" preserveAspectRatio="none">${lines.join('')}` +
+    `<title>Elevation (blue) and speed (orange) over ${distance} km</title></svg>`;
+}
+
 const updateInfoboxTrackEntity = entity => {
   lastSelectedInfoboxEntity = entity;
   document.querySelector("#selectedPhoto").style.display = 'none'; // hide photo
@@ -120,7 +157,7 @@ const updateInfoboxTrackEntity = entity => {
     },
     duration: {
       label: "Duration",
-      format: d => `${Math.floor(d / 3600)}h ${Math.floor((d % 3600) / 60)}m ${Math.floor(d % 60)}s`
+      format: formatDuration
     },
     length_2d: {
       label: "Distance",
@@ -142,10 +179,28 @@ const updateInfoboxTrackEntity = entity => {
       label: "Max elevation",
       format: d => `${d.toFixed(0)} meters`
     },
+    moving_time: {
+      label: "Moving time",
+      format: formatDuration
+    },
+    avg_speed: {
+      label: "Average speed",
+      format: d => `${(d * 3.6).toFixed(1)} km/h`
+    },
+    max_speed: {
+      label: "Max speed",
+      format: d => `${(d * 3.6).toFixed(1)} km/h`
+    },
   }
   
-  table.innerHTML = Object.keys(props).map(key => 
-    `<tr><td>${props[key].label}</td><td>${props[key].format(entity.properties[key]._value)}</td></tr>`).join('');
+  // Tracks generated by older versions don't have all statistics, and some are unknown (null) without times
+  table.innerHTML = Object.keys(props)
+    .filter(key => entity.properties.hasProperty(key) && entity.properties[key]._value !== null)
+    .map(key => `<tr><td>${props[key].label}</td><td>${props[key].format(entity.properties[key]._value)}</td></tr>`)
+    .join('');
+  if (entity.properties.hasProperty('profile') && entity.properties.profile._value) {
+    table.innerHTML += `<tr><td colspan="2">${createProfile(entity.properties.profile._value)}</td></tr>`;
+  }
   
   document.querySelector(".cesium-infoBox").style.display = ''; // show the box
 }
@@ -272,6 +327,22 @@ const closeInfoBox = () => {
 document.querySelector('.cesium-infoBox-close').onclick = closeInfoBox;
 
 
+// Flies the camera to the photos of a cluster, close enough for the cluster to be expanded
+const expandCluster = entity => {
+  const positions = entity.properties.members._value
+    .map(id => czmlDataSource.entities.getById(id))
+    .filter(member => member !== undefined)
+    .map(member => member.position.getValue(viewer.clock.currentTime));
+  if (positions.length === 0) return;
+  const boundingSphere = Cesium.BoundingSphere.fromPoints(positions);
+  // Stay below the distance at which the photos are clustered
+  const maxRange = entity.point.distanceDisplayCondition.getValue(viewer.clock.currentTime).near;
+  const range = Math.min(Math.max(3 * boundingSphere.radius, 1000), 0.9 * maxRange);
+  viewer.camera.flyToBoundingSphere(boundingSphere, {
+    offset: new Cesium.HeadingPitchRange(viewer.camera.heading, -Math.PI / 4, range)
+  });
+};
+
 // Handler for selecting a timeline photo (img)
 const selectTimelinePhoto = entity => {
   viewer.selectedEntity = entity; // this will trigger onSelectEntity
@@ -280,7 +351,16 @@ const selectTimelinePhoto = entity => {
 // Handler for map selection of an entity.
 // Don't call directly, but set viewer.selectedEntity to trigger it.
 const onSelectEntity = entity => {
-  if (Cesium.defined(entity) && entity.id.startsWith('line_')) {
+  if (Cesium.defined(entity) && entity.id.startsWith('lod_')) {
+    // Simplified track (level of detail), select the full track instead
+    viewer.selectedEntity = czmlDataSource.entities.getById(entity.properties.line._value);
+  }
+  else if (Cesium.defined(entity) && entity.id.startsWith('cluster_')) {
+    // Photo cluster, zoom in on its photos so they are shown individually
+    expandCluster(entity);
+    viewer.selectedEntity = undefined;
+  }
+  else if (Cesium.defined(entity) && entity.id.startsWith('line_')) {
     trackEntities.select(entity);
     updateInfoboxTrackEntity(entity);
   }
@@ -313,73 +393,185 @@ photoTimeline.addEventListener('wheel', (event) => {
   });
 });
 
+// Lazy loading for the images in the photo timeline
+const photoObserver = new IntersectionObserver((entries, observer) => {
+  for (let entry of entries) {
+    if (entry.isIntersecting) {
+      const img = entry.target;
+      if (img.src === placeholderImage) {
+        img.setAttribute('src', img.getAttribute('lazysrc'));
+      }
+    }
+  }
+}, {
+  root: photoTimeline, rootMargin: '0px', threshold: 0.01
+});
+
+// Updates the sorted list of photo entities and the photo timeline, after loading data
+const updatePhotoEntities = () => {
+  // Get a sorted list of all photo entities
+  const allEntities = czmlDataSource.entities.values;
+  const filteredEntities = allEntities.filter(entity => entity.id.startsWith('photo'));
+  filteredEntities.sort((a, b) => { 
+    return a.properties.time._value.localeCompare(b.properties.time._value);
+  });
+  photoEntities = entityList(filteredEntities);
+  if (lastSelectedInfoboxEntity !== undefined && lastSelectedInfoboxEntity.id.startsWith('photo')) {
+    // Changed entities are replaced by an update, so look it up by id
+    photoEntities.select(czmlDataSource.entities.getById(lastSelectedInfoboxEntity.id));
+  }
+
+  // The div we'll put the photos in
+  const target = document.querySelector('#photoTimeline');
+  photoObserver.disconnect();
+  target.innerHTML = '';
+
+  // For each photo add a placeholder to the timeline
+  for (let entity of photoEntities.list) {
+    const img = document.createElement('img');
+    img.src = placeholderImage;
+    img.onclick = event => selectTimelinePhoto(event.target.entity);
+    img.setAttribute('id', entity.id);
+    img.setAttribute('height', '100%');
+    img.setAttribute('alt', entity.id);
+    img.setAttribute('lazysrc', entity.properties.hasProperty('thumbnail') ?
+      entity.properties.thumbnail._value : entity.properties.src._value);
+    img.entity = entity;
+    target.appendChild(img);
+    // Observe for img visibility
+    photoObserver.observe(img);
+
+    // For easy clock comparisons
+    entity.properties.julianDate = JulianDate.fromIso8601(entity.properties.time._value);
+
+    // Set the disableDepthTestDistance to a high number, but not INFINITY. The effect is that markers are not clipped
+    // at their edges, but are hidden behind terrain (mountains). Setting to INFINITY would do no depth testing at all
+    // (similar to viewer.scene.globe.depthTestAgainstTerrain = false)
+    entity.point.disableDepthTestDistance = new Cesium.ConstantProperty(100000);
+  }
+}
+
 // Load the data, filter, sort and display the photos
 const czml_path = `data/${key}/combined.czml`;
 fetch(czml_path)
   .then(response => response.json())
-  .then(czml => viewer.dataSources.add(Cesium.CzmlDataSource.load(czml)))
-  .then(() => {
-    // Get a sorted list of all photo entities
-    const allEntities = viewer.dataSources._dataSources[0].entities.values;
-    const filteredEntities = allEntities.filter(entity => entity.id.startsWith('photo'));
-    filteredEntities.sort((a, b) => { 
-      return a.properties.time._value.localeCompare(b.properties.time._value);
-    });
-    photoEntities = entityList(filteredEntities);
-
-    // The div we'll put the photos in
-    const target = document.querySelector('#photoTimeline');
-    
-    // Lazy loading for images
-    const observer = new IntersectionObserver((entries, observer) => {
-      for (let entry of entries) {
-        if (entry.isIntersecting) {
-          const img = entry.target;
-          if (img.src === placeholderImage) {
-            img.setAttribute('src', img.getAttribute('lazysrc'));
-          }
-        }
-      }
-    }, {
-      root: target, rootMargin: '0px', threshold: 0.01
-    });
-
-    // For each photo add a placeholder to the timeline
-    for (let entity of photoEntities.list) {
-      const img = document.createElement('img');
-      img.src = placeholderImage;
-      img.onclick = event => selectTimelinePhoto(event.target.entity);
-      img.setAttribute('id', entity.id);
-      img.setAttribute('height', '100%');
-      img.setAttribute('alt', entity.id);
-      img.setAttribute('lazysrc', entity.properties.src._value);
-      img.entity = entity;
-      target.appendChild(img);
-      // Observe for img visibility
-      observer.observe(img);
-
-      // For easy clock comparisons
-      entity.properties.julianDate = JulianDate.fromIso8601(entity.properties.time._value);
-
-      // Set the disableDepthTestDistance to a high number, but not INFINITY. The effect is that markers are not clipped
-      // at their edges, but are hidden behind terrain (mountains). Setting to INFINITY would do no depth testing at all
-      // (similar to viewer.scene.globe.depthTestAgainstTerrain = false)
-      entity.point.disableDepthTestDistance = new Cesium.ConstantProperty(100000);
-    }
+  .then(czml => {
+    // Written by the preprocessing in watch mode, see watchUpdates
+    loadedUpdate = czml[0]['travelmap-update'];
+    return viewer.dataSources.add(Cesium.CzmlDataSource.load(czml));
+  })
+  .then(dataSource => {
+    czmlDataSource = dataSource;
+    updatePhotoEntities();
 
     // By default, don't depth test (looking straight down),
     // because marker edges might be clipped. Also see camera.moveEnd handler.
     viewer.scene.globe.depthTestAgainstTerrain = false;
     viewer.scene.screenSpaceCameraController.enableCollisionDetection = true
 
-    // GPS tracks
-    const entities = allEntities.filter(entity => entity.id.startsWith('line_'));
-    trackEntities = entityList(entities);
-
-    // Tracking point
-    trackedEntity = allEntities.find(entity => entity.id === 'track_entity');
+    updateTrackEntities();
+    loadChunks();
+    if (loadedUpdate !== undefined) {
+      setTimeout(watchUpdates, UPDATE_INTERVAL);
+    }
   });
 
+// While the preprocessing runs in watch mode (gpx2czml.py --watch), it writes the changes to the data as
+// updates, listed in updates.json. Poll for new updates and apply them to the loaded data.
+const watchUpdates = () => {
+  fetch(`data/${key}/updates.json`, { cache: 'no-store' })
+    .then(response => response.json())
+    .then(manifest => {
+      const updates = manifest.updates.filter(update => update.sequence > loadedUpdate.sequence);
+      // The preprocessing was restarted, or older updates aren't listed anymore: reload everything
+      if (manifest.session !== loadedUpdate.session ||
+          (updates.length > 0 && updates[0].sequence !== loadedUpdate.sequence + 1)) {
+        window.location.reload();
+        return;
+      }
+      return updates.reduce((previous, update) => previous
+        .then(() => fetch(`data/${key}/${update.path}`, { cache: 'no-store' }))
+        .then(response => response.json())
+        .then(czml => {
+          // Keep the current time, the clock is reset if the update changes the clock interval
+          const currentTime = viewer.clock.currentTime.clone();
+          return czmlDataSource.process(czml).then(() => {
+            viewer.clock.currentTime = currentTime;
+            loadedUpdate.sequence = update.sequence;
+          });
+        }), Promise.resolve())
+        .then(() => {
+          if (updates.length > 0) {
+            updatePhotoEntities();
+            updateTrackEntities();
+          }
+        });
+    })
+    .catch(error => console.log('Could not apply updates', error))
+    .then(() => setTimeout(watchUpdates, UPDATE_INTERVAL));
+}
+
+// Updates the lists of track entities, after loading data
+const updateTrackEntities = () => {
+  const allEntities = czmlDataSource.entities.values;
+
+  // GPS tracks
+  const entities = allEntities.filter(entity => entity.id.startsWith('line_'));
+  entities.sort((a, b) => a.id.localeCompare(b.id, undefined, { numeric: true }));
+  trackEntities = entityList(entities);
+  if (lastSelectedInfoboxEntity !== undefined && lastSelectedInfoboxEntity.id.startsWith('line_')) {
+    trackEntities.select(czmlDataSource.entities.getById(lastSelectedInfoboxEntity.id));
+  }
+
+  // Tracking point
+  trackedEntity = czmlDataSource.entities.getById('track_entity');
+}
+
+// Large datasets can be split up in time chunks (see chunk.hours in the preprocessing config),
+// chunks.json lists the chunks. Only the chunks around the current time are loaded,
+// more chunks are loaded as the clock advances (see loadChunksForTime).
+const loadChunks = () => {
+  fetch(`data/${key}/chunks.json`)
+    .then(response => response.ok ? response.json() : { chunks: [] })
+    .catch(() => ({ chunks: [] }))
+    .then(manifest => {
+      chunks = manifest.chunks.map(chunk => ({
+        path: chunk.path,
+        start: JulianDate.fromIso8601(chunk.start),
+        stop: JulianDate.fromIso8601(chunk.stop),
+        // the polylines of a track are only in the chunk it starts in, they're needed until the track ends
+        linesStop: JulianDate.fromIso8601(chunk.lines_stop || chunk.stop),
+        loaded: undefined // promise, set when loading starts
+      }));
+      loadChunksForTime(viewer.clock.currentTime);
+    });
+}
+
+const loadChunk = chunk => {
+  if (chunk.loaded === undefined) {
+    chunk.loaded = fetch(`data/${key}/${chunk.path}`)
+      .then(response => response.json())
+      .then(czml => czmlDataSource.process(czml))
+      .then(updateTrackEntities);
+  }
+  return chunk.loaded;
+}
+
+// Loads the chunk containing the time (or the first one after it) and the chunk after that one,
+// and the earlier chunks with the polylines of tracks that haven't ended at the time
+const loadChunksForTime = time => {
+  for (let chunk of chunks) {
+    if (JulianDate.lessThan(chunk.start, time) && JulianDate.lessThan(time, chunk.linesStop)) {
+      loadChunk(chunk);
+    }
+  }
+  const index = chunks.findIndex(chunk => JulianDate.lessThan(time, chunk.stop));
+  if (index === -1) return;
+  for (let chunk of chunks.slice(index, index + 2)) {
+    loadChunk(chunk);
+  }
+}
+
 const pois_path = `data/${key}/pois.geojson`;
 fetch(pois_path)
   .then(response => response.json())
@@ -419,6 +611,7 @@ Cesium.knockout.getObservable(viewer.clockViewModel, 'shouldAnimate').subscribe(
   if (isAnimating) {
     closeInfoBox();
     viewer.scene.globe.depthTestAgainstTerrain = true;
+    if (trackedEntity === undefined) return; // not loaded (yet)
     trackedEntity._viewFrom._value = new Cartesian3(0, -2500, 2000);
     viewer.trackedEntity = trackedEntity;
   } else {
@@ -457,6 +650,7 @@ const updateToClock = () => {
   }
 }
 viewer.clock.onTick.addEventListener(throttle(updateToClock, 200));
+viewer.clock.onTick.addEventListener(throttle(() => loadChunksForTime(viewer.clock.currentTime), 500));
 viewer.clock.onTick.addEventListener(() => {
   if (viewer.clock.shouldAnimate) {
     // Setting to anything higher is really making me dizzy
@@ -61,8 +61,11 @@ module.exports = [{
                             '**/*.cfg',
                             '**/*.gpx',
                             '**/*.tcx',
+                            '**/.cache/**',
                             '**/*.mov',
                             '**/*.mp4',
+                            '**/profile.json',
+                            '**/profile/**',
                         ]
                     }
                 },
@@ -72,6 +72,9 @@ module.exports = [{
                             '**/*.cfg',
                             '**/*.gpx',
                             '**/*.tcx',
+                            '**/.cache/**',
+                            '**/profile.json',
+                            '**/profile/**',
                         ]
                     }
                 },